@@ -17,6 +17,11 @@ PRE_MEDS_PY = files(__package_name__).joinpath("pre_MEDS.py")
 PRE_MEDS_CFG = files(__package_name__).joinpath("configs/pre_MEDS_minimal.yaml")
 DATASET_CFG = files(__package_name__).joinpath("dataset.yaml")
 OMOP_CFG = files(__package_name__).joinpath("configs/OMOP.yaml")
+SYNTHETIC_CFG = files(__package_name__).joinpath("configs/synthetic.yaml")
+MICROBENCHMARKS_CFG = files(__package_name__).joinpath("configs/microbenchmarks.yaml")
+SCALING_BENCHMARK_CFG = files(__package_name__).joinpath(
+    "configs/scaling_benchmark.yaml"
+)
 
 dataset_info = OmegaConf.load(DATASET_CFG)
 premeds_cfg = OmegaConf.load(PRE_MEDS_CFG)
@@ -35,6 +40,9 @@ __all__ = [
     "MAIN_CFG",
     "RUNNER_CFG",
     "DATASET_CFG",
+    "SYNTHETIC_CFG",
+    "MICROBENCHMARKS_CFG",
+    "SCALING_BENCHMARK_CFG",
     "dataset_info",
     "__package_name__",
     "__version__",
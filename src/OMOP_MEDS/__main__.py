@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import contextlib
 import logging
 import os
 import shutil
@@ -8,15 +9,24 @@ from importlib.metadata import version
 
 import hydra
 from omegaconf import DictConfig, OmegaConf, omegaconf
+from omop_schema.utils import get_schema_loader
 
-from OMOP_MEDS.utils import finish_codes_metadata
+from OMOP_MEDS.utils import (
+    check_event_config_columns,
+    expand_event_config_for_parts,
+    finish_codes_metadata,
+    table_event_config,
+)
 from . import ETL_CFG, EVENT_CFG, MAIN_CFG
 from . import __version__ as PKG_VERSION
 from . import dataset_info
-from .commands import run_command
+from .commands import BackgroundStage, run_command, run_pipeline_in_process
 from .download import download_data
-from .pre_meds import main as pre_MEDS_transform
+from .fused_events import apply_fused_event_configs
+from .pre_meds import run as pre_MEDS_transform
 from .pre_meds_utils import rename_demo_files
+from .pre_meds_writer import read_schema_manifest
+from .stage_runner import auto_stage_runner, autotune_subjects_per_shard
 
 logger = logging.getLogger(__name__)
 
@@ -42,13 +52,19 @@ def main(cfg: DictConfig):
         logger.info("Not overwriting existing data as do_overwrite is False.")
     # Step 0: Data downloading
     if cfg.do_download:  # pragma: no cover
+        download_kwargs = {"n_workers": int(cfg.get("download_workers", 4))}
+        if cfg.get("download_to_parquet", False):
+            download_kwargs["schema_loader"] = get_schema_loader(
+                float(dataset_info.omop_version)
+            )
+            download_kwargs["delete_csv"] = cfg.get("download_delete_csv", False)
         if cfg.get("do_demo", False):
             logger.info("Downloading demo data.")
-            download_data(raw_input_dir, dataset_info, do_demo=True)
+            download_data(raw_input_dir, dataset_info, do_demo=True, **download_kwargs)
             rename_demo_files(raw_input_dir)
         else:
             logger.info("Downloading data.")
-            download_data(raw_input_dir, dataset_info)
+            download_data(raw_input_dir, dataset_info, **download_kwargs)
             rename_demo_files(raw_input_dir)
     else:  # pragma: no cover
         logger.info("Skipping data download.")
@@ -56,22 +72,82 @@ def main(cfg: DictConfig):
     if cfg.do_demo:
         rename_demo_files(raw_input_dir)
 
+    env = {
+        "DATASET_NAME": dataset_info.dataset_name,
+        "DATASET_VERSION": f"{dataset_info.raw_dataset_version}:{PKG_VERSION}:OMOP_{dataset_info.omop_version}",
+        "PRE_MEDS_DIR": str(pre_MEDS_dir.resolve()),
+        "MEDS_COHORT_DIR": str(MEDS_cohort_dir.resolve()),
+    }
+    overrides = [f"output_dir={MEDS_cohort_dir.resolve()!s}"]
+    if cfg.get("do_overwrite") is not None:
+        overrides.append(f"do_overwrite={cfg.do_overwrite}")
+    if cfg.get("seed") is not None:
+        overrides.append(f"seed={cfg.seed}")
+
     # Step 1: Pre-MEDS Data Wrangling
     event_cfg = OmegaConf.load(EVENT_CFG)
     event_cfg_new = event_cfg.copy()
-    pre_MEDS_transform(cfg)
+
+    # Optionally shard the events of every table as soon as pre-MEDS has finished it.
+    shard_events_done_fp = MEDS_cohort_dir / ".logs" / "shard_events.done"
+    background_shard_events = None
+    if cfg.get("meds_extract_overlap", False) and not shard_events_done_fp.exists():
+        background_shard_events = BackgroundStage(
+            ETL_CFG.resolve(),
+            "shard_events",
+            overrides,
+            env,
+            config_dir=pre_MEDS_dir / ".overlap",
+            n_workers=int(os.getenv("N_WORKERS", 1)),
+        )
+
+    def shard_table_events(table: str):
+        table_cfg = table_event_config(event_cfg, table, pre_MEDS_dir)
+        if table_cfg is not None:
+            background_shard_events.submit(table, table_cfg)
+
+    try:
+        pre_MEDS_transform(
+            cfg, on_table_done=shard_table_events if background_shard_events else None
+        )
+    except BaseException:
+        if background_shard_events is not None:
+            # Let running stages finish; the pre-MEDS failure is the one to report.
+            with contextlib.suppress(Exception):
+                background_shard_events.wait()
+        raise
     pre_MEDS_dir_files = [item.stem for item in pre_MEDS_dir.iterdir()]
     for item in event_cfg.keys():
         if item not in pre_MEDS_dir_files and item != "subject_id_col":
             logger.warning(f"Removing table {item} from event config.")
             event_cfg_new.pop(item)
 
-    if len(event_cfg_new.keys()) != len(event_cfg.keys()):
+    schema_manifest = read_schema_manifest(pre_MEDS_dir)
+    if schema_manifest is not None:
+        # Tables written as extracted events (pre_meds_fused_events) are read with a pass-through config.
+        event_cfg_new = apply_fused_event_configs(event_cfg_new, schema_manifest)
+
+    event_cfg_new = expand_event_config_for_parts(event_cfg_new, pre_MEDS_dir)
+    if schema_manifest is not None:
+        check_event_config_columns(event_cfg_new, schema_manifest)
+
+    if event_cfg_new != event_cfg:
         event_cfg_path = pre_MEDS_dir / "event_configs.yaml"
         with open(event_cfg_path, "w") as f:
             omegaconf.OmegaConf.save(config=event_cfg_new, f=f)
     else:
         event_cfg_path = EVENT_CFG
+    env["EVENT_CONVERSION_CONFIG_FP"] = str(Path(event_cfg_path).resolve())
+
+    if background_shard_events is not None:
+        # Tables pre-MEDS did not report (e.g. when it was already complete) are sharded now.
+        for table in event_cfg_new:
+            table = table.split("/")[0]
+            if table not in background_shard_events.submitted:
+                shard_table_events(table)
+        background_shard_events.wait()
+        shard_events_done_fp.parent.mkdir(parents=True, exist_ok=True)
+        shard_events_done_fp.touch()
 
     # Step 2: MEDS Cohort Creation
     # Ensure output directories exist before MEDS runs.
@@ -81,27 +157,52 @@ def main(cfg: DictConfig):
     # Ensure the pre-meds dir exists (should, but defensive)
     pre_MEDS_dir.mkdir(parents=True, exist_ok=True)
 
-    env = {
-        "DATASET_NAME": dataset_info.dataset_name,
-        "DATASET_VERSION": f"{dataset_info.raw_dataset_version}:{PKG_VERSION}:OMOP_{dataset_info.omop_version}",
-        "EVENT_CONVERSION_CONFIG_FP": str(Path(event_cfg_path).resolve()),
-        "PRE_MEDS_DIR": str(pre_MEDS_dir.resolve()),
-        "MEDS_COHORT_DIR": str(MEDS_cohort_dir.resolve()),
-    }
+    # Size subject shards from the events per subject unless N_SUBJECTS_PER_SHARD is set explicitly.
+    shard_target_rows = cfg.get("meds_shard_target_rows", None)
+    shard_target_mb = cfg.get("meds_shard_target_mb", None)
+    if (shard_target_rows or shard_target_mb) and "N_SUBJECTS_PER_SHARD" in os.environ:
+        logger.warning(
+            "meds_shard_target_rows/meds_shard_target_mb are ignored because N_SUBJECTS_PER_SHARD is set."
+        )
+    elif shard_target_rows or shard_target_mb:
+        env["N_SUBJECTS_PER_SHARD"] = str(
+            autotune_subjects_per_shard(
+                pre_MEDS_dir,
+                event_cfg_new,
+                target_rows=int(shard_target_rows) if shard_target_rows else None,
+                target_bytes=int(float(shard_target_mb) * 1024**2)
+                if shard_target_mb
+                else None,
+            )
+        )
+    n_subjects_per_shard = int(
+        env.get("N_SUBJECTS_PER_SHARD", os.getenv("N_SUBJECTS_PER_SHARD", 10000))
+    )
+
+    auto_workers = cfg.get("meds_extract_auto_workers", False)
+    if auto_workers and not stage_runner_fp:
+        # N_WORKERS, if set, caps the per-stage worker counts.
+        stage_runner_fp = auto_stage_runner(
+            pre_MEDS_dir,
+            [prefix for prefix in event_cfg_new if prefix != "subject_id_col"],
+            ETL_CFG.resolve(),
+            MEDS_cohort_dir / ".logs" / "stage_runner.yaml",
+            n_subjects_per_shard=n_subjects_per_shard,
+            max_workers=int(os.getenv("N_WORKERS", 0)) or None,
+        )
+    elif auto_workers:
+        logger.warning(
+            "meds_extract_auto_workers is ignored because stage_runner_fp is set."
+        )
 
     command_parts = ["MEDS_transform-pipeline", str(ETL_CFG.resolve())]
 
     if stage_runner_fp:
         command_parts.append(f"--stage_runner_fp={stage_runner_fp}")
 
-    overrides = [f"output_dir={MEDS_cohort_dir.resolve()!s}"]
-    if cfg.get("do_overwrite") is not None:
-        overrides.append(f"do_overwrite={cfg.do_overwrite}")
-    if cfg.get("seed") is not None:
-        overrides.append(f"seed={cfg.seed}")
     if cfg.get("do_profile", False):
         command_parts.append("--do_profile")
-    if int(os.getenv("N_WORKERS", 1)) > 1:
+    if int(os.getenv("N_WORKERS", 1)) > 1 and not auto_workers:
         overrides.extend(
             [
                 f"++parallelize.n_workers={os.getenv('N_WORKERS')}",
@@ -110,10 +211,35 @@ def main(cfg: DictConfig):
         )
     command_parts.extend(["--overrides", *overrides])
 
-    run_command(command_parts, env=env)
+    # Per-stage wall time and peak RSS, updated as stages finish.
+    stage_summary_fp = MEDS_cohort_dir / ".logs" / "stage_summary.json"
+    if cfg.get("meds_extract_in_process", False):
+        if cfg.get("do_profile", False):
+            logger.warning(
+                "do_profile is not supported for in-process MEDS-Extract stages."
+            )
+        run_pipeline_in_process(
+            ETL_CFG.resolve(),
+            overrides=overrides,
+            env=env,
+            n_workers=int(os.getenv("N_WORKERS", 1)),
+            stage_runner_fp=stage_runner_fp,
+            stage_summary_fp=stage_summary_fp,
+        )
+    else:
+        run_command(
+            command_parts,
+            env=env,
+            stage_log_fp=MEDS_cohort_dir / ".logs" / "pipeline.log",
+            stage_summary_fp=stage_summary_fp,
+        )
 
     # Copy codes.parquet to MEDS cohort directory
-    finish_codes_metadata(MEDS_cohort_dir, pre_MEDS_dir)
+    finish_codes_metadata(
+        MEDS_cohort_dir,
+        pre_MEDS_dir,
+        code_index_column=cfg.get("meds_code_index_column", False),
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,130 @@
+"""Compact ancestry index over the OMOP concept hierarchy of the codes present in the data."""
+
+from pathlib import Path
+
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import parquet as pq
+
+ANCESTRY_INDEX_FN = "ancestry.parquet"
+
+
+def build_ancestry_index(
+    concept_df: pl.LazyFrame, concept_ancestor_df: pl.LazyFrame, codes: pl.LazyFrame
+) -> pl.LazyFrame:
+    """Index the ``concept_ancestor`` closure of the concepts with one of ``codes`` over dense node ids.
+
+    The nodes are these concepts and all their ancestors, numbered ``0..n-1`` by ``concept_id``; each row
+    lists the ids of the node's ancestors (excluding itself), ordered by id, with their minimal levels of
+    separation. Row ``i`` describes node ``i``, so the ``ancestor_node_ids`` list column is a CSR adjacency:
+    its Arrow offsets are the row pointers and its values the column indices (see :func:`read_ancestry_csr`).
+    Codes are ``<vocabulary_id>//<concept_id>``, as in the codes metadata.
+
+    Args:
+        concept_df: The OMOP ``concept`` table.
+        concept_ancestor_df: The OMOP ``concept_ancestor`` table.
+        codes: A frame with a ``code`` column of the codes (without ``//start`` and ``//end``) in the data.
+
+    Examples:
+        >>> concept = pl.LazyFrame({"concept_id": [10, 20, 30, 40], "vocabulary_id": ["SNOMED"] * 4})
+        >>> concept_ancestor = pl.LazyFrame({
+        ...     "ancestor_concept_id": [10, 20, 10, 30, 40, 10],
+        ...     "descendant_concept_id": [10, 30, 30, 30, 40, 20],
+        ...     "min_levels_of_separation": [0, 1, 2, 0, 0, 1],
+        ... })
+        >>> build_ancestry_index(concept, concept_ancestor, pl.LazyFrame({"code": ["SNOMED//30"]})).collect()
+        shape: (3, 5)
+        ┌─────────┬────────────┬────────────┬───────────────────┬─────────────────┐
+        │ node_id ┆ concept_id ┆ code       ┆ ancestor_node_ids ┆ ancestor_levels │
+        │ ---     ┆ ---        ┆ ---        ┆ ---               ┆ ---             │
+        │ i32     ┆ i64        ┆ str        ┆ list[i32]         ┆ list[i32]       │
+        ╞═════════╪════════════╪════════════╪═══════════════════╪═════════════════╡
+        │ 0       ┆ 10         ┆ SNOMED//10 ┆ []                ┆ []              │
+        │ 1       ┆ 20         ┆ SNOMED//20 ┆ [0]               ┆ [1]             │
+        │ 2       ┆ 30         ┆ SNOMED//30 ┆ [0, 1]            ┆ [2, 1]          │
+        └─────────┴────────────┴────────────┴───────────────────┴─────────────────┘
+    """
+    concepts = concept_df.select(
+        pl.col("concept_id").cast(pl.Int64),
+        code=pl.col("vocabulary_id").cast(pl.Utf8)
+        + "//"
+        + pl.col("concept_id").cast(pl.Utf8),
+    )
+    present = concepts.join(
+        codes.select("code").unique(), on="code", how="semi"
+    ).select("concept_id")
+    edges = concept_ancestor_df.select(
+        ancestor=pl.col("ancestor_concept_id").cast(pl.Int64),
+        descendant=pl.col("descendant_concept_id").cast(pl.Int64),
+        level=pl.col("min_levels_of_separation").cast(pl.Int32),
+    ).filter(pl.col("ancestor") != pl.col("descendant"))
+
+    # concept_ancestor is transitively closed, so the ancestors of these nodes are nodes themselves.
+    nodes = (
+        pl.concat(
+            [
+                present,
+                edges.join(
+                    present, left_on="descendant", right_on="concept_id", how="semi"
+                ).select(concept_id="ancestor"),
+            ]
+        )
+        .unique()
+        .sort("concept_id")
+        .with_row_index("node_id")
+        .with_columns(pl.col("node_id").cast(pl.Int32))
+    )
+    adjacency = (
+        edges.join(
+            nodes.select(ancestor="concept_id", ancestor_node_id="node_id"),
+            on="ancestor",
+        )
+        .join(nodes.select(descendant="concept_id"), on="descendant", how="semi")
+        .sort("descendant", "ancestor_node_id")
+        .group_by("descendant", maintain_order=True)
+        .agg(
+            ancestor_node_ids=pl.col("ancestor_node_id"),
+            ancestor_levels=pl.col("level"),
+        )
+    )
+    return (
+        nodes.join(concepts, on="concept_id", how="left")
+        .join(adjacency, left_on="concept_id", right_on="descendant", how="left")
+        .sort("node_id")
+        .select(
+            "node_id",
+            "concept_id",
+            "code",
+            pl.col("ancestor_node_ids").fill_null(pl.lit([], dtype=pl.List(pl.Int32))),
+            pl.col("ancestor_levels").fill_null(pl.lit([], dtype=pl.List(pl.Int32))),
+        )
+    )
+
+
+def read_ancestry_csr(index_fp: Path) -> tuple[pa.Array, pa.Array]:
+    """Read the ancestor adjacency of an ancestry index as CSR row pointers and column indices.
+
+    The ancestors of node ``i`` are ``indices[indptr[i]:indptr[i + 1]]``.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     fp = Path(tmpdir) / ANCESTRY_INDEX_FN
+        ...     pl.DataFrame(
+        ...         {"ancestor_node_ids": [[], [0], [0, 1]]}, schema={"ancestor_node_ids": pl.List(pl.Int32)}
+        ...     ).write_parquet(fp)
+        ...     indptr, indices = read_ancestry_csr(fp)
+        >>> indptr.to_pylist(), indices.to_pylist()
+        ([0, 0, 1, 3], [0, 0, 1])
+    """
+    ancestors = (
+        pq.read_table(index_fp, columns=["ancestor_node_ids"])
+        .column("ancestor_node_ids")
+        .combine_chunks()
+    )
+    offsets = ancestors.offsets
+    start = offsets[0].as_py()
+    indptr = pc.subtract(offsets, start)
+    indices = ancestors.values.slice(start, offsets[-1].as_py() - start)
+    return indptr, indices
@@ -1,19 +1,262 @@
+import json
 import logging
 import os
+import re
 import subprocess
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
 
-from omegaconf import DictConfig
+from omegaconf import DictConfig, OmegaConf
 
 logger = logging.getLogger(__name__)
 
 
+STAGE_START_RE = re.compile(r"Running stage:? (\w+)")
+STAGE_SKIP_RE = re.compile(r"Skipping stage (\w+)")
+
+
+def _rss_pages(pid: int) -> int:
+    try:
+        return int((Path("/proc") / str(pid) / "statm").read_text().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def _child_pids(pid: int) -> list[int] | None:
+    """The child pids of ``pid`` from ``/proc/<pid>/task/*/children``, or ``None`` if the kernel lacks them."""
+    task_dirs = list((Path("/proc") / str(pid) / "task").glob("*"))
+    children = []
+    for task_dir in task_dirs:
+        try:
+            children.extend(int(c) for c in (task_dir / "children").read_text().split())
+        except FileNotFoundError:
+            if not task_dir.is_dir():
+                continue  # The thread exited.
+            return None
+        except OSError:
+            continue
+    return children
+
+
+def _scan_process_tree(pid: int) -> list[int]:
+    """All pids below ``pid`` from the parent pid of every process on the machine."""
+    children: dict[int, list[int]] = {}
+    for stat_fp in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat_fp.read_text().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat_fp.parent.name))
+
+    pids, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        pids.append(current)
+        stack.extend(children.get(current, []))
+    return pids
+
+
+def process_tree_rss(pid: int) -> int | None:
+    """Return the summed resident set size in bytes of ``pid`` and all its descendants.
+
+    This reads ``/proc`` and returns ``None`` where it is unavailable (e.g. on macOS) or ``pid`` has exited. Only
+    the monitored tree is walked, through ``/proc/<pid>/task/*/children``; kernels without those files fall back to
+    reading the parent pid of every process.
+
+    Examples:
+        >>> rss = process_tree_rss(os.getpid())
+        >>> rss is None or rss > 0
+        True
+    """
+    if not (Path("/proc") / str(pid)).is_dir():
+        return None
+
+    pids, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        children = _child_pids(current)
+        if children is None:
+            pids = _scan_process_tree(pid)
+            break
+        pids.append(current)
+        stack.extend(children)
+    return sum(_rss_pages(p) for p in pids) * os.sysconf("SC_PAGE_SIZE")
+
+
+class StageMonitor:
+    """Track the wall time and peak RSS of pipeline stages while they run.
+
+    Stages are delimited by explicit :meth:`start_stage` calls or by ``Running stage: <name>`` lines passed to
+    :meth:`feed` (as logged by the MEDS-Transforms runner); a stage ends when the next one starts or the monitor
+    stops. While running, a background thread samples the RSS of the process tree rooted at ``pid``, follows
+    ``log_fp`` for stage markers, and the summary is rewritten to ``summary_fp`` whenever a stage ends.
+
+    Examples:
+        >>> with StageMonitor() as monitor:
+        ...     monitor.feed("INFO - Running stage: shard_events")
+        ...     monitor.feed("INFO - Skipping stage split_and_shard_subjects as it is already complete.")
+        ...     monitor.feed("INFO - Running stage: convert_to_MEDS_events")
+        >>> [(s["stage"], s["status"]) for s in monitor.summary()]
+        [('shard_events', 'completed'), ('split_and_shard_subjects', 'skipped'), ('convert_to_MEDS_events', 'completed')]
+    """
+
+    def __init__(
+        self,
+        summary_fp: Path | None = None,
+        pid: int | None = None,
+        log_fp: Path | None = None,
+        poll_interval: float = 1.0,
+    ):
+        self.summary_fp = Path(summary_fp) if summary_fp else None
+        self.pid = pid
+        self.log_fp = Path(log_fp) if log_fp else None
+        self.poll_interval = poll_interval
+        self._stages: list[dict] = []
+        self._current: dict | None = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._log_offset = 0
+
+    def __enter__(self) -> "StageMonitor":
+        if self.log_fp is not None and self.log_fp.is_file():
+            # Only stages of this run; a resumed pipeline appends to the same log.
+            self._log_offset = self.log_fp.stat().st_size
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._follow_log()
+        with self._lock:
+            self._end_current("failed" if exc_type is not None else "completed")
+        self.write()
+
+    def feed(self, line: str):
+        """Parse one output or log line for stage markers."""
+        if match := STAGE_START_RE.search(line):
+            self.start_stage(match.group(1))
+        elif match := STAGE_SKIP_RE.search(line):
+            self.skip_stage(match.group(1))
+
+    def skip_stage(self, stage: str):
+        """Record that ``stage`` was skipped (e.g. already complete), ending the currently running one."""
+        with self._lock:
+            self._end_current("completed")
+            self._stages.append(
+                {
+                    "stage": stage,
+                    "status": "skipped",
+                    "wall_time_s": 0.0,
+                    "peak_rss_bytes": None,
+                }
+            )
+
+    def start_stage(self, stage: str):
+        """Mark the start of ``stage``, ending the currently running one."""
+        with self._lock:
+            if self._current is not None and self._current["stage"] == stage:
+                return
+            self._end_current("completed")
+            self._current = {
+                "stage": stage,
+                "start": time.monotonic(),
+                "peak_rss": None,
+            }
+            logger.info(f"Stage {stage} started")
+        self._sample_rss()
+
+    def summary(self) -> list[dict]:
+        """Per-stage wall time (seconds) and peak RSS (bytes, ``None`` if unavailable), in run order."""
+        with self._lock:
+            stages = list(self._stages)
+            if self._current is not None:
+                stages.append(self._as_record(self._current, "running"))
+        return stages
+
+    def write(self):
+        """Write the current summary to ``summary_fp`` as JSON."""
+        if self.summary_fp is None:
+            return
+        self.summary_fp.parent.mkdir(parents=True, exist_ok=True)
+        self.summary_fp.write_text(
+            json.dumps(self.summary(), indent=2), encoding="utf-8"
+        )
+
+    def _as_record(self, current: dict, status: str) -> dict:
+        return {
+            "stage": current["stage"],
+            "status": status,
+            "wall_time_s": round(time.monotonic() - current["start"], 3),
+            "peak_rss_bytes": current["peak_rss"],
+        }
+
+    def _end_current(self, status: str):
+        if self._current is None:
+            return
+        record = self._as_record(self._current, status)
+        self._stages.append(record)
+        self._current = None
+        rss = record["peak_rss_bytes"]
+        rss_str = f"{rss / 1024**2:.0f} MB" if rss is not None else "n/a"
+        logger.info(
+            f"Stage {record['stage']} {status} in {record['wall_time_s']:.1f}s (peak RSS {rss_str})"
+        )
+        self.write()
+
+    def _sample_rss(self):
+        if self.pid is None:
+            return
+        rss = process_tree_rss(self.pid)
+        with self._lock:
+            if rss is not None and self._current is not None:
+                peak = self._current["peak_rss"]
+                self._current["peak_rss"] = rss if peak is None else max(peak, rss)
+
+    def _follow_log(self):
+        if self.log_fp is None or not self.log_fp.is_file():
+            return
+        with open(self.log_fp, encoding="utf-8", errors="replace") as f:
+            f.seek(self._log_offset)
+            while line := f.readline():
+                if not line.endswith("\n"):
+                    break
+                self._log_offset += len(line.encode("utf-8", errors="replace"))
+                self.feed(line)
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            self._follow_log()
+            self._sample_rss()
+
+
 def run_command(
     command_parts: list[str],
     cfg: DictConfig | dict | None = None,
-    runner_fn: callable = subprocess.run,
+    runner_fn: callable = subprocess.Popen,
     env: dict[str, str] | None = None,
+    stage_log_fp: Path | None = None,
+    stage_summary_fp: Path | None = None,
+    tail_lines: int = 200,
 ):
-    """Run a command without shell interpolation."""
+    """Run a command without shell interpolation, streaming its output to the logger line by line.
+
+    stdout and stderr are merged and logged as they arrive; only the last ``tail_lines`` lines are kept in
+    memory for the error message, so memory stays bounded however long the command runs. Stage markers in the
+    output or in ``stage_log_fp`` are tracked by a :class:`StageMonitor`, whose per-stage wall time and peak RSS
+    summary is written to ``stage_summary_fp``.
+
+    Raises:
+        ValueError: If the command exits with a non-zero return code.
+    """
     if cfg is not None:
         do_overwrite = cfg.get("do_overwrite", None)
         do_profile = cfg.get("do_profile", False)
@@ -28,21 +271,265 @@ def run_command(
             command_parts.append("--do_profile")
 
     logger.info("Running command: %s", command_parts)
-    command_out = runner_fn(
-        command_parts, capture_output=True, env={**os.environ, **(env or {})}
+    tail: deque[str] = deque(maxlen=tail_lines)
+    process = runner_fn(
+        command_parts,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        env={**os.environ, **(env or {})},
+        text=True,
+        bufsize=1,
     )
+    with StageMonitor(
+        stage_summary_fp, pid=process.pid, log_fp=stage_log_fp
+    ) as monitor:
+        for line in process.stdout:
+            line = line.rstrip("\n")
+            logger.info("%s", line)
+            tail.append(line)
+            monitor.feed(line)
+        returncode = process.wait()
+
+        if returncode != 0:
+            output = "\n".join(tail)
+            raise ValueError(
+                f"Command failed with return code {returncode}.\n"
+                f"output (last {len(tail)} lines):\n{output}"
+            )
+
+
+@contextmanager
+def _patched_environ(env: dict[str, str] | None) -> Iterator[None]:
+    """Temporarily set environment variables, restoring the previous values afterwards."""
+    env = env or {}
+    previous = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for k, v in previous.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+@contextmanager
+def _isolated_hydra() -> Iterator[None]:
+    """Initialize a fresh hydra context, even when called from within a running ``@hydra.main`` app."""
+    from hydra import initialize
+    from hydra.core.global_hydra import GlobalHydra
+
+    global_hydra = GlobalHydra.instance()
+    outer = global_hydra.hydra if global_hydra.is_initialized() else None
+    global_hydra.clear()
+    try:
+        with initialize(version_base=None):
+            yield
+    finally:
+        global_hydra.clear()
+        if outer is not None:
+            global_hydra.initialize(outer)
+
+
+def _compose_stage_cfgs(
+    pipeline_config_fp: str, stage_name: str, overrides: list[str], n_workers: int
+):
+    """Compose the config of every worker of one MEDS-Transforms stage, as ``MEDS_transform-stage`` would."""
+    from hydra import compose
+    from hydra.core.config_store import ConfigStore
+    from MEDS_transforms import __package_name__ as meds_pkg_name
+    from MEDS_transforms import __version__ as meds_version
+    from MEDS_transforms.__main__ import MAIN_CFG_PATH
+    from MEDS_transforms.configs import PipelineConfig
+
+    pipeline_cfg = PipelineConfig.from_arg(pipeline_config_fp)
+    stage = pipeline_cfg.register_for(stage_name)
+    ConfigStore.instance().store(name="_main", node=OmegaConf.load(MAIN_CFG_PATH))
+
+    resolvers = {
+        "get_package_version": lambda: meds_version,
+        "get_package_name": lambda: meds_pkg_name,
+        "stage_name": lambda: stage_name,
+        "stage_docstring": lambda: stage.stage_docstring.replace("$", "$$"),
+    }
+    for name, resolver in resolvers.items():
+        OmegaConf.register_new_resolver(name, resolver, replace=True)
+
+    with _isolated_hydra():
+        cfgs = [
+            compose(
+                config_name="_main",
+                overrides=[f"stage={stage_name}", *overrides, f"worker={worker}"],
+            )
+            for worker in range(n_workers)
+        ]
+    return stage, cfgs
+
+
+def run_pipeline_in_process(
+    pipeline_config_fp: str | Path,
+    overrides: list[str] | None = None,
+    env: dict[str, str] | None = None,
+    n_workers: int = 1,
+    stage_runner_fp: str | Path | None = None,
+    stage_summary_fp: Path | None = None,
+):
+    """Run the stages of a MEDS-Transforms pipeline in this process instead of via ``MEDS_transform-pipeline``.
 
-    stderr = command_out.stderr.decode()
-    stdout = command_out.stdout.decode()
+    This mirrors ``MEDS_transforms.runner.main``: stages run in order, each is skipped if its ``.done`` file
+    exists in ``<output_dir>/.logs``, and the same ``overrides`` and environment are applied. Instead of one
+    interpreter (and hydra, polars, and config loading) per stage and worker, stage workers run as threads of
+    the calling process; MEDS-Transforms coordinates them through the same shard lock files either way.
 
-    logger.info("Command stdout:\n%s", stdout)
-    if stderr:
-        logger.warning("Command stderr:\n%s", stderr)
+    Args:
+        pipeline_config_fp: The pipeline configuration, e.g. ``ETL.yaml``.
+        overrides: Config overrides in dotlist format; must include ``output_dir``.
+        env: Environment variables set while the pipeline runs (e.g. those the pipeline config reads via
+            ``oc.env``).
+        n_workers: The default number of workers per stage.
+        stage_runner_fp: An optional stage runner YAML file; its (per-stage) ``parallelize.n_workers`` take
+            precedence over ``n_workers``.
+        stage_summary_fp: Where to write the per-stage wall time and peak RSS summary (see :class:`StageMonitor`).
 
-    if command_out.returncode != 0:
-        raise ValueError(
-            "Command failed with return code "
-            f"{command_out.returncode}.\n"
-            f"stdout:\n{stdout}\n"
-            f"stderr:\n{stderr}"
+    Raises:
+        ValueError: If ``output_dir`` is not given or the pipeline has no stages.
+    """
+    from MEDS_transforms.configs import PipelineConfig
+    from MEDS_transforms.runner import load_yaml_file
+
+    pipeline_config_fp = str(pipeline_config_fp)
+    overrides = [
+        o for o in (overrides or []) if not o.lstrip("+").startswith("parallelize.")
+    ]
+
+    with _patched_environ(env):
+        pipeline_cfg = PipelineConfig.from_arg(pipeline_config_fp, overrides)
+        params = pipeline_cfg.additional_params or {}
+        if "output_dir" not in params:
+            raise ValueError(
+                "Pipeline configuration or override must specify an 'output_dir'"
+            )
+        stages = [s.name for s in pipeline_cfg.parsed_stages]
+        if not stages:
+            raise ValueError("Pipeline configuration must specify at least one stage.")
+
+        log_dir = Path(params["output_dir"]) / ".logs"
+        log_dir.mkdir(parents=True, exist_ok=True)
+        global_done_fp = log_dir / "_all_stages.done"
+        if global_done_fp.exists():
+            logger.info("All stages are already complete.")
+            return
+
+        stage_runners_cfg = load_yaml_file(
+            str(stage_runner_fp) if stage_runner_fp else None
+        )
+        default_n_workers = stage_runners_cfg.get("parallelize", {}).get(
+            "n_workers", n_workers
         )
+
+        with StageMonitor(stage_summary_fp, pid=os.getpid()) as monitor:
+            for stage_name in stages:
+                done_fp = log_dir / f"{stage_name}.done"
+                if done_fp.exists():
+                    logger.info(
+                        f"Skipping stage {stage_name} as it is already complete."
+                    )
+                    monitor.skip_stage(stage_name)
+                    continue
+
+                stage_n_workers = int(
+                    stage_runners_cfg.get(stage_name, {})
+                    .get("parallelize", {})
+                    .get("n_workers", default_n_workers)
+                )
+                logger.info(
+                    f"Running stage {stage_name} in-process with {stage_n_workers} worker(s)"
+                )
+                monitor.start_stage(stage_name)
+                stage, cfgs = _compose_stage_cfgs(
+                    pipeline_config_fp, stage_name, overrides, stage_n_workers
+                )
+                if len(cfgs) == 1:
+                    stage.main(cfgs[0])
+                else:
+                    with ThreadPoolExecutor(max_workers=len(cfgs)) as executor:
+                        for future in [
+                            executor.submit(stage.main, cfg) for cfg in cfgs
+                        ]:
+                            future.result()
+                done_fp.touch()
+
+        global_done_fp.touch()
+
+
+class BackgroundStage:
+    """Run one MEDS-Transforms stage per input table in the background, while later tables are still produced.
+
+    Each :meth:`submit` saves the table's event conversion config to ``config_dir`` and runs the stage on it
+    with ``MEDS_transform-stage`` on a pool of ``n_workers`` threads, one subprocess per table. Stages that
+    key their outputs by input prefix (``shard_events``) thereby write the same outputs as a single run over
+    all tables. Failures are raised by :meth:`wait`.
+
+    Args:
+        pipeline_config_fp: The pipeline configuration, e.g. ``ETL.yaml``.
+        stage_name: The stage to run.
+        overrides: Config overrides in dotlist format, as passed to the pipeline.
+        env: Environment variables for the stage (e.g. those the pipeline config reads via ``oc.env``);
+            ``EVENT_CONVERSION_CONFIG_FP`` is set per table.
+        config_dir: Where the per-table event conversion configs are written.
+        n_workers: How many tables are processed at once.
+    """
+
+    def __init__(
+        self,
+        pipeline_config_fp: str | Path,
+        stage_name: str,
+        overrides: list[str],
+        env: dict[str, str],
+        config_dir: Path,
+        n_workers: int = 1,
+    ):
+        self.pipeline_config_fp = str(pipeline_config_fp)
+        self.stage_name = stage_name
+        self.overrides = [
+            o for o in overrides if not o.lstrip("+").startswith("parallelize.")
+        ]
+        self.env = env
+        self.config_dir = Path(config_dir)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, n_workers))
+        self._futures = {}
+
+    @property
+    def submitted(self) -> set[str]:
+        """The tables submitted so far."""
+        return set(self._futures)
+
+    def submit(self, table: str, event_cfg: DictConfig):
+        """Run the stage for ``table`` with the event conversion config ``event_cfg``, once per table."""
+        if table in self._futures:
+            return
+        self.config_dir.mkdir(parents=True, exist_ok=True)
+        event_cfg_fp = (self.config_dir / f"{table}.yaml").resolve()
+        OmegaConf.save(config=event_cfg, f=event_cfg_fp)
+        command_parts = [
+            "MEDS_transform-stage",
+            self.pipeline_config_fp,
+            self.stage_name,
+            f"stage={self.stage_name}",
+            *self.overrides,
+        ]
+        logger.info(f"Starting {self.stage_name} for {table} in the background.")
+        self._futures[table] = self._executor.submit(
+            run_command,
+            command_parts,
+            env={**self.env, "EVENT_CONVERSION_CONFIG_FP": str(event_cfg_fp)},
+        )
+
+    def wait(self):
+        """Wait for all submitted tables, raising the first failure."""
+        try:
+            for future in self._futures.values():
+                future.result()
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
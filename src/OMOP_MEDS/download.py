@@ -1,21 +1,71 @@
+import contextlib
+import hashlib
+import json
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urljoin, urlparse
 
+import polars as pl
 import requests
 from bs4 import BeautifulSoup
 from omegaconf import DictConfig
+from omop_schema.schema.base import OMOPSchemaBase
+from omop_schema.utils import pyarrow_to_polars_schema
+
+from .mirror import DownloadMirror
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 1024 * 1024
+# ETags of the downloaded files and the files renamed after downloading (e.g. the demo's 2b_ prefix), keyed by
+# their path relative to the download directory.
+DOWNLOAD_MANIFEST_FN = ".downloads.json"
+
+
+def read_download_manifest(output_dir: Path) -> dict[str, dict[str, str]]:
+    """The ``etags`` and ``renamed`` records of the downloads into ``output_dir``."""
+    manifest_fp = Path(output_dir) / DOWNLOAD_MANIFEST_FN
+    manifest = json.loads(manifest_fp.read_text()) if manifest_fp.is_file() else {}
+    return {"etags": manifest.get("etags", {}), "renamed": manifest.get("renamed", {})}
+
+
+def write_download_manifest(output_dir: Path, manifest: dict[str, dict[str, str]]):
+    manifest_fp = Path(output_dir) / DOWNLOAD_MANIFEST_FN
+    manifest_fp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def rename_downloaded_file(output_dir: Path, file_path: Path, new_path: Path):
+    """Rename a downloaded file, recording it so a later download finds it (see :func:`download_files`).
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     fp = Path(tmpdir) / "2b_death.csv"
+        ...     _ = fp.write_text("person_id")
+        ...     rename_downloaded_file(Path(tmpdir), fp, Path(tmpdir) / "death.csv")
+        ...     sorted(p.name for p in Path(tmpdir).iterdir()), read_download_manifest(Path(tmpdir))["renamed"]
+        (['.downloads.json', 'death.csv'], {'2b_death.csv': 'death.csv'})
+    """
+    file_path.rename(new_path)
+    manifest = read_download_manifest(output_dir)
+    manifest["renamed"][file_path.relative_to(output_dir).as_posix()] = (
+        new_path.relative_to(output_dir).as_posix()
+    )
+    write_download_manifest(output_dir, manifest)
+
 
 class MockResponse:  # pragma: no cover
     """A mock requests.Response objects for tests."""
 
-    def __init__(self, status_code: int, contents: str = ""):
+    def __init__(
+        self, status_code: int, contents: str = "", headers: dict | None = None
+    ):
         self.status_code = status_code
         self.contents = contents.encode()
+        self.headers = headers or {}
 
     def iter_content(self, chunk_size):
         return [
@@ -28,12 +78,16 @@ class MockResponse:  # pragma: no cover
         return self.contents.decode()
 
     def raise_for_status(self):
-        if self.status_code != 200:
+        if self.status_code >= 400:
             raise requests.exceptions.HTTPError(self.status_code)
 
 
 class MockSession:  # pragma: no cover
-    """A mock requests.Session objects for tests."""
+    """A mock requests.Session objects for tests.
+
+    Responses carry a ``Content-Length`` header and honour ``Range: bytes=<start>-`` request headers with a
+    ``206`` partial response, like a static file server.
+    """
 
     def __init__(
         self,
@@ -47,7 +101,7 @@ class MockSession:  # pragma: no cover
         self.headers = {}
         self.auth = None
 
-    def get(self, url: str, stream: bool = False):
+    def get(self, url: str, stream: bool = False, headers: dict | None = None):
         if self.expect_url is not None and url != self.expect_url:
             raise ValueError(f"Expected URL {self.expect_url}, got {url}")
         if isinstance(self.return_status, dict):
@@ -62,21 +116,97 @@ class MockSession:  # pragma: no cover
                 contents = self.return_contents[url]
             else:
                 status = 404
+                contents = ""
         else:
             contents = self.return_contents
-        return MockResponse(status_code=status, contents=contents)
+        range_header = (headers or {}).get("Range")
+        if status == 200 and range_header:
+            contents = contents[int(range_header.removeprefix("bytes=").rstrip("-")) :]
+            status = 206
+        return MockResponse(
+            status_code=status,
+            contents=contents,
+            headers={"Content-Length": str(len(contents.encode()))},
+        )
+
+    def head(self, url: str, allow_redirects: bool = False):
+        response = self.get(url)
+        response.contents = b""
+        return response
 
 
-def download_file(url: str, output_dir: Path, session: requests.Session):
-    """Download a single file.
+def file_sha256(fp: Path) -> str:
+    """The hex SHA-256 digest of a file.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.NamedTemporaryFile() as f:
+        ...     _ = f.write(b"hello world"); f.flush()
+        ...     file_sha256(Path(f.name))[:16]
+        'b94d27b9934d3e08'
+    """
+    digest = hashlib.sha256()
+    with open(fp, "rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_sha256sums(text: str, base_url: str) -> dict[str, str]:
+    """Parse a ``sha256sum``-style checksum file (e.g. PhysioNet's ``SHA256SUMS.txt``) into digests by URL.
+
+    Paths in the file are relative to ``base_url``, the directory the checksum file is in.
+
+    Examples:
+        >>> text = "ab12  1_omop_data_csv/person.csv\\ncd34 *LICENSE.txt\\n\\n"
+        >>> parse_sha256sums(text, "https://physionet.org/files/demo/0.9/")
+        {'https://physionet.org/files/demo/0.9/1_omop_data_csv/person.csv': 'ab12', 'https://physionet.org/files/demo/0.9/LICENSE.txt': 'cd34'}
+    """
+    checksums = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        digest, path = line.split(maxsplit=1)
+        checksums[urljoin(base_url, path.strip().lstrip("*"))] = digest.lower()
+    return checksums
+
+
+def fetch_sha256sums(url: str, session: requests.Session) -> dict[str, str]:
+    """Download and parse a checksum file; files are not verified (with a warning) if it cannot be fetched."""
+    try:
+        response = session.get(url)
+        response.raise_for_status()
+    except Exception as e:
+        logger.warning(f"Could not fetch checksums from {url}, not verifying: {e}")
+        return {}
+    return parse_sha256sums(response.text, urljoin(url, "."))
+
+
+def download_file(
+    url: str,
+    output_dir: Path,
+    session: requests.Session,
+    sha256: str | None = None,
+    known_etag: str | None = None,
+) -> str | None:
+    """Download a single file, resuming a partial download and skipping it if it is already complete.
+
+    The file is streamed to a hidden ``.<name>.part`` file, which a later call resumes with an HTTP ``Range``
+    request, and renamed once complete (and verified against ``sha256``, if given). An existing file is kept if
+    it matches ``sha256`` or, without a checksum, if a ``HEAD`` request reports its size or ``known_etag``.
 
     Args:
         url: The URL to download.
         output_dir: The directory to download the file to.
         session: The requests session to use for downloading.
+        sha256: The expected hex SHA-256 digest of the file, if known.
+        known_etag: The ETag the existing file was downloaded with, if known.
+
+    Returns:
+        The file's ETag, if the server reported one.
 
     Raises:
-        Various requests exceptions if the download fails.
+        ValueError: If the download fails or the file does not match ``sha256``.
 
     Examples:
         >>> import tempfile
@@ -101,10 +231,40 @@ def download_file(url: str, output_dir: Path, session: requests.Session):
         Traceback (most recent call last):
             ...
         ValueError: Failed to download http://example.com
+
+    A partial download is resumed from where it stopped:
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     _ = (Path(tmpdir) / ".foo.csv.part").write_text("1,2")
+        ...     download_file(url, Path(tmpdir), mock_session)
+        ...     sorted(p.name for p in Path(tmpdir).iterdir()), (Path(tmpdir) / "foo.csv").read_text()
+        (['foo.csv'], '1,2,3')
+
+    A download that does not match its checksum is discarded:
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     download_file(url, Path(tmpdir), mock_session, sha256="0" * 64)
+        Traceback (most recent call last):
+            ...
+        ValueError: Checksum mismatch for http://example.com/foo.csv
     """
+    parsed_url = urlparse(url)
+    filename = os.path.basename(parsed_url.path) or "index.html"
+    file_path = Path(output_dir) / filename
+    part_path = file_path.with_name(f".{filename}.part")
+
+    if file_path.exists() and _is_complete(url, file_path, session, sha256, known_etag):
+        logger.info(f"Already downloaded: {file_path}")
+        return known_etag
+
+    offset = part_path.stat().st_size if part_path.exists() else 0
     try:
-        response = session.get(url, stream=True)
-        if response.status_code != 200:
+        response = session.get(
+            url, stream=True, headers={"Range": f"bytes={offset}-"} if offset else {}
+        )
+        if response.status_code == 416:
+            # The partial file is not a prefix of the current file; start over.
+            offset = 0
+            response = session.get(url, stream=True, headers={})
+        if response.status_code not in (200, 206):
             logger.error(
                 f"Failed to download {url} in streaming download_file get: {response.status_code}"
             )
@@ -112,26 +272,282 @@ def download_file(url: str, output_dir: Path, session: requests.Session):
     except Exception as e:
         raise ValueError(f"Failed to download {url}") from e
 
-    parsed_url = urlparse(url)
-    filename = os.path.basename(parsed_url.path) or "index.html"
-    file_path = Path(output_dir) / filename
-
-    with open(file_path, "wb") as file:
-        for chunk in response.iter_content(chunk_size=8192):
+    if response.status_code != 206:
+        offset = 0
+    with open(part_path, "ab" if offset else "wb") as file:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
             file.write(chunk)
-    logger.info(f"Downloaded: {file_path}")
+
+    if sha256 is not None and file_sha256(part_path) != sha256.lower():
+        part_path.unlink()
+        raise ValueError(f"Checksum mismatch for {url}")
+    part_path.replace(file_path)
+    logger.info(
+        f"Downloaded: {file_path}" + (f" (resumed at byte {offset})" if offset else "")
+    )
+    return response.headers.get("ETag")
+
+
+def _is_complete(
+    url: str,
+    file_path: Path,
+    session: requests.Session,
+    sha256: str | None,
+    known_etag: str | None,
+) -> bool:
+    """Whether an existing download matches its checksum or, without one, the server's ETag or size."""
+    if sha256 is not None:
+        return file_sha256(file_path) == sha256.lower()
+    try:
+        response = session.head(url, allow_redirects=True)
+        response.raise_for_status()
+    except Exception:
+        return False
+    etag = response.headers.get("ETag")
+    if etag is not None and known_etag is not None:
+        return etag == known_etag
+    size = response.headers.get("Content-Length")
+    return size is not None and int(size) == file_path.stat().st_size
 
 
-def crawl_and_download(base_url: str, output_dir: Path, session: requests.Session):
+def omop_table_name(fp: Path, table_names: list[str]) -> str | None:
+    """The OMOP table a downloaded file holds, allowing for a prefix such as the demo's ``2b_``.
+
+    Examples:
+        >>> tables = ["person", "concept", "concept_relationship", "relationship"]
+        >>> omop_table_name(Path("person.csv"), tables)
+        'person'
+        >>> omop_table_name(Path("2b_concept_relationship.csv.gz"), tables)
+        'concept_relationship'
+        >>> omop_table_name(Path("LICENSE.txt"), tables) is None
+        True
+    """
+    stem = fp.name.split(".")[0]
+    matches = [t for t in table_names if stem == t or stem.endswith(f"_{t}")]
+    return max(matches, key=len) if matches else None
+
+
+def parquet_path(fp: Path) -> Path:
+    """Where :func:`convert_to_parquet` writes the parquet version of a downloaded CSV file."""
+    return fp.with_name(f"{fp.name.split('.')[0]}.parquet")
+
+
+def convert_to_parquet(
+    fp: Path, schema_loader: OMOPSchemaBase, delete_csv: bool = False
+) -> Path | None:
+    """Convert a downloaded OMOP CSV table to parquet, typed by the OMOP schema as ``load_raw_file`` reads it.
+
+    The parquet file is written next to the CSV file, under a temporary name until complete.
+
+    Returns:
+        The parquet file, or ``None`` if ``fp`` is not a CSV file of an OMOP table.
+
+    Examples:
+        >>> import tempfile
+        >>> from omop_schema.utils import get_schema_loader
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     fp = Path(tmpdir) / "death.csv"
+        ...     _ = fp.write_text("person_id,death_date\\n1,2020-01-02\\n")
+        ...     out_fp = convert_to_parquet(fp, get_schema_loader(5.3), delete_csv=True)
+        ...     print(out_fp.name, fp.exists(), pl.read_parquet(out_fp).schema)
+        death.parquet False Schema({'person_id': Int64, 'death_date': Date})
+    """
+    if not fp.name.endswith((".csv", ".csv.gz")):
+        return None
+    table_name = omop_table_name(fp, schema_loader.get_table_names())
+    if table_name is None:
+        return None
+    schema = pyarrow_to_polars_schema(schema_loader.get_pyarrow_schema(table_name))
+    out_fp = parquet_path(fp)
+    tmp_fp = out_fp.with_name(f".{out_fp.name}.part")
+    pl.scan_csv(
+        fp,
+        infer_schema=False,
+        has_header=True,
+        schema_overrides=schema,
+    ).sink_parquet(tmp_fp)
+    tmp_fp.replace(out_fp)
+    if delete_csv:
+        fp.unlink()
+    logger.info(f"Converted {fp} to {out_fp}")
+    return out_fp
+
+
+class ParquetConverter:
+    """Convert downloaded OMOP CSV tables to parquet (see :func:`convert_to_parquet`) on a background worker.
+
+    Files are converted as their downloads complete, while the remaining files are still downloading.
+    Failures are raised by :meth:`wait`.
+    """
+
+    def __init__(
+        self,
+        schema_loader: OMOPSchemaBase,
+        delete_csv: bool = False,
+        n_workers: int = 1,
+    ):
+        self.schema_loader = schema_loader
+        self.delete_csv = delete_csv
+        self._executor = ThreadPoolExecutor(max_workers=max(1, n_workers))
+        self._futures = []
+
+    def is_converted(self, fp: Path) -> bool:
+        """Whether ``fp`` was converted before, so its download can be skipped."""
+        return (
+            parquet_path(fp).is_file()
+            and omop_table_name(fp, self.schema_loader.get_table_names()) is not None
+        )
+
+    def submit(self, fp: Path):
+        self._futures.append(
+            self._executor.submit(
+                convert_to_parquet, fp, self.schema_loader, self.delete_csv
+            )
+        )
+
+    def wait(self):
+        """Wait for all submitted conversions, raising the first failure."""
+        try:
+            for future in self._futures:
+                future.result()
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def list_files(
+    base_url: str, output_dir: Path, session: requests.Session
+) -> list[tuple[str, Path]]:
+    """Recursively crawl directory listings for the files below ``base_url``.
+
+    Returns:
+        The URL of every file and the directory it is downloaded to, mirroring the URL structure below
+        ``base_url`` in ``output_dir``. A ``base_url`` that is not a directory (no trailing ``/``) is a file.
+    """
+    if not base_url.endswith("/"):
+        return [(base_url, Path(output_dir))]
+
+    try:
+        response = session.get(base_url)
+        if response.status_code != 200:
+            logger.error(
+                f"Failed to download {base_url} in initial get: {response.status_code}"
+            )
+        response.raise_for_status()
+    except requests.exceptions.HTTPError as e:
+        raise ValueError(f"Failed to download data from {base_url}") from e
+
+    files = []
+    soup = BeautifulSoup(response.text, "html.parser")
+    for link in soup.find_all("a", href=True):
+        href = link["href"]
+        full_url = urljoin(base_url, href)
+        if not full_url.startswith(base_url):
+            continue
+
+        if full_url.endswith("/"):  # It's a directory
+            subdir = Path(output_dir) / href.strip("/")
+            files.extend(list_files(full_url, subdir, session))
+        else:
+            filepath = Path(output_dir) / full_url.replace(base_url, "")
+            files.append((full_url, filepath.parent))
+    return files
+
+
+def download_files(
+    files: list[tuple[str, Path]],
+    output_dir: Path,
+    session: requests.Session,
+    n_workers: int = 1,
+    checksums: dict[str, str] | None = None,
+    converter: ParquetConverter | None = None,
+    mirror: DownloadMirror | None = None,
+):
+    """Download files concurrently with :func:`download_file` on a pool of ``n_workers`` threads.
+
+    The threads share ``session``, and so its connection pool. The ETags of the downloads are recorded in
+    ``output_dir/.downloads.json`` so that later runs can skip unchanged files; a file renamed since (see
+    :func:`rename_downloaded_file`) is moved back to its downloaded name, with its parquet conversion, to be
+    checked like any other and renamed again by the caller. With a ``converter``, each
+    completed file is handed to it, and files it converted before are not downloaded again. With a ``mirror``,
+    files it holds are linked from it instead of downloaded, and downloaded files are added to it.
+
+    Raises:
+        ValueError: If a download fails, once the other downloads have finished.
+    """
+    checksums = checksums or {}
+    manifest = read_download_manifest(output_dir)
+    etags, renamed = manifest["etags"], manifest["renamed"]
+    lock = threading.Lock()
+
+    def download(url: str, file_dir: Path):
+        file_dir.mkdir(parents=True, exist_ok=True)
+        file_path = file_dir / (os.path.basename(urlparse(url).path) or "index.html")
+        key = file_path.relative_to(output_dir)
+        for fp in [file_path, parquet_path(file_path)]:
+            new_path = renamed.pop(fp.relative_to(output_dir).as_posix(), None)
+            if new_path is not None and not fp.exists():
+                with contextlib.suppress(FileNotFoundError):
+                    (Path(output_dir) / new_path).rename(fp)
+        if converter is not None and converter.is_converted(file_path):
+            logger.info(f"Already converted: {file_path}")
+            return
+        mirrored = mirror.lookup(url, checksums.get(url)) if mirror else None
+        if mirrored is not None:
+            obj, etag = mirrored
+            mirror.link(obj, file_path)
+        else:
+            etag = download_file(
+                url,
+                file_dir,
+                session,
+                sha256=checksums.get(url),
+                known_etag=etags.get(key.as_posix()),
+            )
+            if mirror is not None:
+                sha256 = checksums.get(url) or file_sha256(file_path)
+                mirror.add(url, file_path, sha256, etag)
+        if etag is not None:
+            with lock:
+                etags[key.as_posix()] = etag
+        if converter is not None:
+            converter.submit(file_path)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, n_workers)) as executor:
+            futures = [executor.submit(download, url, d) for url, d in files]
+        for future in futures:
+            future.result()
+    finally:
+        if etags or renamed:
+            write_download_manifest(output_dir, manifest)
+
+
+def crawl_and_download(
+    base_url: str,
+    output_dir: Path,
+    session: requests.Session,
+    n_workers: int = 1,
+    checksums: dict[str, str] | None = None,
+    converter: ParquetConverter | None = None,
+    mirror: DownloadMirror | None = None,
+):
     """Recursively crawl and download files.
 
+    The directory listings are crawled first (see :func:`list_files`), then the files are downloaded with
+    :func:`download_files`. If ``mirror`` holds every file of an earlier crawl of ``base_url``, they are
+    linked from it without crawling.
+
     Args:
         base_url: The base URL to crawl.
         output_dir: The directory to download the files to.
         session: The requests session to use for downloading.
+        n_workers: How many files are downloaded at once.
+        checksums: Expected SHA-256 digests by URL (see :func:`parse_sha256sums`).
+        converter: Converts the downloaded tables to parquet as they complete.
+        mirror: The shared download mirror (see :class:`~OMOP_MEDS.mirror.DownloadMirror`).
 
     Raises:
-        Various requests exceptions if downloads fail.
+        ValueError: If a listing or download fails.
 
     Examples:
         >>> import tempfile
@@ -164,36 +580,12 @@ def crawl_and_download(base_url: str, output_dir: Path, session: requests.Sessio
         ...     assert (tmpdir / "bar" / "qux.csv").read_text() == "10,11,12", "bar/qux.csv check"
         ...     assert (tmpdir / "bur" / "wor.csv").read_text() == "13,14,15", "bur/wor.csv check"
     """
-
-    if not base_url.endswith("/"):
-        download_file(base_url, output_dir, session)
-
-    try:
-        response = session.get(base_url)
-        if response.status_code != 200:
-            logger.error(
-                f"Failed to download {base_url} in initial get: {response.status_code}"
-            )
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        raise ValueError(f"Failed to download data from {base_url}") from e
-
-    soup = BeautifulSoup(response.text, "html.parser")
-    for link in soup.find_all("a", href=True):
-        href = link["href"]
-        full_url = urljoin(base_url, href)
-        if not full_url.startswith(base_url):
-            continue
-
-        if full_url.endswith("/"):  # It's a directory
-            subdir = Path(output_dir) / href.strip("/")
-            subdir.mkdir(parents=True, exist_ok=True)
-            crawl_and_download(full_url, subdir, session)
-        else:
-            filepath = output_dir / full_url.replace(base_url, "")
-            subdir = filepath.parent
-            subdir.mkdir(parents=True, exist_ok=True)
-            download_file(full_url, subdir, session)
+    files = mirror.listing(base_url, output_dir) if mirror else None
+    if files is None:
+        files = list_files(base_url, output_dir, session)
+    download_files(files, output_dir, session, n_workers, checksums, converter, mirror)
+    if mirror is not None:
+        mirror.record_listing(base_url, files, output_dir)
 
 
 def download_data(
@@ -201,14 +593,27 @@ def download_data(
     dataset_info: DictConfig,
     do_demo: bool = False,
     session_factory: callable = requests.Session,
+    n_workers: int = 4,
+    schema_loader: OMOPSchemaBase | None = None,
+    delete_csv: bool = False,
 ):
     """Downloads the data specified in dataset_info.dataset_urls to the output_dir.
 
+    URLs are given as strings or as mappings with a ``url`` and optionally a ``username`` and ``password`` and
+    a ``sha256sums`` URL of a checksum file (e.g. PhysioNet's ``SHA256SUMS.txt``) to verify the files against.
+    Files already downloaded are skipped and partial downloads resumed (see :func:`download_file`). If
+    ``dataset_info.download_mirror`` is set, files are linked from and added to that shared
+    :class:`~OMOP_MEDS.mirror.DownloadMirror` directory.
+
     Args:
         output_dir: The directory to download the data to.
         dataset_info: The dataset information containing the URLs to download.
         do_demo: If True, download the demo URLs instead of the main URLs.
         session_factory: A callable that returns a requests.Session object (for testing).
+        n_workers: How many files are downloaded at once, over one pooled session per URL.
+        schema_loader: If given, every downloaded OMOP CSV table is converted to typed parquet with this
+            schema, on a background worker while the other files download (see :class:`ParquetConverter`).
+        delete_csv: Whether to delete the CSV files once converted.
 
     Raises:
         ValueError: If the command fails
@@ -290,19 +695,63 @@ def download_data(
 
     urls += dataset_info.urls.get("common", [])
 
-    for url in urls:
-        session = session_factory()
+    mirror = None
+    if dataset_info.get("download_mirror", None):
+        mirror = DownloadMirror(Path(dataset_info.download_mirror))
+        logger.info(f"Using the download mirror at {mirror.root}")
+    converter = None
+    if schema_loader is not None:
+        converter = ParquetConverter(schema_loader, delete_csv=delete_csv)
+    try:
+        for url in urls:
+            _download_url(
+                url, output_dir, session_factory, n_workers, converter, mirror
+            )
+    except BaseException:
+        if converter is not None:
+            with contextlib.suppress(Exception):
+                converter.wait()
+        raise
+    if converter is not None:
+        converter.wait()
+
 
-        if isinstance(url, (dict, DictConfig)):
-            username = url.get("username", None)
-            password = url.get("password", None)
+def _download_url(
+    url: str | DictConfig,
+    output_dir: Path,
+    session_factory: callable,
+    n_workers: int,
+    converter: ParquetConverter | None,
+    mirror: DownloadMirror | None = None,
+):
+    """Download one entry of ``dataset_info.urls`` with its own session (see :func:`download_data`)."""
+    session = session_factory()
+    if isinstance(session, requests.Session):
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=n_workers, pool_maxsize=n_workers
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+    checksums = {}
+    if isinstance(url, (dict, DictConfig)):
+        username = url.get("username", None)
+        password = url.get("password", None)
+        if username is not None:
             logger.info(f"Authenticating for {username}")
             session.auth = (username, password)
             session.headers.update({"User-Agent": "Wget/1.21.1 (linux-gnu)"})
+        # Mirrored files were verified when they were added.
+        if url.get("sha256sums", None) and not (
+            mirror and mirror.listing(url.url, output_dir)
+        ):
+            checksums = fetch_sha256sums(url.sha256sums, session)
 
-            url = url.url
+        url = url.url
 
-        try:
-            crawl_and_download(url, output_dir, session)
-        except ValueError as e:
-            raise ValueError(f"Failed to download data from {url}") from e
+    try:
+        crawl_and_download(
+            url, output_dir, session, n_workers, checksums, converter, mirror
+        )
+    except ValueError as e:
+        raise ValueError(f"Failed to download data from {url}") from e
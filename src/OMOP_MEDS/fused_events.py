@@ -0,0 +1,207 @@
+"""Evaluates the MEDS-Extract event configuration during pre-MEDS (fused mode).
+
+In fused mode pre-MEDS writes, instead of the wide table, the MEDS events of every configured event of the table
+with one ``code__<event>`` column per event that is only set on that event's rows. The event configuration handed
+to MEDS-Extract is then rewritten to a pass-through configuration over these columns (see
+:func:`fused_event_config`), so the final MEDS data, including ``source_block`` and ``code_components``, is the same
+as without fusing.
+"""
+
+from collections.abc import Mapping
+
+import polars as pl
+from dftly import Parser
+from MEDS_extract.convert_to_MEDS_events.convert_to_MEDS_events import extract_event
+from MEDS_extract.dftly_bridge import EVENT_META_KEYS
+from omegaconf import DictConfig, OmegaConf
+
+CODE_COMPONENTS_COL = "code_components"
+
+
+def code_col(event_name: str) -> str:
+    """The column holding the codes of ``event_name`` in a fused table.
+
+    Examples:
+        >>> code_col("visit_end")
+        'code__visit_end'
+    """
+    return f"code__{event_name}"
+
+
+def event_names(table_cfg: Mapping) -> list[str]:
+    """The names of the events configured for a table."""
+    return [
+        name
+        for name, event_cfg in table_cfg.items()
+        if name not in EVENT_META_KEYS and isinstance(event_cfg, Mapping)
+    ]
+
+
+def can_fuse(table_cfg: Mapping | None) -> bool:
+    """Whether a table's events can be extracted in pre-MEDS.
+
+    Tables with table-level settings (``subject_id_col``, ``transforms``, ...) are left to MEDS-Extract, as are
+    tables whose codes are all literals, since their pass-through events would gain ``code_components``.
+
+    Examples:
+        >>> can_fuse({"e": {"code": 'f"A//{$c}"', "time": "$t"}, "d": {"code": "MEDS_DEATH", "time": "$t"}})
+        True
+        >>> can_fuse({"d": {"code": "MEDS_DEATH", "time": "$t"}})
+        False
+        >>> can_fuse({"subject_id_col": "mrn", "e": {"code": "$c", "time": None}})
+        False
+        >>> can_fuse(None)
+        False
+    """
+    if not table_cfg or any(key in EVENT_META_KEYS for key in table_cfg):
+        return False
+    return any(
+        Parser()(str(table_cfg[name]["code"])).referenced_columns
+        for name in event_names(table_cfg)
+    )
+
+
+def fuse_events(lf: pl.LazyFrame, table_cfg: Mapping, subject_col: str) -> pl.LazyFrame:
+    """Extract the MEDS events of a table as MEDS-Extract's ``convert_to_MEDS_events`` stage would.
+
+    Args:
+        lf: The pre-MEDS table.
+        table_cfg: The table's entry of the event conversion config.
+        subject_col: The subject id column of ``lf``, which is kept under its name.
+
+    Returns:
+        The events of all configured events of the table, with the codes of event ``e`` in :func:`code_col`.
+
+    Examples:
+        >>> from datetime import datetime
+        >>> lf = pl.LazyFrame({
+        ...     "person_id": [1, 2],
+        ...     "concept": ["A", None],
+        ...     "start": [datetime(2020, 1, 1), datetime(2020, 1, 2)],
+        ...     "end": [datetime(2020, 1, 3), None],
+        ... })
+        >>> table_cfg = {
+        ...     "start": {"code": 'f"{$concept}//start"', "time": "$start"},
+        ...     "end": {"code": 'f"{$concept}//end"', "time": "$end"},
+        ... }
+        >>> fuse_events(lf, table_cfg, "person_id").collect()
+        shape: (3, 5)
+        ┌───────────┬─────────────┬─────────────────┬─────────────────────┬───────────┐
+        │ person_id ┆ code__start ┆ code_components ┆ time                ┆ code__end │
+        │ ---       ┆ ---         ┆ ---             ┆ ---                 ┆ ---       │
+        │ i64       ┆ str         ┆ struct[1]       ┆ datetime[μs]        ┆ str       │
+        ╞═══════════╪═════════════╪═════════════════╪═════════════════════╪═══════════╡
+        │ 1         ┆ A//start    ┆ {"A"}           ┆ 2020-01-01 00:00:00 ┆ null      │
+        │ 2         ┆ UNK//start  ┆ {null}          ┆ 2020-01-02 00:00:00 ┆ null      │
+        │ 1         ┆ null        ┆ {"A"}           ┆ 2020-01-03 00:00:00 ┆ A//end    │
+        └───────────┴─────────────┴─────────────────┴─────────────────────┴───────────┘
+    """
+    if subject_col != "subject_id":
+        lf = lf.rename({subject_col: "subject_id"})
+    frames = []
+    for name in event_names(table_cfg):
+        event_cfg = table_cfg[name]
+        if OmegaConf.is_config(event_cfg):
+            event_cfg = OmegaConf.to_container(event_cfg)
+        frames.append(
+            extract_event(lf, dict(event_cfg)).rename({"code": code_col(name)})
+        )
+    events = pl.concat(frames, how="diagonal_relaxed")
+    if subject_col != "subject_id":
+        events = events.rename({"subject_id": subject_col})
+    return events
+
+
+def fused_event_config(table_cfg: Mapping) -> DictConfig:
+    """The pass-through event config that reads a table written by :func:`fuse_events`.
+
+    Each event keeps its name, so MEDS-Extract assigns the same ``source_block``, and reads its code from its own
+    code column, so it only yields that event's rows. Static events keep a null time. The precomputed
+    ``code_components`` replace the ones MEDS-Extract would derive from the code column.
+
+    Examples:
+        >>> print(OmegaConf.to_yaml(fused_event_config({
+        ...     "race": {"code": 'f"RACE//{$race_concept_id}"', "time": None, "table_name": "$table_name"},
+        ...     "visit": {"code": 'f"{$c}//start"', "time": "$start", "numeric_value": "$v"},
+        ... })))
+        race:
+          code: $code__race
+          time: null
+          table_name: $table_name
+          code_components: $code_components
+        visit:
+          code: $code__visit
+          time: $time
+          numeric_value: $numeric_value
+          code_components: $code_components
+        <BLANKLINE>
+    """
+    fused_cfg = {}
+    for name in event_names(table_cfg):
+        event_cfg = table_cfg[name]
+        fused_cfg[name] = {
+            "code": f"${code_col(name)}",
+            "time": None if event_cfg.get("time") is None else "$time",
+            **{key: f"${key}" for key in event_cfg if key not in ("code", "time")},
+            CODE_COMPONENTS_COL: f"${CODE_COMPONENTS_COL}",
+        }
+    return OmegaConf.create(fused_cfg)
+
+
+def is_fused_output(columns: Mapping | list[str], table_cfg: Mapping) -> bool:
+    """Whether a pre-MEDS output with ``columns`` was written by :func:`fuse_events` for ``table_cfg``.
+
+    Examples:
+        >>> is_fused_output({"person_id": "Int64", "code__visit": "String"}, {"visit": {"code": "$c"}})
+        True
+        >>> is_fused_output(["person_id", "c"], {"visit": {"code": "$c"}})
+        False
+    """
+    names = event_names(table_cfg)
+    return bool(names) and all(code_col(name) in columns for name in names)
+
+
+def apply_fused_event_configs(
+    event_cfg: DictConfig, schema_manifest: Mapping
+) -> DictConfig:
+    """Replace the config of every table that pre-MEDS wrote as fused events by :func:`fused_event_config`.
+
+    Fused tables are recognized from their output columns in the pre-MEDS schema manifest, so a resumed or
+    partially fused pre-MEDS directory is handled table by table.
+
+    Examples:
+        >>> cfg = OmegaConf.create({
+        ...     "subject_id_col": "person_id",
+        ...     "a": {"e": {"code": "$c", "time": None}},
+        ...     "b": {"e": {"code": "$c", "time": None}},
+        ... })
+        >>> manifest = {
+        ...     "a/part_00000": {"columns": {"person_id": "Int64", "code__e": "String"}},
+        ...     "b": {"columns": {"person_id": "Int64", "c": "String"}},
+        ... }
+        >>> print(OmegaConf.to_yaml(apply_fused_event_configs(cfg, manifest)))
+        subject_id_col: person_id
+        a:
+          e:
+            code: $code__e
+            time: null
+            code_components: $code_components
+        b:
+          e:
+            code: $c
+            time: null
+        <BLANKLINE>
+    """
+    fused_cfg = event_cfg.copy()
+    for prefix, table_cfg in event_cfg.items():
+        if not isinstance(table_cfg, Mapping):
+            continue
+        columns = {
+            col
+            for key, entry in schema_manifest.items()
+            if key == prefix or key.startswith(f"{prefix}/")
+            for col in entry["columns"]
+        }
+        if is_fused_output(columns, table_cfg):
+            fused_cfg[prefix] = fused_event_config(table_cfg)
+    return fused_cfg
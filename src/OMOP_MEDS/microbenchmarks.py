@@ -0,0 +1,560 @@
+"""Microbenchmarks of the pre-MEDS hot functions on synthetic fixtures: throughput and peak memory as JSON."""
+
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import hydra
+import numpy as np
+import polars as pl
+from omegaconf import DictConfig, OmegaConf
+from omop_schema.utils import get_schema_loader
+
+from . import MICROBENCHMARKS_CFG
+from . import __version__ as PKG_VERSION
+from .pre_meds_data_loader import ShardedTableDataLoader, load_raw_file
+from .pre_meds_utils import (
+    build_preferred_event_datetime,
+    determine_concept_id,
+    extract_nlp_features,
+    get_patient_link,
+    join_concept,
+)
+from .synthetic import note_corpus
+
+logger = logging.getLogger(__name__)
+
+# The fixture parameters and the values used for those a grid does not set.
+DEFAULT_GRID = {
+    "rows": [100_000],
+    "reference_cols": [1, 2],
+    "concept_size": [10_000],
+    "datetime_kind": ["string", "native"],
+    "prefer_source": [False, True],
+    "note_length_mean": [1_000],
+    "file_format": ["csv", "parquet"],
+    "shards": [8],
+}
+SEED = 0
+
+
+def _datetimes(
+    rng: np.random.Generator, n: int, kind: str, null_fraction: float = 0.0
+) -> pl.Series:
+    """Whole-second datetimes in 2010-2020, as ``%Y-%m-%d %H:%M:%S`` strings if ``kind`` is ``"string"``."""
+    start = int(datetime(2010, 1, 1).timestamp())
+    seconds = rng.integers(start, start + 10 * 365 * 86_400, n)
+    times = pl.Series(seconds * 1_000_000).cast(pl.Datetime("us"))
+    if null_fraction:
+        times = pl.select(
+            pl.when(pl.Series(rng.random(n) >= null_fraction)).then(times)
+        ).to_series()
+    return times.dt.strftime("%Y-%m-%d %H:%M:%S") if kind == "string" else times
+
+
+def _dates(times: pl.Series, kind: str) -> pl.Series:
+    if kind == "string":
+        return times.str.slice(0, 10)
+    return times.dt.date()
+
+
+def _concepts(rng: np.random.Generator, size: int) -> pl.LazyFrame:
+    return pl.LazyFrame(
+        {
+            "concept_id": np.arange(1, size + 1),
+            "vocabulary_id": rng.choice(["SNOMED", "LOINC", "RxNorm", "ICD10CM"], size),
+            "concept_code": pl.int_range(1, size + 1, eager=True).cast(pl.Utf8),
+        }
+    )
+
+
+def _persons(n_persons: int) -> pl.LazyFrame:
+    return pl.LazyFrame({"person_id": np.arange(1, n_persons + 1)})
+
+
+def _concept_ids(rng: np.random.Generator, n: int, size: int) -> np.ndarray:
+    """Concept ids of ``1..size``, with 10% zeros (no matching concept)."""
+    return np.where(rng.random(n) < 0.1, 0, rng.integers(1, size + 1, n))
+
+
+def setup_join_concept(params: dict, work_dir: Path) -> Callable[[], None]:
+    """:func:`join_concept` of a measurement table with ``reference_cols`` concept columns."""
+    rng = np.random.default_rng(SEED)
+    n, n_persons = params["rows"], max(1, params["rows"] // 50)
+    reference_cols = ["measurement_concept_id", "measurement_source_concept_id"] + [
+        f"measurement_ref{i}_concept_id" for i in range(params["reference_cols"] - 2)
+    ]
+    reference_cols = reference_cols[: params["reference_cols"]]
+    df = pl.LazyFrame(
+        {
+            "person_id": rng.integers(1, n_persons + 1, n),
+            **{
+                col: _concept_ids(rng, n, params["concept_size"])
+                for col in reference_cols
+            },
+            "measurement_datetime": _datetimes(rng, n, "native"),
+            "value_as_number": rng.normal(100.0, 30.0, n),
+        }
+    )
+    concept_df = _concepts(rng, params["concept_size"])
+    person_df = _persons(n_persons)
+    fn = join_concept(
+        "measurement",
+        reference_cols,
+        ["measurement_datetime", "value_as_number", *reference_cols],
+        ["vocabulary_id", "concept_code"],
+    )
+    return lambda: fn(df, concept_df, person_df).collect()
+
+
+def setup_determine_concept_id(params: dict, work_dir: Path) -> Callable[[], None]:
+    """:func:`determine_concept_id` over mapped and source concept columns with 10% nulls each."""
+    rng = np.random.default_rng(SEED)
+    n = params["rows"]
+
+    def codes() -> pl.Series:
+        codes = pl.Series(rng.integers(1, 100_000, n)).cast(pl.Utf8)
+        return pl.select(
+            pl.when(pl.Series(rng.random(n) >= 0.1)).then(codes)
+        ).to_series()
+
+    df = pl.LazyFrame(
+        {
+            "measurement_concept_id": rng.integers(1, 100_000, n),
+            "concept_code": codes(),
+            "vocabulary_id": rng.choice(["SNOMED", "LOINC"], n),
+            "concept_code_source": codes(),
+            "vocabulary_id_source": rng.choice(["ICD10CM", "LOINC"], n),
+        }
+    )
+    return lambda: determine_concept_id(
+        df,
+        ["measurement_concept_id"],
+        "concept_code",
+        "vocabulary_id",
+        "concept_code_source",
+        "vocabulary_id_source",
+        prefer_source=params["prefer_source"],
+    ).collect()
+
+
+def setup_build_preferred_event_datetime(
+    params: dict, work_dir: Path
+) -> Callable[[], None]:
+    """:func:`build_preferred_event_datetime` of a note date/datetime pair and a last-edit override pair."""
+    rng = np.random.default_rng(SEED)
+    n, kind = params["rows"], params["datetime_kind"]
+    note_datetime = _datetimes(rng, n, kind, null_fraction=0.2)
+    edit_datetime = _datetimes(rng, n, kind, null_fraction=0.5)
+    df = pl.LazyFrame(
+        {
+            "note_date": _dates(_datetimes(rng, n, kind), kind),
+            "note_datetime": note_datetime,
+            "xtn_note_last_edit_date": _dates(_datetimes(rng, n, kind), kind),
+            "xtn_note_last_edit_datetime": edit_datetime,
+        }
+    )
+    expr = build_preferred_event_datetime(
+        df.collect_schema(),
+        primary_datetime_col="note_datetime",
+        primary_date_col="note_date",
+        override_datetime_col="xtn_note_last_edit_datetime",
+        override_date_col="xtn_note_last_edit_date",
+    )
+    return lambda: df.select(expr).collect()
+
+
+def setup_get_patient_link(params: dict, work_dir: Path) -> Callable[[], None]:
+    """:func:`get_patient_link` of ``rows`` persons with three visits each and 5% deaths."""
+    rng = np.random.default_rng(SEED)
+    n, kind = params["rows"], params["datetime_kind"]
+    person_id = np.arange(1, n + 1)
+    births = pl.Series(rng.integers(1930, 2005, n))
+    gender = rng.choice([8507, 8532], n)
+    person_df = pl.LazyFrame(
+        {
+            "person_id": person_id,
+            "gender_concept_id": gender,
+            "year_of_birth": births,
+            "month_of_birth": rng.integers(1, 13, n),
+            "day_of_birth": rng.integers(1, 29, n),
+            "birth_datetime": _datetimes(rng, n, kind, null_fraction=0.3),
+            "gender_source_concept_id": gender,
+        }
+    )
+    died = person_id[rng.random(n) < 0.05]
+    death_datetime = _datetimes(rng, len(died), kind)
+    death_df = pl.LazyFrame(
+        {
+            "person_id": died,
+            "death_date": _dates(death_datetime, kind),
+            "death_datetime": death_datetime,
+        }
+    )
+    visit_df = pl.LazyFrame({"person_id": np.repeat(person_id, 3)})
+    schema_loader = get_schema_loader(5.3)
+    return lambda: get_patient_link(
+        person_df, death_df, visit_df, schema_loader
+    ).collect()
+
+
+def setup_extract_nlp_features(params: dict, work_dir: Path) -> Callable[[], None]:
+    """:func:`extract_nlp_features` (all features) of notes with log-normal lengths around ``note_length_mean``."""
+    rng = np.random.default_rng(SEED)
+    n, n_persons = params["rows"], max(1, params["rows"] // 5)
+    corpus = note_corpus(rng)
+    lengths = np.clip(
+        rng.lognormal(np.log(params["note_length_mean"]) - 0.5, 1.0, n), 1, len(corpus)
+    ).astype(np.int64)
+    offsets = (rng.random(n) * (len(corpus) - lengths)).astype(np.int64)
+    df = pl.LazyFrame(
+        {
+            "person_id": rng.integers(1, n_persons + 1, n),
+            "note_date": _dates(_datetimes(rng, n, "native"), "native"),
+            "note_text": pl.select(
+                pl.lit(corpus).str.slice(pl.Series(offsets), pl.Series(lengths))
+            ).to_series(),
+        }
+    )
+    fn = extract_nlp_features("note", "note_text", output_data_cols=["note_date"])
+    person_df = _persons(n_persons)
+    return lambda: fn(df, person_df).collect()
+
+
+def _measurement_fixture(rng: np.random.Generator, n: int) -> pl.DataFrame:
+    datetimes = _datetimes(rng, n, "native")
+    return pl.DataFrame(
+        {
+            "measurement_id": np.arange(1, n + 1),
+            "person_id": rng.integers(1, max(2, n // 50), n),
+            "measurement_concept_id": _concept_ids(rng, n, 10_000),
+            "measurement_date": datetimes.dt.date(),
+            "measurement_datetime": datetimes,
+            "measurement_type_concept_id": rng.integers(1, 20, n),
+            "value_as_number": rng.normal(100.0, 30.0, n),
+            "unit_concept_id": rng.integers(1, 50, n),
+            "visit_occurrence_id": rng.integers(1, max(2, n // 10), n),
+            "measurement_source_value": pl.Series(rng.integers(1, 10_000, n)).cast(
+                pl.Utf8
+            ),
+        }
+    )
+
+
+def setup_load_raw_file(params: dict, work_dir: Path) -> Callable[[], None]:
+    """:func:`load_raw_file` of a measurement ``csv`` or ``parquet`` file."""
+    df = _measurement_fixture(np.random.default_rng(SEED), params["rows"])
+    fp = work_dir / f"measurement.{params['file_format']}"
+    if params["file_format"] == "csv":
+        df.write_csv(fp, datetime_format="%Y-%m-%d %H:%M:%S")
+    else:
+        df.write_parquet(fp)
+    schema_loader = get_schema_loader(5.3)
+    return lambda: load_raw_file(fp, schema_loader).collect()
+
+
+def setup_iter_table_batches(params: dict, work_dir: Path) -> Callable[[], None]:
+    """``ShardedTableDataLoader.iter_table_batches`` of a measurement table in ``shards`` parquet files."""
+    df = _measurement_fixture(np.random.default_rng(SEED), params["rows"])
+    table_dir = work_dir / "measurement"
+    table_dir.mkdir()
+    n_shards = params["shards"]
+    for i, shard in enumerate(df.iter_slices(-(-df.height // n_shards))):
+        shard.write_parquet(table_dir / f"{i:06d}.parquet")
+    loader = ShardedTableDataLoader(
+        get_schema_loader(5.3),
+        chunked_tables=["measurement"],
+        batching_row_threshold=0,
+        batch_mode="per_shard",
+    )
+
+    def run():
+        for batch in loader.iter_table_batches("measurement", table_dir):
+            batch.collect()
+
+    return run
+
+
+# Each benchmark: its setup, which returns the function to time, and the fixture parameters it depends on.
+BENCHMARKS: dict[
+    str, tuple[Callable[[dict, Path], Callable[[], None]], tuple[str, ...]]
+] = {
+    "join_concept": (setup_join_concept, ("rows", "reference_cols", "concept_size")),
+    "determine_concept_id": (setup_determine_concept_id, ("rows", "prefer_source")),
+    "build_preferred_event_datetime": (
+        setup_build_preferred_event_datetime,
+        ("rows", "datetime_kind"),
+    ),
+    "get_patient_link": (setup_get_patient_link, ("rows", "datetime_kind")),
+    "extract_nlp_features": (setup_extract_nlp_features, ("rows", "note_length_mean")),
+    "load_raw_file": (setup_load_raw_file, ("rows", "file_format")),
+    "iter_table_batches": (setup_iter_table_batches, ("rows", "shards")),
+}
+
+
+def benchmark_cases(
+    grid: dict | None = None, benchmarks: list[str] | None = None
+) -> list[tuple[str, dict]]:
+    """The (benchmark, parameters) cases: each benchmark over the product of the grid values it depends on.
+
+    Examples:
+        >>> cases = benchmark_cases({"rows": [10, 100], "prefer_source": [True]}, ["determine_concept_id"])
+        >>> cases
+        [('determine_concept_id', {'rows': 10, 'prefer_source': True}), ('determine_concept_id', {'rows': 100, 'prefer_source': True})]
+        >>> benchmark_cases(benchmarks=["nope"])
+        Traceback (most recent call last):
+            ...
+        ValueError: Unknown benchmarks ['nope']; expected some of ['join_concept', 'determine_concept_id', 'build_preferred_event_datetime', 'get_patient_link', 'extract_nlp_features', 'load_raw_file', 'iter_table_batches']
+    """
+    grid = {**DEFAULT_GRID, **(grid or {})}
+    benchmarks = list(BENCHMARKS) if benchmarks is None else list(benchmarks)
+    if unknown := [b for b in benchmarks if b not in BENCHMARKS]:
+        raise ValueError(
+            f"Unknown benchmarks {unknown}; expected some of {list(BENCHMARKS)}"
+        )
+    cases = []
+    for name in benchmarks:
+        keys = BENCHMARKS[name][1]
+        for values in itertools.product(*(grid[key] for key in keys)):
+            cases.append((name, dict(zip(keys, values))))
+    return cases
+
+
+def _proc_status_bytes(field: str) -> int | None:
+    """A memory field (e.g. ``VmRSS``, ``VmHWM``) of ``/proc/self/status`` in bytes, or ``None`` off Linux."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the peak RSS (``VmHWM``) of this process, where Linux allows it."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss() -> int:
+    peak = _proc_status_bytes("VmHWM")
+    if peak is not None:
+        return peak
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def run_benchmark(name: str, params: dict, repeats: int = 3) -> dict:
+    """Time a benchmark case and measure the peak memory of this process while it runs.
+
+    The fixture is set up first and the function run once to warm up, untimed. The peak RSS is that of the
+    timed runs where it can be reset (Linux), and otherwise that of the whole process so far; run each case in
+    a fresh process (see :func:`run_microbenchmarks`) so it is not inflated by earlier cases.
+
+    Examples:
+        >>> result = run_benchmark("determine_concept_id", {"rows": 1000, "prefer_source": False}, repeats=2)
+        >>> sorted(result)  # doctest: +NORMALIZE_WHITESPACE
+        ['benchmark', 'max_s', 'median_s', 'min_s', 'params', 'peak_rss_bytes', 'peak_rss_delta_bytes',
+         'peak_rss_reset', 'repeats', 'rows', 'rows_per_s']
+        >>> result["rows"], result["repeats"], result["min_s"] <= result["median_s"] <= result["max_s"]
+        (1000, 2, True)
+    """
+    setup = BENCHMARKS[name][0]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fn = setup(params, Path(tmpdir))
+        fn()
+        rss_before = _proc_status_bytes("VmRSS")
+        peak_reset = _reset_peak_rss()
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        peak = _peak_rss()
+    median = statistics.median(times)
+    return {
+        "benchmark": name,
+        "params": params,
+        "rows": params["rows"],
+        "repeats": repeats,
+        "min_s": min(times),
+        "median_s": median,
+        "max_s": max(times),
+        "rows_per_s": params["rows"] / median if median > 0 else None,
+        "peak_rss_bytes": peak,
+        "peak_rss_delta_bytes": peak - rss_before
+        if peak_reset and rss_before is not None
+        else None,
+        "peak_rss_reset": peak_reset,
+    }
+
+
+def _git_commit() -> dict:
+    """The commit of the source tree and whether it has uncommitted changes (``None`` outside a git checkout)."""
+    cwd = Path(__file__).parent
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": bool(status.strip())}
+
+
+def environment_info() -> dict:
+    """The commit, package versions and machine of a benchmark run, stored with its results."""
+    return {
+        **_git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "package_version": PKG_VERSION,
+        "python": platform.python_version(),
+        "polars": pl.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "polars_threads": pl.thread_pool_size(),
+    }
+
+
+def run_microbenchmarks(
+    grid: dict | None = None,
+    benchmarks: list[str] | None = None,
+    repeats: int = 3,
+    isolate: bool = True,
+) -> dict:
+    """Run the benchmark cases (see :func:`benchmark_cases`) and collect their results.
+
+    Args:
+        grid: Values of the fixture parameters, overriding ``DEFAULT_GRID``.
+        benchmarks: The benchmarks to run (default: all of ``BENCHMARKS``).
+        repeats: The timed runs per case.
+        isolate: Run every case in a fresh process, so its peak memory is its own.
+
+    Returns:
+        The run's :func:`environment_info` with a ``results`` list of :func:`run_benchmark` results.
+    """
+    info = environment_info()
+    results = []
+    cases = benchmark_cases(grid, benchmarks)
+    for i, (name, params) in enumerate(cases):
+        if isolate:
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                result = executor.submit(run_benchmark, name, params, repeats).result()
+        else:
+            result = run_benchmark(name, params, repeats)
+        logger.info(
+            f"[{i + 1}/{len(cases)}] {name} {params}: {result['median_s']:.4f}s, "
+            f"peak RSS {result['peak_rss_bytes'] / 1024**2:.0f} MB"
+        )
+        results.append(result)
+    return {**info, "results": results}
+
+
+def results_table(results: dict, baseline: dict | None = None) -> pl.DataFrame:
+    """The results of a run as a table, with the median time and peak RSS relative to a ``baseline`` run.
+
+    Examples:
+        >>> run = {"results": [{"benchmark": "b", "params": {"rows": 10}, "rows": 10, "median_s": 1.0,
+        ...                     "rows_per_s": 10.0, "peak_rss_bytes": 2 * 1024**2, "peak_rss_delta_bytes": None}]}
+        >>> base = {"results": [{**run["results"][0], "median_s": 2.0}]}
+        >>> results_table(run, base).row(0, named=True)  # doctest: +NORMALIZE_WHITESPACE
+        {'benchmark': 'b', 'params': 'rows=10', 'median_s': 1.0, 'rows_per_s': 10.0, 'peak_rss_mb': 2.0,
+         'peak_rss_delta_mb': None, 'speedup': 2.0, 'peak_rss_ratio': 1.0}
+    """
+
+    def table(run: dict) -> pl.DataFrame:
+        return pl.DataFrame(
+            [
+                {
+                    "benchmark": r["benchmark"],
+                    "params": " ".join(f"{k}={v}" for k, v in r["params"].items()),
+                    "median_s": r["median_s"],
+                    "rows_per_s": r["rows_per_s"],
+                    "peak_rss_mb": r["peak_rss_bytes"] / 1024**2,
+                    "peak_rss_delta_mb": (
+                        r["peak_rss_delta_bytes"] / 1024**2
+                        if r["peak_rss_delta_bytes"] is not None
+                        else None
+                    ),
+                }
+                for r in run["results"]
+            ],
+            schema_overrides={"peak_rss_delta_mb": pl.Float64},
+        )
+
+    df = table(results)
+    if baseline is not None:
+        df = df.join(
+            table(baseline).select(
+                "benchmark",
+                "params",
+                baseline_median_s="median_s",
+                baseline_peak_rss_mb="peak_rss_mb",
+            ),
+            on=["benchmark", "params"],
+            how="left",
+        ).select(
+            pl.exclude("baseline_median_s", "baseline_peak_rss_mb"),
+            speedup=pl.col("baseline_median_s") / pl.col("median_s"),
+            peak_rss_ratio=pl.col("peak_rss_mb") / pl.col("baseline_peak_rss_mb"),
+        )
+    return df
+
+
+@hydra.main(
+    version_base=None,
+    config_path=str(MICROBENCHMARKS_CFG.parent),
+    config_name=MICROBENCHMARKS_CFG.stem,
+)
+def main(cfg: DictConfig):
+    """Runs the microbenchmarks and writes their results to ``cfg.output_fp``."""
+    results = run_microbenchmarks(
+        grid=OmegaConf.to_container(cfg.grid) if cfg.get("grid") else None,
+        benchmarks=list(cfg.benchmarks) if cfg.get("benchmarks") else None,
+        repeats=int(cfg.repeats),
+        isolate=bool(cfg.isolate),
+    )
+    output_fp = Path(cfg.output_fp)
+    output_fp.parent.mkdir(parents=True, exist_ok=True)
+    output_fp.write_text(json.dumps(results, indent=2))
+    logger.info(f"Wrote the results to {output_fp}")
+
+    baseline = (
+        json.loads(Path(cfg.baseline_fp).read_text())
+        if cfg.get("baseline_fp")
+        else None
+    )
+    with pl.Config(tbl_rows=-1, tbl_cols=-1, tbl_width_chars=200, fmt_str_lengths=60):
+        logger.info(f"Results:\n{results_table(results, baseline)}")
@@ -0,0 +1,203 @@
+"""A content-addressed store of downloaded files, shared between download directories."""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Linux ioctl that clones the extents of a file (a reflink) on copy-on-write filesystems such as Btrfs or XFS.
+FICLONE = 0x40049409
+
+
+def _reflink(src: Path, dst: Path):
+    """Clone ``src`` to ``dst`` sharing its data blocks. Raises OSError where reflinks are unsupported."""
+    if sys.platform != "linux":
+        raise OSError("reflinks are only supported on Linux")
+    import fcntl
+
+    try:
+        with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+    except OSError:
+        dst.unlink(missing_ok=True)
+        raise
+
+
+def link_file(src: Path, dst: Path) -> str:
+    """Place ``src`` at ``dst`` without copying its data where possible, replacing ``dst``.
+
+    ``src`` is hard-linked, or reflinked if it is on another filesystem or may not be hard-linked (e.g. it is
+    another user's file under ``fs.protected_hardlinks``), and copied as a last resort.
+
+    Returns:
+        How the file was placed: ``"hardlink"``, ``"reflink"`` or ``"copy"``.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     src, dst = Path(tmpdir) / "src.csv", Path(tmpdir) / "dst.csv"
+        ...     _ = src.write_text("1,2,3")
+        ...     _ = dst.write_text("old")
+        ...     print(link_file(src, dst), dst.read_text(), dst.samefile(src))
+        hardlink 1,2,3 True
+    """
+    tmp = dst.with_name(f".{dst.name}.{uuid.uuid4().hex}.link")
+    try:
+        try:
+            os.link(src, tmp)
+            method = "hardlink"
+        except OSError:
+            try:
+                _reflink(src, tmp)
+                method = "reflink"
+            except OSError:
+                shutil.copyfile(src, tmp)
+                method = "copy"
+        os.replace(tmp, dst)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return method
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+class DownloadMirror:
+    """A directory of downloaded files addressed by their SHA-256 digest, shared by several download directories.
+
+    The files are stored once as ``<root>/sha256/<digest[:2]>/<digest>`` and linked into download directories with
+    :func:`link_file`, so they take no further disk space. A new download is linked into the mirror the same way,
+    so the mirror and the first download share one inode and its mode is left alone; write-protect the mirror
+    through the permissions of its directory instead. The mirror records the digest (and ETag) each URL served and
+    the files below each crawled URL, so a download it has seen before is set up from the mirror without network
+    access. Files are verified against checksums when they are downloaded; a URL without a checksum is assumed to
+    always serve the same content, as the versioned PhysioNet URLs do.
+
+    All writes are atomic renames, so several users and processes can share a mirror (given a group-writable
+    directory).
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     mirror = DownloadMirror(Path(tmpdir) / "mirror")
+        ...     fp = Path(tmpdir) / "a" / "person.csv"
+        ...     fp.parent.mkdir()
+        ...     _ = fp.write_text("person_id")
+        ...     digest = hashlib.sha256(b"person_id").hexdigest()
+        ...     url = "http://example.com/data/person.csv"
+        ...     obj = mirror.add(url, fp, digest, etag='"v1"')
+        ...     print(mirror.lookup(url) == (obj, '"v1"'), mirror.lookup("http://example.com/other.csv"))
+        ...     mirror.record_listing("http://example.com/data/", [(url, fp.parent)], Path(tmpdir) / "a")
+        ...     listing = mirror.listing("http://example.com/data/", Path(tmpdir) / "b")
+        ...     print([(u, d.name) for u, d in listing])
+        ...     mirror.link(obj, Path(tmpdir) / "b" / "person.csv")
+        ...     print((Path(tmpdir) / "b" / "person.csv").samefile(fp), bool(fp.stat().st_mode & 0o200))
+        True None
+        [('http://example.com/data/person.csv', 'b')]
+        True True
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def object_path(self, sha256: str) -> Path:
+        sha256 = sha256.lower()
+        return self.root / "sha256" / sha256[:2] / sha256
+
+    def _record_path(self, kind: str, url: str) -> Path:
+        return self.root / kind / f"{_url_key(url)}.json"
+
+    def _read_record(self, kind: str, url: str) -> dict | None:
+        fp = self._record_path(kind, url)
+        try:
+            record = json.loads(fp.read_text())
+        except (OSError, ValueError):
+            return None
+        return record if record.get("url") == url else None
+
+    def _write_record(self, kind: str, url: str, record: dict):
+        fp = self._record_path(kind, url)
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        tmp = fp.with_name(f".{fp.name}.{uuid.uuid4().hex}")
+        tmp.write_text(json.dumps({"url": url, **record}, indent=2))
+        os.replace(tmp, fp)
+
+    def lookup(
+        self, url: str, sha256: str | None = None
+    ) -> tuple[Path, str | None] | None:
+        """The mirrored file of ``url`` (with the given digest, if known) and its ETag, or ``None``."""
+        record = self._read_record("urls", url) or {}
+        sha256 = sha256 or record.get("sha256")
+        if sha256 is None:
+            return None
+        obj = self.object_path(sha256)
+        if not obj.is_file():
+            return None
+        etag = record.get("etag") if record.get("sha256") == sha256.lower() else None
+        return obj, etag
+
+    def add(
+        self, url: str, file_path: Path, sha256: str, etag: str | None = None
+    ) -> Path:
+        """Store a downloaded file, recording it as the content of ``url``.
+
+        Returns:
+            The mirrored file.
+        """
+        obj = self.object_path(sha256)
+        if not obj.is_file():
+            obj.parent.mkdir(parents=True, exist_ok=True)
+            tmp = obj.with_name(f".{obj.name}.{uuid.uuid4().hex}")
+            try:
+                # The object shares the download's inode, so it is not made read-only: that would change the
+                # caller's file too.
+                link_file(file_path, tmp)
+                os.replace(tmp, obj)
+            finally:
+                tmp.unlink(missing_ok=True)
+            logger.info(f"Added {file_path} to the download mirror as {obj}")
+        self._write_record("urls", url, {"sha256": sha256.lower(), "etag": etag})
+        return obj
+
+    def link(self, obj: Path, file_path: Path):
+        """Link a mirrored file into a download directory, unless it is already there."""
+        if file_path.exists() and file_path.samefile(obj):
+            return
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        method = link_file(obj, file_path)
+        logger.info(f"Linked {file_path} from the download mirror ({method})")
+
+    def record_listing(
+        self, base_url: str, files: list[tuple[str, Path]], output_dir: Path
+    ):
+        """Record the files crawled below ``base_url``, as ``(url, directory)`` pairs below ``output_dir``."""
+        self._write_record(
+            "listings",
+            base_url,
+            {
+                "files": [
+                    {
+                        "url": url,
+                        "dir": Path(file_dir).relative_to(output_dir).as_posix(),
+                    }
+                    for url, file_dir in files
+                ]
+            },
+        )
+
+    def listing(self, base_url: str, output_dir: Path) -> list[tuple[str, Path]] | None:
+        """The recorded files below ``base_url`` for ``output_dir``, or ``None`` unless all are mirrored."""
+        record = self._read_record("listings", base_url)
+        if record is None:
+            return None
+        files = [(f["url"], Path(output_dir) / f["dir"]) for f in record["files"]]
+        if not all(self.lookup(url) for url, _ in files):
+            return None
+        return files
@@ -1,34 +1,56 @@
 """Performs pre-MEDS data wrangling for OMOP datasets."""
 
-import os
+import copy
+import json
+import logging.handlers
+import multiprocessing
+import queue
 import shutil
+from collections.abc import Callable
 from datetime import datetime
 from pathlib import Path
 
-os.environ["POLARS_MAX_THREADS"] = str(
-    max(4, len(os.sched_getaffinity(0)) - 2)
-    if hasattr(os, "sched_getaffinity")  # Linux only
-    else max(4, (os.cpu_count() or 8) - 2)  # macOS / Windows
-)
-
-os.environ["POLARS_STREAMING_CHUNK_SIZE"] = "100000"
 import polars as pl
 import polars.selectors as cs
 import logging
 from omegaconf import OmegaConf, DictConfig
 from omop_schema.utils import get_schema_loader
 
-from . import dataset_info, omop_cfg, premeds_cfg
+from . import dataset_info, event_config, omop_cfg, premeds_cfg
 from .pre_meds_utils import (
     DATASET_NAME,
+    SUBJECT_ID,
     get_table_path,
     join_concept,
     col_selector,
     set_up_metadata,
+    extract_codes_metadata,
     extract_nlp_features,
     build_preferred_event_datetime,
 )
-from .pre_meds_data_loader import ShardedTableDataLoader
+from .ancestry import ANCESTRY_INDEX_FN, build_ancestry_index
+from .commands import _patched_environ
+from .fused_events import can_fuse, fuse_events
+from .pre_meds_budget import ResourceBudget
+from .pre_meds_data_loader import ShardedTableDataLoader, load_raw_file
+from .pre_meds_writer import (
+    SCHEMA_MANIFEST_FN,
+    SUBJECT_INDEX_FN,
+    build_schema_manifest,
+    build_subject_index,
+    compact_parquet_parts,
+    decode_low_cardinality,
+    encode_low_cardinality,
+    estimate_row_width,
+    event_sort_cols,
+    low_cardinality_dtypes,
+    parquet_num_rows,
+    polars_sink_kwargs,
+    resolve_dtype_policy,
+    resolve_parquet_profile,
+    sink_parquet_with_dtype_policy,
+)
+from .utils import present_codes
 from tqdm import tqdm
 
 logger = logging.getLogger(__name__)
@@ -47,11 +69,22 @@ def get_shard_prefix(root: Path, path: Path) -> str:
     return path.name if path.is_dir() else path.stem.split(".")[0]
 
 
-def main(cfg: DictConfig) -> None:
-    """Performs pre-MEDS data wrangling for INSERT DATASET NAME HERE."""
+def main(cfg: DictConfig, on_table_done: Callable[[str], None] | None = None) -> None:
+    """Performs pre-MEDS data wrangling for INSERT DATASET NAME HERE.
+
+    Args:
+        cfg: The pipeline configuration.
+        on_table_done: Called with the prefix of every output table once it is final, so downstream stages can
+            start on it while later tables are processed (see ``meds_extract_overlap``).
+    """
+    if on_table_done is None:
+
+        def on_table_done(tbl_prefix: str) -> None:
+            pass
 
     logger.info(f"Loading table preprocessors from {premeds_cfg}...")
-    preprocessors = premeds_cfg  # OmegaConf.load(premeds_cfg)
+    # Deep copy: preprocessor configs are popped from below and must stay intact for later runs.
+    preprocessors = copy.deepcopy(premeds_cfg)
     functions = {}
     omop_version = float(dataset_info.omop_version)
     supported_omop_versions = [5.3, 5.4]
@@ -150,7 +183,11 @@ def main(cfg: DictConfig) -> None:
 
         return fn
 
-    pl.Config.set_streaming_chunk_size(50_000)  # default is ~200k–1M; tune downward
+    # Threads and streaming chunk size, applied per table or batch and divided over concurrent workers.
+    budget = ResourceBudget.from_config(cfg)
+    logger.info(
+        f"Pre-MEDS resource budget: {budget} (Polars thread pool: {pl.thread_pool_size()} threads)"
+    )
     # Ensure any nlp_features config isn't accidentally forwarded to join_concept
     for table_name, preprocessor_cfg in preprocessors.items():
         if table_name in [
@@ -239,15 +276,110 @@ def main(cfg: DictConfig) -> None:
 
     unused_tables = {}
 
-    concept_df, patient_df = set_up_metadata(
-        MEDS_input_dir=MEDS_input_dir,
-        do_overwrite=cfg.do_overwrite,
-        OMOP_input_dir=OMOP_input_dir,
-        limit=limit,
-        schema_loader=schema_loader,
-        selector=selector,
-        join_on_visit=cfg.join_on_visit,
-    )
+    full_vocabulary = bool(cfg.get("codes_metadata_full_vocabulary", False))
+    with budget.scope():
+        concept_df, patient_df = set_up_metadata(
+            MEDS_input_dir=MEDS_input_dir,
+            do_overwrite=cfg.do_overwrite,
+            OMOP_input_dir=OMOP_input_dir,
+            limit=limit,
+            schema_loader=schema_loader,
+            selector=selector,
+            join_on_visit=cfg.join_on_visit,
+            full_vocabulary=full_vocabulary,
+        )
+    # The metadata tables, and on a resumed run any table finished before, are final from here on.
+    for fp in sorted(MEDS_input_dir.iterdir()):
+        if not fp.name.startswith(".") and (fp.is_dir() or fp.suffix == ".parquet"):
+            on_table_done(fp.name.removesuffix(".parquet"))
+
+    # Optionally encode the vocabulary columns of the concept table with one global Enum mapping. The joins still
+    # match on concept_id; only the vocabulary payload they gather per row becomes a fixed-width Enum code instead
+    # of a string copy. The columns are decoded again right before sinking: MEDS-Extract cannot read Categorical
+    # fields nested in its code_components, and parquet dictionary-encodes these columns on disk anyway.
+    if cfg.get("pre_meds_encode_categoricals", False):
+        vocabularies = (
+            concept_df.select(
+                pl.col("vocabulary_id").cast(pl.String).drop_nulls().unique()
+            )
+            .collect()
+            .to_series()
+            .to_list()
+        )
+        # join_concept falls back to OMOP_<table> when no vocabulary could be determined.
+        vocabularies += [f"OMOP_{table_name}" for table_name in functions]
+        concept_df = encode_low_cardinality(
+            concept_df, low_cardinality_dtypes(vocabularies)
+        )
+        logger.info(
+            f"Encoding the concept vocabulary columns with {len(vocabularies)} vocabularies"
+        )
+
+    # Optionally compact dtypes for concept ids and values; the concept id downcast is decided once, from the
+    # concept_id range of the concept table.
+    dtype_policy = cfg.get("pre_meds_dtype_policy", None)
+    if isinstance(dtype_policy, DictConfig):
+        dtype_policy = OmegaConf.to_container(dtype_policy, resolve=True)
+    dtype_policy = resolve_dtype_policy(dtype_policy, concept_df)
+
+    # Parquet output profiles (codec, row groups, ...) are chosen per table from its size, with config overrides.
+    parquet_profiles = cfg.get("pre_meds_parquet_profiles", None)
+    if isinstance(parquet_profiles, DictConfig):
+        parquet_profiles = OmegaConf.to_container(parquet_profiles, resolve=True)
+    table_profiles: dict[str, dict] = {}
+
+    def table_parquet_profile(
+        tbl_prefix: str, in_fp: Path, table_df: pl.LazyFrame
+    ) -> dict:
+        """Resolve (once per table) the parquet output profile of a table."""
+        if tbl_prefix not in table_profiles:
+            table_profiles[tbl_prefix] = resolve_parquet_profile(
+                tbl_prefix,
+                parquet_profiles,
+                estimated_rows=data_loader.estimate_rows(in_fp),
+                row_width=estimate_row_width(table_df.collect_schema()),
+            )
+            logger.info(
+                f"{tbl_prefix}: parquet output profile {table_profiles[tbl_prefix]}"
+            )
+        return table_profiles[tbl_prefix]
+
+    # Optionally sort every output by subject and event time so row-group statistics can prune per-subject reads.
+    sort_output = bool(cfg.get("pre_meds_sort_output", False))
+
+    def table_sort_cols(tbl_prefix: str, table_df: pl.LazyFrame) -> list[str]:
+        """Sort keys of a table: the subject id, then the first event time used by its event configs."""
+        time_cols = [
+            event_cfg["time"][1:]
+            for event_cfg in (event_config.get(tbl_prefix) or {}).values()
+            if isinstance(event_cfg, DictConfig)
+            and isinstance(event_cfg.get("time"), str)
+            and event_cfg["time"].startswith("$")
+        ]
+        return event_sort_cols(table_df.collect_schema(), SUBJECT_ID, time_cols)
+
+    # Optionally extract the MEDS events of each table here and write them instead of the wide table.
+    fused_events = bool(cfg.get("pre_meds_fused_events", False))
+
+    def output_transform(tbl_prefix: str):
+        """The step applied to a table's (downcast) output right before sinking: event extraction, then sorting."""
+        table_cfg = event_config.get(tbl_prefix)
+        fuse = fused_events and can_fuse(table_cfg)
+        if fused_events and not fuse:
+            logger.info(
+                f"{tbl_prefix}: writing the wide table, its events cannot be fused"
+            )
+
+        def transform(table_df: pl.LazyFrame) -> pl.LazyFrame:
+            if fuse:
+                table_df = fuse_events(table_df, table_cfg, SUBJECT_ID)
+            if sort_output:
+                table_df = table_df.sort(
+                    table_sort_cols(tbl_prefix, table_df), nulls_last=True
+                )
+            return table_df
+
+        return transform
 
     # Cache care_site lookup once per run; False means unavailable and skip subsequent attempts.
     care_site_lookup: pl.LazyFrame | bool | None = None
@@ -290,6 +422,7 @@ def main(cfg: DictConfig) -> None:
     for in_fp in all_fps:
         tbl_prefix = get_shard_prefix(OMOP_input_dir, in_fp)
         out_fp = MEDS_input_dir / f"{tbl_prefix}.parquet"
+        out_dir = MEDS_input_dir / tbl_prefix
 
         if tbl_prefix in unused_tables:
             logger.warning(
@@ -312,8 +445,9 @@ def main(cfg: DictConfig) -> None:
                 )
             continue
 
-        if out_fp.exists():
+        if out_fp.exists() or out_dir.exists():
             logger.info(f"Done with {tbl_prefix}. Continuing")
+            on_table_done(tbl_prefix)
             continue
 
         out_fp.parent.mkdir(parents=True, exist_ok=True)
@@ -337,6 +471,7 @@ def main(cfg: DictConfig) -> None:
             temp_out_dir.mkdir(parents=True, exist_ok=True)
 
             written_parts: list[Path] = []
+            transform = output_transform(tbl_prefix)
             batch_iter = data_loader.iter_table_batches(tbl_prefix, in_fp)
             estimated_batches = data_loader.estimate_batches(in_fp)
 
@@ -357,11 +492,16 @@ def main(cfg: DictConfig) -> None:
 
                 processed_df = processed_df.with_columns(table_name=pl.lit(tbl_prefix))
                 part_fp = temp_out_dir / f"part_{batch_idx:05d}.parquet"
-                processed_df.sink_parquet(part_fp, row_group_size=128_000)
-                if part_fp.exists() and part_fp.stat().st_size > 0:
-                    written_parts.append(part_fp)
-                elif part_fp.exists():
-                    part_fp.unlink()
+                profile = table_parquet_profile(tbl_prefix, in_fp, processed_df)
+                with budget.scope(estimate_row_width(processed_df.collect_schema())):
+                    if sink_parquet_with_dtype_policy(
+                        decode_low_cardinality(processed_df),
+                        part_fp,
+                        dtype_policy,
+                        transform=transform,
+                        **polars_sink_kwargs(profile),
+                    ):
+                        written_parts.append(part_fp)
 
             if not written_parts:
                 logger.warning(
@@ -370,6 +510,34 @@ def main(cfg: DictConfig) -> None:
                 shutil.rmtree(temp_out_dir, ignore_errors=True)
                 continue
 
+            if len(written_parts) > 1 and cfg.get("pre_meds_compact_parts", True):
+                # Balance part sizes; shard_events treats every pre-MEDS file as one unit of work.
+                n_compact_workers, worker_budget = budget.split(
+                    int(cfg.get("pre_meds_compact_workers", 4))
+                )
+                with worker_budget.scope(
+                    estimate_row_width(pl.read_parquet_schema(written_parts[0]))
+                ):
+                    written_parts = compact_parquet_parts(
+                        temp_out_dir,
+                        target_file_bytes=int(
+                            float(cfg.get("pre_meds_compact_target_mb", 256)) * 1024**2
+                        ),
+                        n_workers=n_compact_workers,
+                        sort_by=table_sort_cols(
+                            tbl_prefix, pl.scan_parquet(written_parts[0])
+                        )
+                        if sort_output
+                        else None,
+                        **{
+                            **polars_sink_kwargs(profile),
+                            "row_group_size": int(
+                                cfg.get("pre_meds_compact_row_group_size")
+                                or profile["row_group_size"]
+                            ),
+                        },
+                    )
+
             if len(written_parts) == 1:
                 written_parts[0].replace(out_fp)
                 shutil.rmtree(temp_out_dir, ignore_errors=True)
@@ -377,9 +545,9 @@ def main(cfg: DictConfig) -> None:
                     f"Processed and wrote to {str(out_fp.resolve())} in {datetime.now() - st}"
                 )
             else:
-                temp_out_dir.replace(out_fp)
+                temp_out_dir.replace(out_dir)
                 logger.info(
-                    f"Processed and wrote {len(written_parts)} parts to {str(out_fp.resolve())} in {datetime.now() - st}"
+                    f"Processed and wrote {len(written_parts)} parts to {str(out_dir.resolve())} in {datetime.now() - st}"
                 )
         else:
             # Singular execution for smaller tables that Polars can handle
@@ -391,33 +559,171 @@ def main(cfg: DictConfig) -> None:
                 continue
 
             processed_df = fn(df, concept_df, patient_df)
-            if processed_df.limit(1).collect().is_empty():
-                logger.warning(
-                    f"Skipping {tbl_prefix} as it is empty after preprocessing (potentially due to filtering subjects)."
-                )
-                continue
             if tbl_prefix == "visit_occurrence":
                 processed_df = maybe_join_visit_occurrence_care_site(processed_df)
 
             processed_df = processed_df.with_columns(table_name=pl.lit(tbl_prefix))
-            if processed_df.limit(1).collect().is_empty():
+
+            # Execute the plan once; emptiness and row count come from the written footer.
+            profile = table_parquet_profile(tbl_prefix, in_fp, processed_df)
+            with budget.scope(estimate_row_width(processed_df.collect_schema())):
+                n_rows = sink_parquet_with_dtype_policy(
+                    decode_low_cardinality(processed_df),
+                    out_fp,
+                    dtype_policy,
+                    transform=output_transform(tbl_prefix),
+                    **polars_sink_kwargs(profile),
+                )
+            if n_rows == 0:
                 logger.warning(
                     f"Skipping {tbl_prefix} as it is empty after preprocessing (potentially due to filtering subjects)."
                 )
                 continue
 
+            logger.info(f"{tbl_prefix}: rows before final sink={n_rows}")
             logger.info(
-                f"{tbl_prefix}: rows before final sink={processed_df.select(pl.len()).collect().item(0, 0)}"
+                f"Processed and wrote to {str(out_fp.resolve())} in {datetime.now() - st}"
             )
-            processed_df.sink_parquet(out_fp, row_group_size=128_000)
 
+        on_table_done(tbl_prefix)
+
+    if sort_output:
+        subject_index = build_subject_index(MEDS_input_dir, SUBJECT_ID)
+        subject_index.write_parquet(MEDS_input_dir / SUBJECT_INDEX_FN)
+        logger.info(
+            f"Wrote subject index over {subject_index.height} row groups to {str((MEDS_input_dir / SUBJECT_INDEX_FN).resolve())}"
+        )
+
+    # The codes the outputs can yield, scanned only if codes metadata or the ancestry index still need building.
+    codes: pl.LazyFrame | None = None
+
+    def get_present_codes() -> pl.LazyFrame:
+        """Scan the distinct codes of the outputs on first use and cache them for the other consumer."""
+        nonlocal codes
+        if codes is None:
+            with budget.scope():
+                codes = present_codes(event_config, MEDS_input_dir).collect().lazy()
+        return codes
+
+    codes_out_fp = MEDS_input_dir / "codes.parquet"
+    if not codes_out_fp.is_file():
+        # Descriptions and parent codes only for the codes the event tables can yield.
+        with budget.scope():
+            extract_codes_metadata(
+                pl.scan_parquet(MEDS_input_dir / "concept.parquet"),
+                pl.scan_parquet(MEDS_input_dir / "concept_relationship.parquet"),
+                codes=get_present_codes(),
+            ).sink_parquet(codes_out_fp)
+        logger.info(
+            f"Wrote code metadata for {parquet_num_rows(codes_out_fp)} present concepts to {str(codes_out_fp.resolve())}"
+        )
+
+    if cfg.get("pre_meds_ancestry_index", False):
+        # Ancestors of the present concepts over dense node ids, for hierarchy roll-ups without concept_ancestor.
+        ancestry_out_fp = MEDS_input_dir / ANCESTRY_INDEX_FN
+        concept_ancestor_fp = get_table_path(OMOP_input_dir, "concept_ancestor")
+        if ancestry_out_fp.is_file():
             logger.info(
-                f"Processed and wrote to {str(out_fp.resolve())} in {datetime.now() - st}"
+                f"Reusing existing ancestry index at {str(ancestry_out_fp.resolve())}"
+            )
+        elif concept_ancestor_fp is None:
+            logger.warning(
+                "No concept_ancestor table found in the input directory; not building the ancestry index."
+            )
+        else:
+            with budget.scope():
+                build_ancestry_index(
+                    pl.scan_parquet(MEDS_input_dir / "concept.parquet"),
+                    load_raw_file(concept_ancestor_fp, schema_loader),
+                    get_present_codes(),
+                ).sink_parquet(ancestry_out_fp)
+            logger.info(
+                f"Wrote ancestry index over {parquet_num_rows(ancestry_out_fp)} concepts to {str(ancestry_out_fp.resolve())}"
             )
 
+    # Exact output schemas and row counts, used to check the event config before MEDS-Extract runs.
+    schema_manifest = build_schema_manifest(MEDS_input_dir)
+    (MEDS_input_dir / SCHEMA_MANIFEST_FN).write_text(
+        json.dumps(schema_manifest, indent=2), encoding="utf-8"
+    )
+    logger.info(f"Wrote schema manifest of {len(schema_manifest)} files")
+
     logger.info(
         f"Done! All dataframes processed and written to {str(MEDS_input_dir.resolve())}"
     )
     done_fp.write_text(f"completed_at={datetime.now().isoformat()}\n", encoding="utf-8")
 
     return
+
+
+def _run_in_child(cfg_container: dict, events) -> None:
+    """Runs :func:`main` in a pre-MEDS child process, sending its log records and finished tables to ``events``."""
+    root_logger = logging.getLogger()
+    root_logger.handlers = [logging.handlers.QueueHandler(events)]
+    root_logger.setLevel(logging.INFO)
+    try:
+        main(
+            OmegaConf.create(cfg_container),
+            on_table_done=lambda tbl_prefix: events.put(("table_done", tbl_prefix)),
+        )
+    except BaseException:
+        logger.exception("Pre-MEDS failed")
+        raise
+    finally:
+        events.put(("exit", None))
+
+
+def run(cfg: DictConfig, on_table_done: Callable[[str], None] | None = None) -> None:
+    """Runs :func:`main` with the Polars thread pool sized to ``pre_meds_threads``.
+
+    Polars sizes its thread pool once, from ``POLARS_MAX_THREADS`` when it is imported. If ``pre_meds_threads`` is
+    set and differs from the pool size of this process, pre-MEDS therefore runs in a spawned child process with
+    ``POLARS_MAX_THREADS`` set to it; its log records are re-emitted here and ``on_table_done`` is called here as
+    the child finishes tables. Otherwise :func:`main` runs in this process.
+
+    Raises:
+        RuntimeError: If the child process fails.
+    """
+    n_threads = cfg.get("pre_meds_threads", None)
+    if n_threads is None or int(n_threads) == pl.thread_pool_size():
+        main(cfg, on_table_done=on_table_done)
+        return
+
+    logger.info(
+        f"Running pre-MEDS in a child process with {int(n_threads)} Polars threads"
+    )
+    ctx = multiprocessing.get_context("spawn")
+    events = ctx.Queue()
+    process = ctx.Process(
+        target=_run_in_child,
+        # Without the hydra node of a config that was not loaded by hydra, whose resolvers the child lacks.
+        args=(
+            OmegaConf.to_container(
+                OmegaConf.masked_copy(cfg, [k for k in cfg if k != "hydra"]),
+                resolve=True,
+            ),
+            events,
+        ),
+    )
+    with _patched_environ({"POLARS_MAX_THREADS": str(int(n_threads))}):
+        process.start()
+
+    exited = False
+    while not exited:
+        try:
+            event = events.get(timeout=1.0)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+            break
+        if isinstance(event, logging.LogRecord):
+            logging.getLogger(event.name).handle(event)
+        elif event[0] == "table_done" and on_table_done is not None:
+            on_table_done(event[1])
+        elif event[0] == "exit":
+            exited = True
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(
+            f"Pre-MEDS failed in its child process (exit code {process.exitcode})"
+        )
@@ -0,0 +1,130 @@
+"""Thread and streaming chunk budget handed out to pre-MEDS work."""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+import polars as pl
+from omegaconf import DictConfig
+
+
+class ResourceBudget:
+    """The threads and Polars streaming chunk size available to a unit of pre-MEDS work.
+
+    The orchestrator builds one budget from the config, applies it around each table or batch with
+    :meth:`scope`, and divides it with :meth:`split` before running work concurrently. Polars' thread pool is
+    sized once per process (by ``POLARS_MAX_THREADS``, all CPUs by default), so ``n_threads`` bounds how many
+    concurrent workers share that pool rather than resizing it; :func:`OMOP_MEDS.pre_meds.run` sizes the pool to
+    ``pre_meds_threads`` by running pre-MEDS in a child process.
+
+    Args:
+        n_threads: The number of threads; defaults to the size of the Polars thread pool.
+        streaming_chunk_size: A fixed streaming chunk size in rows, ``"auto"`` to size chunks to
+            ``chunk_bytes`` from the row width, or ``None`` for the Polars default.
+        chunk_bytes: The target in-memory size of one streaming chunk in ``"auto"`` mode.
+
+    Examples:
+        >>> budget = ResourceBudget(8, "auto", chunk_bytes=16 * 1024**2)
+        >>> budget
+        ResourceBudget(n_threads=8, streaming_chunk_size='auto', chunk_bytes=16777216)
+        >>> budget.chunk_size(row_width=200)
+        83886
+        >>> budget.chunk_size(row_width=None)
+        >>> ResourceBudget(8, 50_000).chunk_size(row_width=200)
+        50000
+    """
+
+    MIN_CHUNK_SIZE = 1_000
+
+    def __init__(
+        self,
+        n_threads: int | None = None,
+        streaming_chunk_size: int | str | None = None,
+        chunk_bytes: int = 16 * 1024**2,
+    ):
+        if streaming_chunk_size not in (None, "auto") and not isinstance(
+            streaming_chunk_size, int
+        ):
+            raise ValueError(
+                f"streaming_chunk_size must be an int, 'auto' or None, got {streaming_chunk_size!r}"
+            )
+        self.n_threads = max(1, int(n_threads or pl.thread_pool_size()))
+        self.streaming_chunk_size = streaming_chunk_size
+        self.chunk_bytes = int(chunk_bytes)
+
+    def __repr__(self) -> str:
+        return (
+            f"ResourceBudget(n_threads={self.n_threads}, streaming_chunk_size={self.streaming_chunk_size!r}, "
+            f"chunk_bytes={self.chunk_bytes})"
+        )
+
+    @classmethod
+    def from_config(cls, cfg: DictConfig) -> "ResourceBudget":
+        """Build the budget from the ``pre_meds_threads`` and ``pre_meds_streaming_chunk_*`` settings.
+
+        Examples:
+            >>> from omegaconf import OmegaConf
+            >>> ResourceBudget.from_config(OmegaConf.create({
+            ...     "pre_meds_threads": 6, "pre_meds_streaming_chunk_size": "auto", "pre_meds_streaming_chunk_mb": 8,
+            ... }))
+            ResourceBudget(n_threads=6, streaming_chunk_size='auto', chunk_bytes=8388608)
+        """
+        chunk_size = cfg.get("pre_meds_streaming_chunk_size", None)
+        return cls(
+            n_threads=cfg.get("pre_meds_threads", None),
+            streaming_chunk_size=chunk_size
+            if chunk_size in (None, "auto")
+            else int(chunk_size),
+            chunk_bytes=int(
+                float(cfg.get("pre_meds_streaming_chunk_mb", 16)) * 1024**2
+            ),
+        )
+
+    def chunk_size(self, row_width: int | None = None) -> int | None:
+        """The streaming chunk size in rows for rows of ``row_width`` bytes (``None``: the Polars default)."""
+        if self.streaming_chunk_size != "auto":
+            return self.streaming_chunk_size
+        if not row_width:
+            return None
+        return max(self.MIN_CHUNK_SIZE, self.chunk_bytes // row_width)
+
+    def split(self, n_workers: int) -> tuple[int, "ResourceBudget"]:
+        """Divide the budget over up to ``n_workers`` concurrent workers.
+
+        The number of workers is capped at ``n_threads``. Each worker gets an even share of the threads and of
+        the streaming chunk memory, so the workers together stay within this budget.
+
+        Returns:
+            The number of workers to run and the budget of each.
+
+        Examples:
+            >>> ResourceBudget(8, 40_000).split(3)
+            (3, ResourceBudget(n_threads=2, streaming_chunk_size=13333, chunk_bytes=5592405))
+            >>> ResourceBudget(2, "auto", chunk_bytes=1024**2).split(4)
+            (2, ResourceBudget(n_threads=1, streaming_chunk_size='auto', chunk_bytes=524288))
+            >>> ResourceBudget(2, None).split(1)
+            (1, ResourceBudget(n_threads=2, streaming_chunk_size=None, chunk_bytes=16777216))
+        """
+        n_workers = max(1, min(int(n_workers), self.n_threads))
+        chunk_size = self.streaming_chunk_size
+        if isinstance(chunk_size, int):
+            chunk_size = max(self.MIN_CHUNK_SIZE, chunk_size // n_workers)
+        return n_workers, ResourceBudget(
+            n_threads=self.n_threads // n_workers,
+            streaming_chunk_size=chunk_size,
+            chunk_bytes=self.chunk_bytes // n_workers,
+        )
+
+    @contextmanager
+    def scope(self, row_width: int | None = None) -> Iterator["ResourceBudget"]:
+        """Apply the streaming chunk size for rows of ``row_width`` bytes while the block runs.
+
+        The Polars setting is process-wide, so scopes must be entered by the orchestrating thread, around (not
+        inside) concurrent workers.
+
+        Examples:
+            >>> with ResourceBudget(4, 12_345).scope():
+            ...     pl.Config.state()["POLARS_STREAMING_CHUNK_SIZE"]
+            '12345'
+        """
+        with pl.Config(streaming_chunk_size=self.chunk_size(row_width)):
+            yield self
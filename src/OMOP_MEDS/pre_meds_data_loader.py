@@ -42,8 +42,9 @@ def load_raw_file(
     # pa.schema([(col, dtype) for coll, dtype in schema.items()])
     # Convert dict to pa.Schema
     if fp.suffixes == [".csv", ".gz"]:
+        # Polars detects and decompresses gzip itself.
         file = pl.scan_csv(
-            fp, compression="gzip", infer_schema=False, schema_overrides=schema
+            fp, infer_schema=False, has_header=True, schema_overrides=schema
         ).select(selector)
         logging.info(f"Loaded gzipped CSV file from {fp}")
     elif fp.suffix == ".csv":
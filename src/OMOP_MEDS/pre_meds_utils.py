@@ -13,6 +13,7 @@ from omop_schema.schema.base import OMOPSchemaBase
 from omop_schema.utils import pyarrow_to_polars_schema
 
 from . import dataset_info, premeds_cfg
+from .download import rename_downloaded_file
 from .pre_meds_data_loader import load_raw_file
 
 DATASET_NAME = dataset_info.dataset_name
@@ -22,10 +23,24 @@ OMOP_TIME_FORMATS: Iterable[str] = ("%Y-%m-%d %H:%M:%S%.f", "%Y-%m-%d")
 
 
 def get_table_path(input_dir: Path, table_name: str) -> Path | None:
+    """The input file or directory of an OMOP table, preferring parquet to other formats of the same table.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     for fn in ["person.csv", "person.parquet", "death.csv"]:
+        ...         _ = (Path(tmpdir) / fn).write_text("")
+        ...     print(get_table_path(Path(tmpdir), "person").name, get_table_path(Path(tmpdir), "death").name)
+        ...     print(get_table_path(Path(tmpdir), "visit_occurrence"))
+        person.parquet death.csv
+        None
+    """
     table_path = input_dir / table_name
     if table_path.exists():
         return table_path
-    table_path_with_ext = list(input_dir.glob(f"{table_name}.*"))
+    table_path_with_ext = sorted(
+        input_dir.glob(f"{table_name}.*"), key=lambda fp: fp.suffix != ".parquet"
+    )
     if table_path_with_ext:
         return table_path_with_ext[0]
     return None
@@ -572,14 +587,17 @@ def check_column_mismatches(folder_path: str):
 
 
 def extract_codes_metadata(
-    concept_df: pl.LazyFrame, concept_relationship_df: pl.LazyFrame
+    concept_df: pl.LazyFrame,
+    concept_relationship_df: pl.LazyFrame,
+    codes: pl.LazyFrame | None = None,
 ) -> pl.LazyFrame:
     """ "
     Extracts metadata from the OMOP `concept` and `concept_relationship` tables.
     This function generates a metadata table that includes concept IDs, vocabulary IDs,
     descriptions, and parent codes for each concept. It also handles custom concepts with
     concept IDs greater than 2000000000, ensuring they are included in the metadata with
-    appropriate parent codes when available.
+    appropriate parent codes when available. If `codes` (a frame with a `code` column) is
+    given, only the concepts with one of these codes, and their relationships, are processed.
     """
     logger.info(
         "Generating codes metadata from OMOP `concept` table and `concept_relationship` table"
@@ -597,6 +615,21 @@ def extract_codes_metadata(
     concept_relationship_df = concept_relationship_df.with_columns(
         pl.col("concept_id_1").cast(pl.Int64), pl.col("concept_id_2").cast(pl.Int64)
     )
+    if codes is not None:
+        result = result.join(
+            codes.select("code").unique(),
+            left_on=pl.col("vocabulary_id").cast(pl.Utf8)
+            + "//"
+            + pl.col("concept_id").cast(pl.Utf8),
+            right_on="code",
+            how="semi",
+        )
+        concept_relationship_df = concept_relationship_df.join(
+            result.select("concept_id"),
+            left_on="concept_id_1",
+            right_on="concept_id",
+            how="semi",
+        )
 
     # Take the parents of the concepts
     parent_codes = concept_relationship_df.filter(
@@ -812,11 +845,14 @@ def determine_concept_id(
 
 
 def rename_demo_files(directory: Path):
-    """Rename files in the directory by removing the '2b_' prefix in the MIMIC-OMOP demo."""
+    """Rename files in the directory by removing the '2b_' prefix in the MIMIC-OMOP demo.
+
+    The renames are recorded in the download manifest, so a later download still skips the files.
+    """
     for file_path in directory.glob("2b_*"):
         new_name = file_path.name.replace("2b_", "")
         new_path = file_path.with_name(new_name)
-        file_path.rename(new_path)
+        rename_downloaded_file(directory, file_path, new_path)
         logger.info(f"Renamed: {file_path} to {new_path}")
 
 
@@ -840,7 +876,13 @@ def set_up_metadata(
     limit,
     schema_loader: OMOPSchemaBase,
     selector: SelectorType,
+    full_vocabulary: bool = True,
 ) -> tuple[pl.LazyFrame, pl.LazyFrame]:
+    """Write the person, concept, concept_relationship and (with ``full_vocabulary``) codes metadata tables.
+
+    Without ``full_vocabulary``, the codes metadata is left to be built for the codes present in the pre-MEDS
+    outputs once they are written (see ``extract_codes_metadata``).
+    """
     person_out_fp = MEDS_input_dir / "person_birth_death.parquet"
     concept_out_fp = MEDS_input_dir / "concept.parquet"
     concept_relationship_out_fp = MEDS_input_dir / "concept_relationship.parquet"
@@ -939,7 +981,7 @@ def set_up_metadata(
 
     if codes_out_fp.is_file():
         logger.info(f"Reusing existing code metadata at {str(codes_out_fp.resolve())}")
-    else:
+    elif full_vocabulary:
         code_metadata = extract_codes_metadata(concept_df, concept_relationship_df)
         code_metadata.sink_parquet(codes_out_fp)
         logger.info(f"Wrote code metadata to {str(codes_out_fp.resolve())}")
@@ -0,0 +1,753 @@
+"""Helpers for writing pre-MEDS tables to parquet."""
+
+import json
+import logging
+import math
+import shutil
+from collections.abc import Callable, Collection, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import polars as pl
+from pyarrow import parquet as pq
+
+logger = logging.getLogger(__name__)
+
+
+PARQUET_PROFILE_KEYS = (
+    "compression",
+    "compression_level",
+    "row_group_size",
+    "data_page_size",
+    "statistics",
+    "dictionary",
+)
+
+# Approximate in-memory bytes per value, used to turn a row-group byte target into a row count.
+_DTYPE_WIDTHS = {
+    pl.Boolean: 1,
+    pl.Int8: 1,
+    pl.UInt8: 1,
+    pl.Int16: 2,
+    pl.UInt16: 2,
+    pl.Int32: 4,
+    pl.UInt32: 4,
+    pl.Float32: 4,
+    pl.Date: 4,
+    pl.Categorical: 4,
+    pl.Enum: 4,
+}
+_STRING_WIDTH = 32
+_DEFAULT_WIDTH = 8
+
+
+def estimate_row_width(schema: pl.Schema) -> int:
+    """Estimate the uncompressed width of one row in bytes from its schema.
+
+    Examples:
+        >>> estimate_row_width(pl.Schema({"a": pl.Int64, "b": pl.Int32, "c": pl.String}))
+        44
+    """
+    width = 0
+    for dtype in schema.values():
+        if dtype == pl.String:
+            width += _STRING_WIDTH
+        else:
+            width += _DTYPE_WIDTHS.get(dtype.base_type(), _DEFAULT_WIDTH)
+    return max(1, width)
+
+
+def auto_parquet_profile(
+    estimated_rows: int | None,
+    row_width: int | None,
+    target_row_group_bytes: int = 64 * 1024**2,
+) -> dict:
+    """Pick a parquet output profile from a table's estimated size.
+
+    Row groups target ``target_row_group_bytes`` of uncompressed data (clamped to 16k-1M rows), so narrow
+    tables get larger row groups and wide tables smaller ones. Compression trades CPU against I/O: small
+    tables are cheap to compress hard, while very large tables use a fast zstd level so the write does not
+    become CPU bound.
+
+    Args:
+        estimated_rows: The estimated row count of the table, if known.
+        row_width: The estimated bytes per row, if known.
+        target_row_group_bytes: The desired uncompressed size of one row group.
+
+    Returns:
+        A profile with all of ``PARQUET_PROFILE_KEYS``.
+
+    Examples:
+        >>> auto_parquet_profile(50, 100)["compression_level"]
+        9
+        >>> p = auto_parquet_profile(4_000_000_000, 64)
+        >>> p["compression"], p["compression_level"], p["row_group_size"]
+        ('zstd', 1, 1000000)
+        >>> auto_parquet_profile(None, None)["row_group_size"]
+        128000
+    """
+    if row_width:
+        row_group_size = min(
+            1_000_000, max(16_384, target_row_group_bytes // row_width)
+        )
+    else:
+        row_group_size = 128_000
+    if estimated_rows is not None and estimated_rows < 1_000_000:
+        compression_level = 9
+    elif estimated_rows is not None and estimated_rows > 100_000_000:
+        compression_level = 1
+    else:
+        compression_level = 3
+    return {
+        "compression": "zstd",
+        "compression_level": compression_level,
+        "row_group_size": int(row_group_size),
+        "data_page_size": 1024**2,
+        "statistics": True,
+        "dictionary": True,
+    }
+
+
+def resolve_parquet_profile(
+    table: str,
+    profiles: Mapping | None,
+    estimated_rows: int | None = None,
+    row_width: int | None = None,
+) -> dict:
+    """Resolve the parquet output profile of one table.
+
+    The automatic profile is overridden by the ``default`` entry of ``profiles`` and then by the table's own
+    entry, so only the settings that should differ need to be configured.
+
+    Examples:
+        >>> profiles = {"default": {"compression": "lz4"}, "measurement": {"row_group_size": 500_000}}
+        >>> p = resolve_parquet_profile("measurement", profiles, 10, 100)
+        >>> p["compression"], p["row_group_size"], p["statistics"]
+        ('lz4', 500000, True)
+        >>> resolve_parquet_profile("note", {"note": {"codec": "gzip"}})
+        Traceback (most recent call last):
+            ...
+        ValueError: Unknown parquet profile keys for note: ['codec']
+    """
+    profile = auto_parquet_profile(estimated_rows, row_width)
+    profiles = profiles or {}
+    for key in ("default", table):
+        overrides = dict(profiles.get(key) or {})
+        unknown = sorted(set(overrides) - set(PARQUET_PROFILE_KEYS))
+        if unknown:
+            raise ValueError(f"Unknown parquet profile keys for {key}: {unknown}")
+        profile.update(overrides)
+    return profile
+
+
+def polars_sink_kwargs(profile: Mapping) -> dict:
+    """Translate a parquet profile into ``LazyFrame.sink_parquet`` keyword arguments.
+
+    Polars picks dictionary encoding per column itself, so the ``dictionary`` setting only applies to writers
+    backed by pyarrow (see :func:`pyarrow_writer_kwargs`).
+
+    Examples:
+        >>> polars_sink_kwargs(auto_parquet_profile(10, 100))
+        {'compression': 'zstd', 'compression_level': 9, 'row_group_size': 671088, 'data_page_size': 1048576, 'statistics': True}
+    """
+    return {
+        "compression": profile["compression"],
+        "compression_level": profile["compression_level"],
+        "row_group_size": profile["row_group_size"],
+        "data_page_size": profile["data_page_size"],
+        "statistics": profile["statistics"],
+    }
+
+
+def pyarrow_writer_kwargs(profile: Mapping) -> dict:
+    """Translate a parquet profile into ``pyarrow.parquet.ParquetWriter`` keyword arguments.
+
+    Examples:
+        >>> pyarrow_writer_kwargs(auto_parquet_profile(10, 100))
+        {'compression': 'zstd', 'compression_level': 9, 'data_page_size': 1048576, 'write_statistics': True, 'use_dictionary': True}
+    """
+    return {
+        "compression": profile["compression"],
+        "compression_level": profile["compression_level"],
+        "data_page_size": profile["data_page_size"],
+        "write_statistics": profile["statistics"],
+        "use_dictionary": profile["dictionary"],
+    }
+
+
+def low_cardinality_dtypes(vocabularies: list[str]) -> dict[str, pl.DataType]:
+    """Build the Enum dtypes used for the low-cardinality vocabulary columns of the concept table.
+
+    The Enum categories are sorted, so the mapping depends only on the set of vocabularies and is identical for
+    every batch, part, and run over the same vocabulary; frames therefore concatenate and join without
+    re-encoding.
+
+    Examples:
+        >>> dtypes = low_cardinality_dtypes(["SNOMED", "LOINC", "LOINC"])
+        >>> dtypes["vocabulary_id"] == dtypes["preferred_vocabulary_name"] == pl.Enum(["LOINC", "SNOMED"])
+        True
+    """
+    vocab_enum = pl.Enum(sorted(set(vocabularies)))
+    return {
+        "vocabulary_id": vocab_enum,
+        "preferred_vocabulary_name": vocab_enum,
+    }
+
+
+def encode_low_cardinality(
+    lf: pl.LazyFrame, dtypes: Mapping[str, pl.DataType]
+) -> pl.LazyFrame:
+    """Cast the string columns named in ``dtypes`` to their Enum dtype.
+
+    A column matches a key exactly or as ``<key>_<suffix>``, which covers the suffixed concept columns
+    (e.g. ``vocabulary_id_source_concept_id``) of multi-concept joins. Non-string columns are left untouched.
+
+    Examples:
+        >>> lf = pl.LazyFrame({"vocabulary_id_source": ["LOINC"], "concept_code": ["1"], "vocabulary_id": [1]})
+        >>> dict(encode_low_cardinality(lf, low_cardinality_dtypes(["LOINC"])).collect_schema())
+        {'vocabulary_id_source': Enum(categories=['LOINC']), 'concept_code': String, 'vocabulary_id': Int64}
+    """
+    schema = lf.collect_schema()
+    casts = []
+    for col, dtype in schema.items():
+        if dtype != pl.String:
+            continue
+        for key, target in dtypes.items():
+            if col == key or col.startswith(f"{key}_"):
+                casts.append(pl.col(col).cast(target))
+                break
+    return lf.with_columns(casts) if casts else lf
+
+
+def decode_low_cardinality(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """Cast all Enum/Categorical columns back to plain strings, e.g. right before writing outputs.
+
+    Examples:
+        >>> lf = pl.LazyFrame({"a": ["x"], "b": [1]}, schema={"a": pl.Enum(["x"]), "b": pl.Int64})
+        >>> dict(decode_low_cardinality(lf).collect_schema())
+        {'a': String, 'b': Int64}
+    """
+    encoded = [
+        col
+        for col, dtype in lf.collect_schema().items()
+        if isinstance(dtype, (pl.Enum, pl.Categorical))
+    ]
+    return lf.with_columns(pl.col(encoded).cast(pl.String)) if encoded else lf
+
+
+DTYPE_POLICY_KEYS = ("ids", "values")
+
+
+def _policy_id_cols(schema: pl.Schema) -> list[str]:
+    return [
+        col
+        for col, dtype in schema.items()
+        if dtype == pl.Int64 and col.endswith("_concept_id")
+    ]
+
+
+def apply_dtype_policy(lf: pl.LazyFrame, policy: Mapping | None) -> pl.LazyFrame:
+    """Downcast the concept id and value columns of a pre-MEDS table following ``policy``.
+
+    ``policy["ids"]`` is applied to all ``Int64`` columns ending in ``_concept_id``. Row and link ids
+    (``person_id``, ``visit_occurrence_id``, ``measurement_id``, ...) are often hashed 64-bit values and keep
+    their dtype, so the MEDS schema of those columns does not change. ``policy["values"]`` is applied to all
+    ``Float64`` columns (e.g. ``value_as_number``, ``quantity``). Unset entries leave those columns untouched.
+    Integer downcasts are strict, so an id that does not fit raises ``InvalidOperationError`` when the frame is
+    collected; :func:`resolve_dtype_policy` checks the ``ids`` entry against the concept table beforehand.
+
+    Timestamps are left alone: a polars ``Datetime`` takes 8 bytes at any time unit and dates are already
+    4-byte ``Date`` columns.
+
+    Examples:
+        >>> lf = pl.LazyFrame({"person_id": [1], "visit_occurrence_id": [2], "visit_concept_id": [2],
+        ...                    "quantity": [1.5], "x": [3]})
+        >>> dict(apply_dtype_policy(lf, {"ids": "Int32", "values": "Float32"}).collect_schema())
+        {'person_id': Int64, 'visit_occurrence_id': Int64, 'visit_concept_id': Int32, 'quantity': Float32, 'x': Int64}
+        >>> apply_dtype_policy(lf, {"ids": "Int32"}).collect_schema()["quantity"]
+        Float64
+        >>> apply_dtype_policy(lf, {"dates": "Date"})
+        Traceback (most recent call last):
+            ...
+        ValueError: Unknown dtype policy keys: ['dates']
+    """
+    policy = dict(policy or {})
+    unknown = sorted(set(policy) - set(DTYPE_POLICY_KEYS))
+    if unknown:
+        raise ValueError(f"Unknown dtype policy keys: {unknown}")
+
+    schema = lf.collect_schema()
+    casts = []
+    if policy.get("ids"):
+        ids_dtype = getattr(pl, policy["ids"])
+        casts.extend(
+            pl.col(col).cast(ids_dtype, strict=True) for col in _policy_id_cols(schema)
+        )
+    if policy.get("values"):
+        values_dtype = getattr(pl, policy["values"])
+        casts.extend(
+            pl.col(col).cast(values_dtype)
+            for col, dtype in schema.items()
+            if dtype == pl.Float64
+        )
+    return lf.with_columns(casts) if casts else lf
+
+
+def resolve_dtype_policy(
+    policy: Mapping | None, concept_df: pl.LazyFrame
+) -> dict | None:
+    """Drop the ``ids`` entry of ``policy`` if the ``concept_id`` range of the concept table does not fit it.
+
+    OMOP ``*_concept_id`` columns are foreign keys into the concept table, so its ``concept_id`` range bounds
+    every concept id column of the outputs. The range is read once, from the concept table only, and the output
+    plans are still executed in a single pass. An output concept id outside of that range fails the strict cast
+    of :func:`apply_dtype_policy` when sinking rather than being silently widened or truncated.
+
+    Examples:
+        >>> resolve_dtype_policy({"ids": "Int32", "values": "Float32"}, pl.LazyFrame({"concept_id": [0, 2**31 - 1]}))
+        {'ids': 'Int32', 'values': 'Float32'}
+        >>> resolve_dtype_policy({"ids": "Int32", "values": "Float32"}, pl.LazyFrame({"concept_id": [0, 2**40]}))
+        {'ids': None, 'values': 'Float32'}
+        >>> resolve_dtype_policy(None, pl.LazyFrame({"concept_id": [2**40]})) is None
+        True
+    """
+    if not policy or not policy.get("ids"):
+        return dict(policy) if policy else None
+
+    bounds = (
+        concept_df.select(
+            pl.concat_list(pl.col("concept_id").min(), pl.col("concept_id").max())
+        )
+        .collect()
+        .to_series()
+        .explode()
+        .drop_nulls()
+    )
+    if bounds.cast(getattr(pl, policy["ids"]), strict=False).null_count():
+        logger.warning(
+            f"concept_id range [{bounds.min()}, {bounds.max()}] does not fit {policy['ids']}; "
+            "keeping concept id columns at their original dtype"
+        )
+        return {**policy, "ids": None}
+    return dict(policy)
+
+
+def sink_parquet_with_dtype_policy(
+    lf: pl.LazyFrame,
+    out_fp: Path,
+    policy: Mapping | None,
+    transform: Callable[[pl.LazyFrame], pl.LazyFrame] | None = None,
+    **sink_kwargs,
+) -> int:
+    """Sink ``lf`` in a single execution with :func:`apply_dtype_policy` applied.
+
+    ``policy`` should come from :func:`resolve_dtype_policy`, which decides the ``ids`` downcast once from the
+    concept table without running ``lf``. Errors of the plan itself are raised as they are. An optional
+    ``transform`` is applied to the downcast frame right before sinking.
+
+    Returns:
+        The number of rows written, as returned by :func:`sink_parquet_counted`.
+
+    Examples:
+        >>> import tempfile
+        >>> lf = pl.LazyFrame({"person_id": [2**40], "visit_concept_id": [3], "value_as_number": [1.5]})
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     fp = Path(tmpdir) / "t.parquet"
+        ...     n = sink_parquet_with_dtype_policy(lf, fp, {"ids": "Int32", "values": "Float32"})
+        ...     n, dict(pl.read_parquet_schema(fp))
+        (1, {'person_id': Int64, 'visit_concept_id': Int32, 'value_as_number': Float32})
+    """
+    transform = transform or (lambda df: df)
+    return sink_parquet_counted(
+        transform(apply_dtype_policy(lf, policy)), out_fp, **sink_kwargs
+    )
+
+
+def parquet_num_rows(fp: Path) -> int:
+    """Return the number of rows in a parquet file, read from its footer only.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     fp = Path(tmpdir) / "t.parquet"
+        ...     pl.DataFrame({"a": [1, 2, 3]}).write_parquet(fp)
+        ...     parquet_num_rows(fp)
+        3
+    """
+    return pq.ParquetFile(fp).metadata.num_rows
+
+
+def sink_parquet_counted(lf: pl.LazyFrame, out_fp: Path, **sink_kwargs) -> int:
+    """Sink a LazyFrame to parquet in a single execution and return the written row count.
+
+    The row count is taken from the written file's footer, so the lazy plan is executed exactly once.
+    Outputs without any rows are deleted again so callers can treat a return value of ``0`` as "skipped".
+
+    Args:
+        lf: The LazyFrame to write.
+        out_fp: The parquet file to write to.
+        **sink_kwargs: Extra keyword arguments forwarded to ``LazyFrame.sink_parquet``.
+
+    Returns:
+        The number of rows written to ``out_fp``; ``0`` if the output was empty and has been removed.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     fp = Path(tmpdir) / "t.parquet"
+        ...     n = sink_parquet_counted(pl.LazyFrame({"a": [1, 2]}), fp)
+        ...     n, fp.is_file()
+        (2, True)
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     fp = Path(tmpdir) / "t.parquet"
+        ...     n = sink_parquet_counted(pl.LazyFrame({"a": [1, 2]}).filter(pl.col("a") > 5), fp)
+        ...     n, fp.exists()
+        (0, False)
+    """
+    lf.sink_parquet(out_fp, **sink_kwargs)
+    if not out_fp.is_file():
+        return 0
+
+    n_rows = parquet_num_rows(out_fp)
+    if n_rows == 0:
+        logger.debug(f"Removing empty parquet output {out_fp}")
+        out_fp.unlink()
+    return n_rows
+
+
+def plan_compaction(
+    part_stats: list[tuple[Path, int, int]], target_file_bytes: int
+) -> list[list[tuple[Path, int, int]]]:
+    """Plan how to rewrite a sequence of parquet parts into evenly sized output files.
+
+    The parts are treated as one concatenated row stream. The average on-disk bytes per row is used to
+    translate ``target_file_bytes`` into a row target, and the stream is then cut into that many
+    equally-sized slices, so both many tiny parts and a few huge parts end up balanced.
+
+    Args:
+        part_stats: ``(path, num_rows, num_bytes)`` for each part, in output order.
+        target_file_bytes: The desired on-disk size of each output file.
+
+    Returns:
+        One list of ``(path, row_offset, num_rows)`` segments per output file.
+
+    Examples:
+        >>> plan_compaction([(Path("a"), 10, 100), (Path("b"), 10, 100)], target_file_bytes=1_000)
+        [[(PosixPath('a'), 0, 10), (PosixPath('b'), 0, 10)]]
+        >>> for out in plan_compaction([(Path("a"), 9, 90), (Path("b"), 3, 30)], target_file_bytes=40):
+        ...     print(out)
+        [(PosixPath('a'), 0, 4)]
+        [(PosixPath('a'), 4, 4)]
+        [(PosixPath('a'), 8, 1), (PosixPath('b'), 0, 3)]
+        >>> plan_compaction([(Path("a"), 0, 10)], target_file_bytes=40)
+        []
+    """
+    total_rows = sum(n_rows for _, n_rows, _ in part_stats)
+    total_bytes = sum(n_bytes for _, _, n_bytes in part_stats)
+    if total_rows == 0:
+        return []
+
+    n_files = max(1, math.ceil(total_bytes / max(1, target_file_bytes)))
+    n_files = min(n_files, total_rows)
+    rows_per_file = math.ceil(total_rows / n_files)
+
+    outputs: list[list[tuple[Path, int, int]]] = []
+    current: list[tuple[Path, int, int]] = []
+    current_rows = 0
+    for path, n_rows, _ in part_stats:
+        offset = 0
+        while offset < n_rows:
+            take = min(n_rows - offset, rows_per_file - current_rows)
+            current.append((path, offset, take))
+            offset += take
+            current_rows += take
+            if current_rows == rows_per_file:
+                outputs.append(current)
+                current = []
+                current_rows = 0
+    if current:
+        outputs.append(current)
+    return outputs
+
+
+def _write_compacted_file(
+    segments: list[tuple[Path, int, int]],
+    out_fp: Path,
+    sort_by: list[str] | None = None,
+    **sink_kwargs,
+) -> Path:
+    frames = [pl.scan_parquet(path).slice(offset, n) for path, offset, n in segments]
+    lf = frames[0] if len(frames) == 1 else pl.concat(frames, how="vertical_relaxed")
+    if sort_by:
+        lf = lf.sort(sort_by, nulls_last=True)
+    lf.sink_parquet(out_fp, **sink_kwargs)
+    return out_fp
+
+
+def compact_parquet_parts(
+    parts_dir: Path,
+    target_file_bytes: int,
+    row_group_size: int = 128_000,
+    n_workers: int = 1,
+    sort_by: list[str] | None = None,
+    **sink_kwargs,
+) -> list[Path]:
+    """Rewrite the ``part_*.parquet`` files in ``parts_dir`` into files of roughly ``target_file_bytes``.
+
+    MEDS-Extract's ``shard_events`` stage treats each input file as a unit of work, so balanced file sizes
+    translate directly into balanced, parallelizable downstream stages. Output files are written in parallel
+    to a temporary directory and only swapped in once all of them are complete.
+
+    Args:
+        parts_dir: The directory holding the batched ``part_*.parquet`` files of one table.
+        target_file_bytes: The desired on-disk size of each output file.
+        row_group_size: The parquet row-group size of the rewritten files.
+        n_workers: The number of output files to write concurrently.
+        sort_by: If given, the columns every rewritten file is sorted by, so that merged parts stay sorted.
+        **sink_kwargs: Extra keyword arguments (e.g. compression) forwarded to ``LazyFrame.sink_parquet``.
+
+    Returns:
+        The sorted list of part files in ``parts_dir`` after compaction.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     parts_dir = Path(tmpdir)
+        ...     for i in range(6):
+        ...         pl.DataFrame({"a": list(range(i * 10, i * 10 + 10))}).write_parquet(
+        ...             parts_dir / f"part_{i:05d}.parquet"
+        ...         )
+        ...     out = compact_parquet_parts(parts_dir, target_file_bytes=10**9, n_workers=2)
+        ...     [p.name for p in out], pl.read_parquet(out[0])["a"].to_list() == list(range(60))
+        (['part_00000.parquet'], True)
+    """
+    parts = sorted(parts_dir.glob("part_*.parquet"))
+    if not parts:
+        return []
+
+    part_stats = [(p, parquet_num_rows(p), p.stat().st_size) for p in parts]
+    plan = plan_compaction(part_stats, target_file_bytes)
+    if len(plan) == len(parts) and all(
+        len(segments) == 1 and segments[0][1] == 0 and segments[0][2] == n_rows
+        for segments, (_, n_rows, _) in zip(plan, part_stats)
+    ):
+        logger.info(f"Parts in {parts_dir} are already balanced; skipping compaction")
+        return parts
+
+    tmp_dir = parts_dir / ".compacted"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    out_fps = [tmp_dir / f"part_{i:05d}.parquet" for i in range(len(plan))]
+    with ThreadPoolExecutor(max_workers=max(1, n_workers)) as executor:
+        futures = [
+            executor.submit(
+                _write_compacted_file,
+                segments,
+                out_fp,
+                sort_by,
+                **{**sink_kwargs, "row_group_size": row_group_size},
+            )
+            for segments, out_fp in zip(plan, out_fps)
+        ]
+        for future in futures:
+            future.result()
+
+    for part in parts:
+        part.unlink()
+    for out_fp in out_fps:
+        out_fp.replace(parts_dir / out_fp.name)
+    tmp_dir.rmdir()
+
+    logger.info(
+        f"Compacted {len(parts)} parts into {len(out_fps)} files of ~{target_file_bytes} bytes in {parts_dir}"
+    )
+    return sorted(parts_dir.glob("part_*.parquet"))
+
+
+SUBJECT_INDEX_FN = ".subject_index.parquet"
+
+
+def event_sort_cols(
+    schema: pl.Schema, subject_col: str, time_cols: list[str]
+) -> list[str]:
+    """Return the columns a pre-MEDS table is sorted by: the subject id, then its event time.
+
+    The event time is the first of ``time_cols`` present in ``schema``; if none is, the first temporal column of
+    the table is used, and tables without any temporal column are sorted by subject only.
+
+    Examples:
+        >>> schema = pl.Schema({"person_id": pl.Int64, "start": pl.Date, "end": pl.Datetime("us")})
+        >>> event_sort_cols(schema, "person_id", ["end", "start"])
+        ['person_id', 'end']
+        >>> event_sort_cols(schema, "person_id", ["missing"])
+        ['person_id', 'start']
+        >>> event_sort_cols(pl.Schema({"person_id": pl.Int64}), "person_id", [])
+        ['person_id']
+    """
+    for col in time_cols:
+        if col in schema:
+            return [subject_col, col]
+    for col, dtype in schema.items():
+        if dtype.is_temporal() and col != subject_col:
+            return [subject_col, col]
+    return [subject_col]
+
+
+def build_subject_index(pre_MEDS_dir: Path, subject_col: str) -> pl.DataFrame:
+    """Map the ``subject_col`` range of every row group of every pre-MEDS table file, read from footers only.
+
+    On subject-sorted outputs each row group covers a narrow range of subjects, so the index lets per-subject
+    lookups (see :func:`read_subject_rows`) skip almost every row group. Files without ``subject_col`` or
+    without min/max statistics are left out. Hidden files and directories (sidecars, temporary outputs) are
+    skipped.
+
+    Args:
+        pre_MEDS_dir: The pre-MEDS output directory.
+        subject_col: The subject id column.
+
+    Returns:
+        One row per row group with the table, the file path relative to ``pre_MEDS_dir``, the row group index,
+        its row count, and its min/max subject id.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     df = pl.DataFrame({"person_id": [1, 1, 2, 5, 7, 9], "v": list(range(6))})
+        ...     df.write_parquet(Path(tmpdir) / "measurement.parquet", row_group_size=3)
+        ...     build_subject_index(Path(tmpdir), "person_id")
+        shape: (2, 6)
+        ┌─────────────┬─────────────────────┬───────────┬──────────┬─────────────┬─────────────┐
+        │ table       ┆ file                ┆ row_group ┆ num_rows ┆ min_subject ┆ max_subject │
+        │ ---         ┆ ---                 ┆ ---       ┆ ---      ┆ ---         ┆ ---         │
+        │ str         ┆ str                 ┆ i64       ┆ i64      ┆ i64         ┆ i64         │
+        ╞═════════════╪═════════════════════╪═══════════╪══════════╪═════════════╪═════════════╡
+        │ measurement ┆ measurement.parquet ┆ 0         ┆ 3        ┆ 1           ┆ 2           │
+        │ measurement ┆ measurement.parquet ┆ 1         ┆ 3        ┆ 5           ┆ 9           │
+        └─────────────┴─────────────────────┴───────────┴──────────┴─────────────┴─────────────┘
+    """
+    rows = []
+    for fp in sorted(pre_MEDS_dir.rglob("*.parquet")):
+        rel_fp = fp.relative_to(pre_MEDS_dir)
+        if any(part.startswith(".") for part in rel_fp.parts) or not fp.is_file():
+            continue
+        metadata = pq.ParquetFile(fp).metadata
+        col_names = [
+            metadata.schema.column(i).name for i in range(metadata.num_columns)
+        ]
+        if subject_col not in col_names:
+            continue
+        col_idx = col_names.index(subject_col)
+        table = rel_fp.parts[0] if len(rel_fp.parts) > 1 else fp.stem
+        for rg in range(metadata.num_row_groups):
+            stats = metadata.row_group(rg).column(col_idx).statistics
+            if stats is None or not stats.has_min_max:
+                continue
+            rows.append(
+                {
+                    "table": table,
+                    "file": rel_fp.as_posix(),
+                    "row_group": rg,
+                    "num_rows": metadata.row_group(rg).num_rows,
+                    "min_subject": int(stats.min),
+                    "max_subject": int(stats.max),
+                }
+            )
+
+    return pl.DataFrame(
+        rows,
+        schema={
+            "table": pl.String,
+            "file": pl.String,
+            "row_group": pl.Int64,
+            "num_rows": pl.Int64,
+            "min_subject": pl.Int64,
+            "max_subject": pl.Int64,
+        },
+    )
+
+
+def read_subject_rows(
+    pre_MEDS_dir: Path,
+    subject_index: pl.DataFrame,
+    table: str,
+    subject_col: str,
+    subject_id: int,
+) -> pl.DataFrame:
+    """Read the rows of one subject from a pre-MEDS table, touching only the row groups that may contain it.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     df = pl.DataFrame({"person_id": [1, 1, 2, 5, 7, 9], "v": list(range(6))})
+        ...     df.write_parquet(Path(tmpdir) / "measurement.parquet", row_group_size=3)
+        ...     index = build_subject_index(Path(tmpdir), "person_id")
+        ...     read_subject_rows(Path(tmpdir), index, "measurement", "person_id", 1)["v"].to_list()
+        [0, 1]
+    """
+    candidates = subject_index.filter(
+        (pl.col("table") == table)
+        & (pl.col("min_subject") <= subject_id)
+        & (pl.col("max_subject") >= subject_id)
+    )
+    frames = []
+    for (file,), groups in candidates.group_by("file", maintain_order=True):
+        row_groups = groups["row_group"].to_list()
+        arrow_table = pq.ParquetFile(pre_MEDS_dir / file).read_row_groups(row_groups)
+        frames.append(
+            pl.from_arrow(arrow_table).filter(pl.col(subject_col) == subject_id)
+        )
+    if not frames:
+        return pl.DataFrame()
+    return pl.concat(frames, how="vertical_relaxed")
+
+
+SCHEMA_MANIFEST_FN = ".schema.json"
+
+
+def build_schema_manifest(
+    pre_MEDS_dir: Path, tables: Collection[str] | None = None
+) -> dict:
+    """Collect the exact schema and row count of every pre-MEDS output file, read from footers only.
+
+    Files are keyed by their prefix relative to ``pre_MEDS_dir``, i.e. the input prefixes of the MEDS-Extract
+    event conversion config. Dtypes are Polars dtype strings. Hidden files and directories are skipped. With
+    ``tables``, only the files of those tables (``<table>.parquet`` or ``<table>/**/*.parquet``) are read.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     (Path(tmpdir) / "measurement").mkdir()
+        ...     pl.DataFrame({"person_id": [1, 2], "value": [0.5, None]}).write_parquet(
+        ...         Path(tmpdir) / "measurement" / "part_00000.parquet"
+        ...     )
+        ...     build_schema_manifest(Path(tmpdir))
+        {'measurement/part_00000': {'columns': {'person_id': 'Int64', 'value': 'Float64'}, 'num_rows': 2}}
+    """
+    if tables is None:
+        fps = pre_MEDS_dir.rglob("*.parquet")
+    else:
+        fps = [pre_MEDS_dir / f"{table}.parquet" for table in tables]
+        fps += [
+            fp for table in tables for fp in (pre_MEDS_dir / table).rglob("*.parquet")
+        ]
+    manifest = {}
+    for fp in sorted(fps):
+        rel_fp = fp.relative_to(pre_MEDS_dir)
+        if any(part.startswith(".") for part in rel_fp.parts) or not fp.is_file():
+            continue
+        manifest[rel_fp.with_suffix("").as_posix()] = {
+            "columns": {
+                name: str(dtype) for name, dtype in pl.read_parquet_schema(fp).items()
+            },
+            "num_rows": parquet_num_rows(fp),
+        }
+    return manifest
+
+
+def read_schema_manifest(pre_MEDS_dir: Path) -> dict | None:
+    """Read the schema manifest of ``pre_MEDS_dir``, or ``None`` if pre-MEDS did not write one."""
+    manifest_fp = pre_MEDS_dir / SCHEMA_MANIFEST_FN
+    if not manifest_fp.is_file():
+        return None
+    return json.loads(manifest_fp.read_text(encoding="utf-8"))
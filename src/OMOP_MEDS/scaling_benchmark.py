@@ -0,0 +1,310 @@
+"""End-to-end benchmark of the ETL on synthetic datasets of several sizes and over a grid of configurations."""
+
+import itertools
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+import hydra
+import polars as pl
+from omegaconf import DictConfig, OmegaConf
+
+from . import SCALING_BENCHMARK_CFG
+from .commands import StageMonitor
+from .microbenchmarks import environment_info
+from .synthetic import generate_omop_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def grid_configs(grid: dict | None) -> list[dict]:
+    """The configurations of a grid: the product of the values of every key.
+
+    Examples:
+        >>> grid_configs({"N_WORKERS": [1, 4], "pre_meds_batch_mode": ["auto"]})
+        [{'N_WORKERS': 1, 'pre_meds_batch_mode': 'auto'}, {'N_WORKERS': 4, 'pre_meds_batch_mode': 'auto'}]
+        >>> grid_configs({})
+        [{}]
+    """
+    grid = grid or {}
+    return [
+        dict(zip(grid, values))
+        for values in itertools.product(*(grid[key] for key in grid))
+    ]
+
+
+def split_config(config: dict) -> tuple[dict[str, str], list[str]]:
+    """Split a configuration into environment variables (upper-case keys) and ``main.yaml`` overrides.
+
+    Examples:
+        >>> split_config({"N_WORKERS": 4, "pre_meds_batch_mode": "by_rows", "stage_runner_fp": None,
+        ...               "pre_meds_chunked_tables": ["measurement"]})
+        ({'N_WORKERS': '4'}, ['++pre_meds_batch_mode=by_rows', '++stage_runner_fp=null', '++pre_meds_chunked_tables=["measurement"]'])
+    """
+    env = {key: str(value) for key, value in config.items() if key.isupper()}
+    overrides = [
+        f"++{key}={value if isinstance(value, str) else json.dumps(value)}"
+        for key, value in config.items()
+        if not key.isupper()
+    ]
+    return env, overrides
+
+
+def directory_bytes(path: Path) -> int:
+    """The total size of the files below ``path`` (0 if it does not exist)."""
+    return sum(fp.stat().st_size for fp in Path(path).rglob("*") if fp.is_file())
+
+
+def _config_label(config: dict) -> str:
+    return " ".join(f"{key}={value}" for key, value in config.items()) or "default"
+
+
+def prepare_dataset(data_dir: Path, n_persons: int, dataset: dict) -> dict:
+    """Generate the synthetic dataset of ``n_persons`` persons, unless ``data_dir`` already holds it.
+
+    The generator parameters and row counts are kept in ``data_dir/.dataset.json``, so a dataset is reused by
+    later runs with the same parameters and regenerated otherwise.
+
+    Returns:
+        The row counts of the dataset's tables.
+    """
+    params = {"n_persons": n_persons, **dataset}
+    info_fp = data_dir / ".dataset.json"
+    if info_fp.is_file():
+        info = json.loads(info_fp.read_text())
+        if info["params"] == params:
+            logger.info(
+                f"Reusing the synthetic dataset of {n_persons} persons in {data_dir}"
+            )
+            return info["rows"]
+    if data_dir.exists():
+        shutil.rmtree(data_dir)
+    rows = generate_omop_dataset(data_dir, **params)
+    info_fp.write_text(json.dumps({"params": params, "rows": rows}, indent=2))
+    return rows
+
+
+def run_etl(
+    raw_input_dir: Path,
+    output_dir: Path,
+    config: dict,
+    overrides: list[str] | None = None,
+    env: dict[str, str] | None = None,
+) -> dict:
+    """Run the full ETL (``python -m OMOP_MEDS``) in a subprocess and measure it.
+
+    The ETL output goes to ``output_dir/etl.log``. The wall time and peak RSS of the whole process tree are
+    tracked per stage by a :class:`StageMonitor`: ``pre_MEDS`` (everything up to the first MEDS-Extract stage)
+    and then every MEDS-Extract stage, whose markers are read from the output and from the pipeline log.
+
+    Args:
+        raw_input_dir: The OMOP input tables.
+        output_dir: Where the run writes its ``pre_MEDS`` and ``MEDS_cohort`` outputs and its log.
+        config: The configuration of this run (see :func:`split_config`).
+        overrides: ``main.yaml`` overrides of every run, applied before those of ``config``.
+        env: Environment variables of every run (e.g. ``OMOP_VERSION``), updated by those of ``config``.
+
+    Returns:
+        The run's status, return code, wall time, peak RSS, per-stage times and output sizes.
+    """
+    config_env, config_overrides = split_config(config)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    root_output_dir = output_dir / "output"
+    meds_cohort_dir = root_output_dir / "MEDS_cohort"
+    command = [
+        sys.executable,
+        "-m",
+        "OMOP_MEDS",
+        f"root_output_dir={root_output_dir.resolve()}",
+        f"raw_input_dir={Path(raw_input_dir).resolve()}",
+        "do_download=False",
+        "do_demo=False",
+        "do_overwrite=True",
+        *(overrides or []),
+        *config_overrides,
+    ]
+    log_fp = output_dir / "etl.log"
+    logger.info(f"Running the ETL with {_config_label(config)}; logging to {log_fp}")
+    tail: deque[str] = deque(maxlen=50)
+    start = time.monotonic()
+    with open(log_fp, "w", encoding="utf-8") as log:
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env={**os.environ, **(env or {}), **config_env},
+            text=True,
+            bufsize=1,
+        )
+        with StageMonitor(
+            pid=process.pid, log_fp=meds_cohort_dir / ".logs" / "pipeline.log"
+        ) as monitor:
+            monitor.start_stage("pre_MEDS")
+            for line in process.stdout:
+                log.write(line)
+                tail.append(line.rstrip("\n"))
+                monitor.feed(line)
+            returncode = process.wait()
+    wall_time = time.monotonic() - start
+
+    stages = monitor.summary()
+    if returncode != 0:
+        stages[-1]["status"] = "failed"
+        output = "\n".join(tail)
+        logger.error(f"The ETL failed with return code {returncode}:\n{output}")
+    peaks = [s["peak_rss_bytes"] for s in stages if s["peak_rss_bytes"] is not None]
+
+    meds_data = list((meds_cohort_dir / "data").rglob("*.parquet"))
+    return {
+        "status": "completed" if returncode == 0 else "failed",
+        "returncode": returncode,
+        "wall_time_s": round(wall_time, 3),
+        "peak_rss_bytes": max(peaks) if peaks else None,
+        "stages": stages,
+        "pre_MEDS_bytes": directory_bytes(root_output_dir / "pre_MEDS"),
+        "MEDS_bytes": directory_bytes(meds_cohort_dir / "data")
+        + directory_bytes(meds_cohort_dir / "metadata"),
+        "meds_events": pl.scan_parquet(meds_data).select(pl.len()).collect().item()
+        if meds_data and returncode == 0
+        else None,
+    }
+
+
+def run_scaling_benchmark(
+    work_dir: Path,
+    scales: list[int],
+    grid: dict | None = None,
+    dataset: dict | None = None,
+    overrides: list[str] | None = None,
+    keep_outputs: bool = False,
+) -> dict:
+    """Run the ETL for every scale (synthetic persons) and every configuration of ``grid``.
+
+    Args:
+        work_dir: Holds the synthetic datasets (``data/<n>_persons``, reused across runs) and the outputs of
+            every run (``runs/<n>_persons/<i>``).
+        scales: The numbers of synthetic persons.
+        grid: Lists of values of ``main.yaml`` keys and of environment variables (upper-case keys, e.g.
+            ``N_WORKERS``); every combination is run (see :func:`grid_configs`).
+        dataset: Further :func:`generate_omop_dataset` arguments, e.g. ``layout`` or ``omop_version``.
+        overrides: ``main.yaml`` overrides of every run.
+        keep_outputs: Keep the ``pre_MEDS`` and ``MEDS_cohort`` outputs of every run (its log is always kept).
+
+    Returns:
+        The run's :func:`environment_info` with the dataset parameters and a ``results`` list with the
+        :func:`run_etl` result of every scale and configuration.
+    """
+    work_dir = Path(work_dir)
+    dataset = dict(dataset or {})
+    env = {
+        "DATASET_NAME": "SYNTHETIC_OMOP",
+        "OMOP_VERSION": str(dataset.get("omop_version", 5.3)),
+    }
+    configs = grid_configs(grid)
+    info = environment_info()
+    results = []
+    for n_persons in scales:
+        data_dir = work_dir / "data" / f"{n_persons}_persons"
+        rows = prepare_dataset(data_dir, n_persons, dataset)
+        for i, config in enumerate(configs):
+            run_dir = work_dir / "runs" / f"{n_persons}_persons" / str(i)
+            result = run_etl(data_dir, run_dir, config, overrides=overrides, env=env)
+            if not keep_outputs:
+                shutil.rmtree(run_dir / "output", ignore_errors=True)
+            logger.info(
+                f"{n_persons} persons, {_config_label(config)}: {result['status']} in "
+                f"{result['wall_time_s']:.1f}s"
+            )
+            results.append(
+                {
+                    "n_persons": n_persons,
+                    "config": config,
+                    "input_rows": sum(rows.values()),
+                    "input_bytes": directory_bytes(data_dir),
+                    **result,
+                }
+            )
+    return {
+        **info,
+        "dataset": dataset,
+        "overrides": overrides or [],
+        "results": results,
+    }
+
+
+def results_table(results: dict) -> pl.DataFrame:
+    """The results of a run as a table, with a ``<stage>_s`` column of the wall time of every stage.
+
+    Examples:
+        >>> run = {"results": [{"n_persons": 1000, "config": {"N_WORKERS": 2}, "status": "completed",
+        ...                     "wall_time_s": 10.0, "peak_rss_bytes": 512 * 1024**2, "input_rows": 50000,
+        ...                     "input_bytes": 4 * 1024**2, "pre_MEDS_bytes": 3 * 1024**2,
+        ...                     "MEDS_bytes": 2 * 1024**2, "meds_events": 40000,
+        ...                     "stages": [{"stage": "pre_MEDS", "wall_time_s": 6.0},
+        ...                                {"stage": "shard_events", "wall_time_s": 4.0}]}]}
+        >>> results_table(run).row(0, named=True)  # doctest: +NORMALIZE_WHITESPACE
+        {'n_persons': 1000, 'config': 'N_WORKERS=2', 'status': 'completed', 'wall_time_s': 10.0,
+         'peak_rss_mb': 512.0, 'input_mb': 4.0, 'pre_MEDS_mb': 3.0, 'MEDS_mb': 2.0, 'meds_events': 40000,
+         'events_per_s': 4000.0, 'pre_MEDS_s': 6.0, 'shard_events_s': 4.0}
+    """
+    rows = []
+    for r in results["results"]:
+        row = {
+            "n_persons": r["n_persons"],
+            "config": _config_label(r["config"]),
+            "status": r["status"],
+            "wall_time_s": r["wall_time_s"],
+            "peak_rss_mb": r["peak_rss_bytes"] / 1024**2
+            if r["peak_rss_bytes"] is not None
+            else None,
+            "input_mb": r["input_bytes"] / 1024**2,
+            "pre_MEDS_mb": r["pre_MEDS_bytes"] / 1024**2,
+            "MEDS_mb": r["MEDS_bytes"] / 1024**2,
+            "meds_events": r["meds_events"],
+            "events_per_s": r["meds_events"] / r["wall_time_s"]
+            if r["meds_events"] is not None and r["wall_time_s"] > 0
+            else None,
+        }
+        for stage in r["stages"]:
+            row[f"{stage['stage']}_s"] = stage["wall_time_s"]
+        rows.append(row)
+    return pl.DataFrame(
+        rows,
+        schema_overrides={
+            "peak_rss_mb": pl.Float64,
+            "meds_events": pl.Int64,
+            "events_per_s": pl.Float64,
+        },
+    )
+
+
+@hydra.main(
+    version_base=None,
+    config_path=str(SCALING_BENCHMARK_CFG.parent),
+    config_name=SCALING_BENCHMARK_CFG.stem,
+)
+def main(cfg: DictConfig):
+    """Runs the scaling benchmark and writes its results to ``cfg.output_fp``."""
+    results = run_scaling_benchmark(
+        Path(cfg.work_dir),
+        scales=[int(n) for n in cfg.scales],
+        grid=OmegaConf.to_container(cfg.grid) if cfg.get("grid") else None,
+        dataset=OmegaConf.to_container(cfg.dataset) if cfg.get("dataset") else None,
+        overrides=[str(o) for o in cfg.get("overrides") or []],
+        keep_outputs=bool(cfg.keep_outputs),
+    )
+    output_fp = Path(cfg.output_fp)
+    output_fp.parent.mkdir(parents=True, exist_ok=True)
+    output_fp.write_text(json.dumps(results, indent=2))
+    logger.info(f"Wrote the results to {output_fp}")
+
+    table = results_table(results)
+    table.write_csv(output_fp.with_suffix(".csv"))
+    with pl.Config(tbl_rows=-1, tbl_cols=-1, tbl_width_chars=250):
+        logger.info(f"Results:\n{table}")
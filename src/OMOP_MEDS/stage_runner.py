@@ -0,0 +1,340 @@
+"""Sizes MEDS-Extract stage parallelism from the machine and the pre-MEDS data volume."""
+
+import logging
+import os
+import math
+import shlex
+from collections.abc import Mapping
+from pathlib import Path
+
+import polars as pl
+from omegaconf import DictConfig, OmegaConf
+
+from .pre_meds_writer import estimate_row_width, parquet_num_rows
+
+logger = logging.getLogger(__name__)
+
+# Stages whose unit of work is one pre-MEDS input file.
+INPUT_FILE_STAGES = ["shard_events"]
+# Stages whose unit of work is one subject shard.
+SUBJECT_SHARD_STAGES = [
+    "convert_to_subject_sharded",
+    "convert_to_MEDS_events",
+    "merge_to_MEDS_cohort",
+    "extract_code_metadata",
+    "finalize_MEDS_data",
+]
+# Stages that run as a single job regardless of the number of workers.
+SINGLE_WORKER_STAGES = ["split_and_shard_subjects", "finalize_MEDS_metadata"]
+
+
+# Core columns of a MEDS event; any further event config fields are counted as strings.
+MEDS_EVENT_SCHEMA = {
+    "subject_id": pl.Int64,
+    "time": pl.Datetime("us"),
+    "code": pl.String,
+    "numeric_value": pl.Float32,
+}
+
+
+def available_cpus() -> int:
+    """Number of CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):  # Linux only
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def available_memory_bytes() -> int | None:
+    """Memory available for new work, read from ``/proc/meminfo`` (``None`` where unavailable)."""
+    meminfo = Path("/proc/meminfo")
+    if meminfo.is_file():
+        for line in meminfo.read_text().splitlines():
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _n_workers(
+    n_units: int,
+    n_cpus: int,
+    memory_bytes: int | None,
+    worker_memory_bytes: int,
+    max_workers: int | None,
+) -> int:
+    n_workers = min(n_cpus, max(1, n_units))
+    if memory_bytes is not None and worker_memory_bytes > 0:
+        n_workers = min(n_workers, memory_bytes // worker_memory_bytes)
+    if max_workers:
+        n_workers = min(n_workers, max_workers)
+    return max(1, int(n_workers))
+
+
+def plan_stage_workers(
+    input_file_bytes: list[int],
+    n_subject_shards: int,
+    n_cpus: int,
+    memory_bytes: int | None,
+    max_workers: int | None = None,
+    memory_factor: float = 5.0,
+    memory_fraction: float = 0.8,
+) -> dict[str, dict[str, int]]:
+    """Choose the number of workers and Polars threads per worker for every MEDS-Extract stage.
+
+    Each stage gets at most one worker per unit of work (input file for ``shard_events``, subject shard for the
+    shard-level stages), per CPU, and per ``memory_factor`` times the on-disk bytes one worker holds in memory
+    (the largest input file, or the average shard), within ``memory_fraction`` of the available memory. The
+    CPUs are then split evenly over the workers, so that the workers' Polars thread pools together do not
+    oversubscribe the machine.
+
+    Args:
+        input_file_bytes: The on-disk sizes of the pre-MEDS input files.
+        n_subject_shards: The expected number of subject shards over all splits.
+        n_cpus: The number of available CPUs.
+        memory_bytes: The available memory, or ``None`` if unknown (no memory limit is applied then).
+        max_workers: An optional cap on the number of workers of any stage.
+        memory_factor: The assumed ratio of in-memory to on-disk (compressed parquet) size.
+        memory_fraction: The fraction of ``memory_bytes`` the workers of one stage may use together.
+
+    Returns:
+        A mapping from stage name to ``{"n_workers": ..., "polars_max_threads": ...}``.
+
+    Examples:
+        >>> plan = plan_stage_workers([10**9] * 8, n_subject_shards=40, n_cpus=16, memory_bytes=64 * 10**9)
+        >>> plan["shard_events"], plan["convert_to_MEDS_events"], plan["split_and_shard_subjects"]
+        ({'n_workers': 8, 'polars_max_threads': 2}, {'n_workers': 16, 'polars_max_threads': 1}, {'n_workers': 1, 'polars_max_threads': 16})
+
+        Memory caps the number of workers holding large inputs:
+
+        >>> plan_stage_workers([20 * 10**9, 10**6], 4, n_cpus=16, memory_bytes=250 * 10**9)["shard_events"]
+        {'n_workers': 2, 'polars_max_threads': 8}
+        >>> plan_stage_workers([20 * 10**9], 4, n_cpus=16, memory_bytes=10**9)["shard_events"]
+        {'n_workers': 1, 'polars_max_threads': 16}
+        >>> plan_stage_workers([10**6] * 100, 100, n_cpus=16, memory_bytes=None, max_workers=4)["merge_to_MEDS_cohort"]
+        {'n_workers': 4, 'polars_max_threads': 4}
+    """
+    budget = int(memory_bytes * memory_fraction) if memory_bytes is not None else None
+    largest_file = max(input_file_bytes, default=0)
+    shard_bytes = sum(input_file_bytes) / max(1, n_subject_shards)
+
+    plan = {}
+    for stage in INPUT_FILE_STAGES:
+        plan[stage] = _n_workers(
+            len(input_file_bytes),
+            n_cpus,
+            budget,
+            int(largest_file * memory_factor),
+            max_workers,
+        )
+    for stage in SUBJECT_SHARD_STAGES:
+        plan[stage] = _n_workers(
+            n_subject_shards,
+            n_cpus,
+            budget,
+            int(shard_bytes * memory_factor),
+            max_workers,
+        )
+    for stage in SINGLE_WORKER_STAGES:
+        plan[stage] = 1
+
+    return {
+        stage: {"n_workers": n, "polars_max_threads": max(1, n_cpus // n)}
+        for stage, n in plan.items()
+    }
+
+
+def expected_subject_shards(n_subjects: int, n_subjects_per_shard: int) -> int:
+    """Expected number of subject shards: the train shards plus one each for the tuning and held-out splits.
+
+    Examples:
+        >>> expected_subject_shards(95_000, 10_000)
+        12
+    """
+    return max(1, math.ceil(n_subjects / max(1, n_subjects_per_shard))) + 2
+
+
+def estimate_meds_events(pre_MEDS_dir: Path, event_cfg: DictConfig) -> tuple[int, int]:
+    """Estimate the number and in-memory size of the MEDS events extracted from the pre-MEDS outputs.
+
+    Every configured event of a table yields (at most) one event per pre-MEDS row, so this is an upper bound
+    that ignores rows dropped for null codes or times.
+
+    Returns:
+        The estimated number of events and their total in-memory size in bytes.
+
+    Examples:
+        >>> import tempfile
+        >>> cfg = OmegaConf.create({
+        ...     "subject_id_col": "person_id",
+        ...     "a": {"e1": {"code": "A", "time": None}, "e2": {"code": "B", "time": "$t", "unit": "$u"}},
+        ...     "missing": {"e": {"code": "C"}},
+        ... })
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     pl.DataFrame({"person_id": [1, 1, 2]}).write_parquet(Path(tmpdir) / "a.parquet")
+        ...     estimate_meds_events(Path(tmpdir), cfg)
+        (6, 408)
+    """
+    n_events = 0
+    n_bytes = 0
+    for prefix, table_cfg in event_cfg.items():
+        fp = pre_MEDS_dir / f"{prefix}.parquet"
+        if prefix == "subject_id_col" or not fp.is_file():
+            continue
+        n_rows = parquet_num_rows(fp)
+        for event in table_cfg.values():
+            if not isinstance(event, Mapping) or "code" not in event:
+                continue
+            extra_cols = {k: pl.String for k in event if k not in MEDS_EVENT_SCHEMA}
+            extra_cols.pop("code", None)
+            n_events += n_rows
+            n_bytes += n_rows * estimate_row_width(
+                pl.Schema({**MEDS_EVENT_SCHEMA, **extra_cols})
+            )
+    return n_events, n_bytes
+
+
+def choose_subjects_per_shard(
+    n_subjects: int,
+    n_events: int,
+    event_bytes: int,
+    target_rows: int | None = None,
+    target_bytes: int | None = None,
+) -> int:
+    """Choose the number of subjects per shard so that shards hold about ``target_rows`` events or bytes.
+
+    With both targets, the smaller resulting shard wins.
+
+    Examples:
+        >>> choose_subjects_per_shard(50_000, 500_000_000, 40 * 10**9, target_rows=20_000_000)
+        2000
+        >>> choose_subjects_per_shard(50_000, 500_000_000, 40 * 10**9, 20_000_000, target_bytes=10**9)
+        1250
+        >>> choose_subjects_per_shard(50_000, 1_000_000, 80 * 10**6, target_rows=20_000_000)
+        50000
+    """
+    if n_subjects <= 0 or n_events <= 0:
+        return max(1, n_subjects)
+    candidates = []
+    if target_rows:
+        candidates.append(target_rows / (n_events / n_subjects))
+    if target_bytes:
+        candidates.append(target_bytes / (event_bytes / n_subjects))
+    if not candidates:
+        raise ValueError("At least one of target_rows or target_bytes must be given.")
+    return max(1, min(n_subjects, math.floor(min(candidates))))
+
+
+def autotune_subjects_per_shard(
+    pre_MEDS_dir: Path,
+    event_cfg: DictConfig,
+    target_rows: int | None = None,
+    target_bytes: int | None = None,
+) -> int:
+    """The number of subjects per shard that meets the shard targets for the pre-MEDS outputs.
+
+    The number of subjects is the row count of ``person_birth_death.parquet``, and events per subject are
+    estimated with :func:`estimate_meds_events`.
+    """
+    birth_death_fp = pre_MEDS_dir / "person_birth_death.parquet"
+    n_subjects = parquet_num_rows(birth_death_fp) if birth_death_fp.is_file() else 0
+    n_events, event_bytes = estimate_meds_events(pre_MEDS_dir, event_cfg)
+    n_subjects_per_shard = choose_subjects_per_shard(
+        n_subjects, n_events, event_bytes, target_rows, target_bytes
+    )
+    logger.info(
+        f"Estimated {n_events} MEDS events ({event_bytes} bytes) for {n_subjects} subjects; using "
+        f"{n_subjects_per_shard} subjects per shard (targets: {target_rows} rows, {target_bytes} bytes)"
+    )
+    return n_subjects_per_shard
+
+
+def write_stage_runner(
+    plan: dict[str, dict[str, int]],
+    out_fp: Path,
+    pipeline_config_fp: str | Path,
+    launcher: str = "joblib",
+) -> Path:
+    """Write a MEDS-Transforms stage runner file for ``plan``.
+
+    Every stage runs via ``MEDS_transform-stage`` with its own ``POLARS_MAX_THREADS``, and stages with more
+    than one worker are parallelized with ``launcher``. The file is accepted as ``stage_runner_fp`` by both
+    ``MEDS_transform-pipeline`` and the in-process runner.
+
+    Examples:
+        >>> import tempfile
+        >>> plan = {"shard_events": {"n_workers": 4, "polars_max_threads": 2}}
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     fp = write_stage_runner(plan, Path(tmpdir) / "runner.yaml", "/cfg/ETL.yaml")
+        ...     print(fp.read_text().strip())
+        parallelize:
+          n_workers: 1
+        shard_events:
+          script: POLARS_MAX_THREADS=2 MEDS_transform-stage /cfg/ETL.yaml shard_events
+          parallelize:
+            n_workers: 4
+            launcher: joblib
+    """
+    runner_cfg = {"parallelize": {"n_workers": 1}}
+    for stage, stage_plan in plan.items():
+        stage_cfg = {
+            "script": (
+                f"POLARS_MAX_THREADS={stage_plan['polars_max_threads']} "
+                f"MEDS_transform-stage {shlex.quote(str(pipeline_config_fp))} {stage}"
+            ),
+            "parallelize": {"n_workers": stage_plan["n_workers"]},
+        }
+        if stage_plan["n_workers"] > 1:
+            stage_cfg["parallelize"]["launcher"] = launcher
+        runner_cfg[stage] = stage_cfg
+
+    out_fp.parent.mkdir(parents=True, exist_ok=True)
+    OmegaConf.save(OmegaConf.create(runner_cfg), out_fp)
+    return out_fp
+
+
+def auto_stage_runner(
+    pre_MEDS_dir: Path,
+    input_prefixes: list[str],
+    pipeline_config_fp: str | Path,
+    out_fp: Path,
+    n_subjects_per_shard: int,
+    max_workers: int | None = None,
+) -> Path:
+    """Size the MEDS-Extract stages for the pre-MEDS inputs and this machine, and write the stage runner file.
+
+    Args:
+        pre_MEDS_dir: The pre-MEDS directory; its ``person_birth_death.parquet`` gives the number of subjects.
+        input_prefixes: The input prefixes of the event conversion config (``<prefix>.parquet`` files).
+        pipeline_config_fp: The MEDS-Extract pipeline config the stages run with.
+        out_fp: Where to write the stage runner file.
+        n_subjects_per_shard: The number of subjects per shard of ``split_and_shard_subjects``.
+        max_workers: An optional cap on the number of workers of any stage.
+    """
+    input_file_bytes = [
+        fp.stat().st_size
+        for fp in (pre_MEDS_dir / f"{prefix}.parquet" for prefix in input_prefixes)
+        if fp.is_file()
+    ]
+    birth_death_fp = pre_MEDS_dir / "person_birth_death.parquet"
+    n_subjects = parquet_num_rows(birth_death_fp) if birth_death_fp.is_file() else 0
+    n_cpus = available_cpus()
+    memory_bytes = available_memory_bytes()
+
+    plan = plan_stage_workers(
+        input_file_bytes,
+        expected_subject_shards(n_subjects, n_subjects_per_shard),
+        n_cpus,
+        memory_bytes,
+        max_workers=max_workers,
+    )
+    logger.info(
+        f"Sized MEDS-Extract stages for {len(input_file_bytes)} input files ({sum(input_file_bytes)} bytes), "
+        f"{n_subjects} subjects, {n_cpus} CPUs and {memory_bytes} bytes of available memory: "
+        + ", ".join(
+            f"{stage}={p['n_workers']}x{p['polars_max_threads']}"
+            for stage, p in plan.items()
+        )
+    )
+    return write_stage_runner(plan, out_fp, pipeline_config_fp)
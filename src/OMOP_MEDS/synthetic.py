@@ -0,0 +1,671 @@
+"""Generate synthetic OMOP CDM datasets of a requested scale, e.g. to test and benchmark the ETL."""
+
+import gzip
+import logging
+from datetime import date, datetime
+from pathlib import Path
+
+import hydra
+import numpy as np
+import polars as pl
+from omegaconf import DictConfig
+from omop_schema.utils import get_schema_loader, pyarrow_to_polars_schema
+from pyarrow import parquet as pq
+
+from . import SYNTHETIC_CFG
+
+logger = logging.getLogger(__name__)
+
+LAYOUTS = ("csv", "csv.gz", "parquet", "sharded")
+CSV_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Mean rows per person of the generated event tables; the counts per person are Poisson distributed.
+DEFAULT_EVENTS_PER_PERSON = {
+    "visit_occurrence": 5,
+    "condition_occurrence": 10,
+    "drug_exposure": 15,
+    "procedure_occurrence": 5,
+    "measurement": 50,
+    "observation": 10,
+    "device_exposure": 1,
+    "specimen": 1,
+    "note": 3,
+}
+# The main concept column of each event table with the domain, vocabulary and share of the concept vocabulary
+# its concepts are drawn from. The other concept columns draw from a small pool of type concepts.
+EVENT_DOMAINS = {
+    "visit_occurrence": ("visit_concept_id", "Visit", "Visit", 0.01),
+    "condition_occurrence": ("condition_concept_id", "Condition", "SNOMED", 0.3),
+    "drug_exposure": ("drug_concept_id", "Drug", "RxNorm", 0.25),
+    "procedure_occurrence": ("procedure_concept_id", "Procedure", "CPT4", 0.12),
+    "measurement": ("measurement_concept_id", "Measurement", "LOINC", 0.15),
+    "observation": ("observation_concept_id", "Observation", "SNOMED", 0.1),
+    "device_exposure": ("device_concept_id", "Device", "SNOMED", 0.03),
+    "specimen": ("specimen_concept_id", "Specimen", "SNOMED", 0.02),
+    "note": ("note_class_concept_id", "Meas Value", "LOINC", 0.02),
+}
+# Mean durations in days of the events with an end time.
+EVENT_DURATION_DAYS = {"visit_occurrence": 2.0, "drug_exposure": 14.0}
+GENDER_CONCEPTS = [(8507, "MALE", "M"), (8532, "FEMALE", "F")]
+RACE_CONCEPTS = [
+    (8527, "White", "5"),
+    (8516, "Black or African American", "3"),
+    (8515, "Asian", "2"),
+]
+ETHNICITY_CONCEPTS = [
+    (38003563, "Hispanic or Latino", "Hispanic"),
+    (38003564, "Not Hispanic or Latino", "Not Hispanic"),
+]
+N_TYPE_CONCEPTS = 20
+# Concept ids from 2 billion are reserved for local (non-standard-vocabulary) concepts in OMOP.
+FIRST_CONCEPT_ID = 2_000_000_000
+# Children per concept in the synthetic concept hierarchy of each domain.
+HIERARCHY_BRANCHING = 8
+
+US_PER_DAY = 86_400 * 1_000_000
+EPOCH = datetime(1970, 1, 1)
+
+
+def _us(d: date) -> int:
+    return int((datetime(d.year, d.month, d.day) - EPOCH).total_seconds()) * 1_000_000
+
+
+class Vocabulary:
+    """The synthetic concepts: a domain per event table, type concepts and the demographic concepts.
+
+    Concepts of a domain form a tree with ``HIERARCHY_BRANCHING`` children per concept, recorded as ``Is a`` /
+    ``Subsumes`` relationships and in ``concept_ancestor``. Event concepts are drawn with Zipf-like frequencies,
+    so a few concepts are common and most are rare, as in real data.
+
+    Examples:
+        >>> vocab = Vocabulary(100)
+        >>> concept = vocab.concept()
+        >>> concept.group_by("domain_id").len().sort("domain_id").rows()  # doctest: +NORMALIZE_WHITESPACE
+        [('Condition', 30), ('Device', 3), ('Drug', 25), ('Ethnicity', 2), ('Gender', 2), ('Meas Value', 2),
+         ('Measurement', 15), ('Observation', 10), ('Procedure', 12), ('Race', 3), ('Specimen', 2),
+         ('Type Concept', 20), ('Visit', 1)]
+        >>> ancestors = vocab.concept_ancestor()
+        >>> first_condition_id = vocab.domains["condition_occurrence"][0]
+        >>> ancestors.filter(pl.col("descendant_concept_id") == first_condition_id + 9).rows()
+        [(2000000001, 2000000010, 2, 2), (2000000002, 2000000010, 1, 1), (2000000010, 2000000010, 0, 0)]
+    """
+
+    def __init__(self, size: int, zipf_exponent: float = 1.1):
+        self.zipf_exponent = zipf_exponent
+        self.domains = {}
+        next_id = FIRST_CONCEPT_ID
+        for table, (_, domain, vocabulary_id, share) in EVENT_DOMAINS.items():
+            n = max(1, round(size * share))
+            self.domains[table] = (next_id, n, domain, vocabulary_id)
+            next_id += n
+        self.type_concept_ids = np.arange(next_id, next_id + N_TYPE_CONCEPTS)
+
+    def sample(self, table: str, n: int, rng: np.random.Generator) -> np.ndarray:
+        """Draw ``n`` concept ids of an event table's domain, the concept of rank ``r`` with weight ``1/r^s``."""
+        first_id, size, _, _ = self.domains[table]
+        weights = 1.0 / np.arange(1, size + 1) ** self.zipf_exponent
+        return first_id + rng.choice(size, size=n, p=weights / weights.sum())
+
+    def sample_type_concepts(self, n: int, rng: np.random.Generator) -> np.ndarray:
+        return rng.choice(self.type_concept_ids, size=n)
+
+    def code(self, table: str, concept_ids: np.ndarray) -> pl.Series:
+        """The concept codes of concepts of an event table's domain, e.g. as source values."""
+        first_id = self.domains[table][0]
+        return (
+            pl.Series(concept_ids - first_id, dtype=pl.Int64)
+            .cast(pl.Utf8)
+            .str.pad_start(7, "0")
+        )
+
+    def concept(self) -> pl.DataFrame:
+        frames = []
+        for table, (first_id, n, domain, vocabulary_id) in self.domains.items():
+            index = pl.int_range(0, n, dtype=pl.Int64, eager=True)
+            frames.append(
+                pl.DataFrame(
+                    {
+                        "concept_id": index + first_id,
+                        "concept_name": f"Synthetic {domain.lower()} concept "
+                        + index.cast(pl.Utf8),
+                        "domain_id": domain,
+                        "vocabulary_id": vocabulary_id,
+                        "concept_class_id": domain,
+                        "concept_code": index.cast(pl.Utf8).str.pad_start(7, "0"),
+                    }
+                )
+            )
+        fixed = []
+        for concept_id in self.type_concept_ids:
+            i = int(concept_id - self.type_concept_ids[0])
+            fixed.append(
+                (
+                    int(concept_id),
+                    f"Synthetic type concept {i}",
+                    "Type Concept",
+                    "Type Concept",
+                    f"T{i}",
+                )
+            )
+        for domain, concepts in [
+            ("Gender", GENDER_CONCEPTS),
+            ("Race", RACE_CONCEPTS),
+            ("Ethnicity", ETHNICITY_CONCEPTS),
+        ]:
+            fixed.extend((c, name, domain, domain, code) for c, name, code in concepts)
+        frames.append(
+            pl.DataFrame(
+                {
+                    "concept_id": [c[0] for c in fixed],
+                    "concept_name": [c[1] for c in fixed],
+                    "domain_id": [c[2] for c in fixed],
+                    "vocabulary_id": [c[3] for c in fixed],
+                    "concept_class_id": [c[2] for c in fixed],
+                    "concept_code": [c[4] for c in fixed],
+                }
+            )
+        )
+        return pl.concat(frames).with_columns(
+            standard_concept=pl.lit("S"),
+            valid_start_date=pl.lit(date(1970, 1, 1)),
+            valid_end_date=pl.lit(date(2099, 12, 31)),
+            invalid_reason=pl.lit(None, dtype=pl.Utf8),
+        )
+
+    def _parents(self) -> tuple[np.ndarray, np.ndarray]:
+        """The (child, parent) concept ids of the domain trees."""
+        children, parents = [], []
+        for first_id, n, _, _ in self.domains.values():
+            index = np.arange(1, n)
+            children.append(first_id + index)
+            parents.append(first_id + (index - 1) // HIERARCHY_BRANCHING)
+        return np.concatenate(children), np.concatenate(parents)
+
+    def concept_relationship(self) -> pl.DataFrame:
+        children, parents = self._parents()
+        concept_ids = self.concept()["concept_id"].to_numpy()
+        return pl.DataFrame(
+            {
+                "concept_id_1": np.concatenate([children, parents, concept_ids]),
+                "concept_id_2": np.concatenate([parents, children, concept_ids]),
+                "relationship_id": ["Is a"] * len(children)
+                + ["Subsumes"] * len(children)
+                + ["Maps to"] * len(concept_ids),
+            }
+        ).with_columns(
+            valid_start_date=pl.lit(date(1970, 1, 1)),
+            valid_end_date=pl.lit(date(2099, 12, 31)),
+            invalid_reason=pl.lit(None, dtype=pl.Utf8),
+        )
+
+    def concept_ancestor(self) -> pl.DataFrame:
+        """The transitive closure of the domain trees, including every concept as its own ancestor."""
+        frames = []
+        for first_id, n, _, _ in self.domains.values():
+            descendants = np.arange(n)
+            ancestors = descendants.copy()
+            level = 0
+            while len(descendants):
+                frames.append(
+                    pl.DataFrame(
+                        {
+                            "ancestor_concept_id": first_id + ancestors,
+                            "descendant_concept_id": first_id + descendants,
+                            "min_levels_of_separation": level,
+                        }
+                    )
+                )
+                has_parent = ancestors > 0
+                descendants = descendants[has_parent]
+                ancestors = (ancestors[has_parent] - 1) // HIERARCHY_BRANCHING
+                level += 1
+        return (
+            pl.concat(frames)
+            .with_columns(max_levels_of_separation=pl.col("min_levels_of_separation"))
+            .sort("descendant_concept_id", "ancestor_concept_id")
+        )
+
+
+class _TableWriter:
+    """Write the chunks of one table in one of the ``LAYOUTS``."""
+
+    def __init__(self, output_dir: Path, table: str, layout: str, schema: pl.Schema):
+        self.schema = schema
+        self.layout = layout
+        self.n_rows = 0
+        self._n_chunks = 0
+        self._file = None
+        if layout == "sharded":
+            self.fp = output_dir / table
+            self.fp.mkdir(parents=True, exist_ok=True)
+        else:
+            self.fp = output_dir / f"{table}.{layout}"
+
+    def write(self, df: pl.DataFrame):
+        if df.height == 0 and self._n_chunks > 0:
+            return
+        if self.layout == "sharded":
+            df.write_parquet(self.fp / f"{self._n_chunks:06d}.parquet")
+        elif self.layout == "parquet":
+            table = df.to_arrow()
+            if self._file is None:
+                self._file = pq.ParquetWriter(self.fp, table.schema)
+            self._file.write_table(table)
+        else:
+            if self._file is None:
+                self._file = (
+                    gzip.open(self.fp, "wb", compresslevel=6)
+                    if self.layout == "csv.gz"
+                    else open(self.fp, "wb")
+                )
+            df.write_csv(
+                self._file,
+                include_header=self._n_chunks == 0,
+                datetime_format=CSV_DATETIME_FORMAT,
+            )
+        self.n_rows += df.height
+        self._n_chunks += 1
+
+    def close(self):
+        if self._n_chunks == 0:
+            self.write(pl.DataFrame(schema=self.schema))
+        if self._file is not None:
+            self._file.close()
+
+
+def _fill_columns(
+    table: str,
+    schema: pl.Schema,
+    columns: dict[str, np.ndarray | pl.Series],
+    start_us: np.ndarray,
+    end_us: np.ndarray,
+    vocab: Vocabulary,
+    rng: np.random.Generator,
+) -> pl.DataFrame:
+    """Build a table from the given columns, generating the remaining columns of its schema by name and type.
+
+    Dates and datetimes are the event's start, or its end for ``*_end_*`` columns; source concept ids are 0 (no
+    matching concept) and other concept ids type concepts; ``*_source_value`` columns of the main concept are its code; other columns are plausible filler.
+    """
+    n = len(start_us)
+    concept_col = EVENT_DOMAINS.get(table, (None,))[0]
+    out = {}
+    for col, dtype in schema.items():
+        if col in columns:
+            out[col] = pl.Series(col, columns[col])
+        elif dtype == pl.Date or isinstance(dtype, pl.Datetime):
+            times = end_us if "_end_" in col else start_us
+            # Whole seconds, as in the CSV layouts.
+            times = times // 1_000_000 * 1_000_000
+            out[col] = pl.Series(col, times).cast(pl.Datetime("us"))
+        elif col.endswith("_source_concept_id"):
+            out[col] = pl.Series(col, np.zeros(n, dtype=np.int64))
+        elif col.endswith("_concept_id"):
+            out[col] = pl.Series(col, vocab.sample_type_concepts(n, rng))
+        elif concept_col and col == concept_col.replace("_concept_id", "_source_value"):
+            out[col] = vocab.code(table, columns[concept_col]).alias(col)
+        elif col == "value_as_number":
+            out[col] = pl.Series(col, rng.normal(100.0, 30.0, n).round(2))
+        elif col in ("provider_id", "care_site_id", "location_id"):
+            out[col] = pl.Series(col, rng.integers(1, 1000, n))
+        elif dtype.is_float():
+            out[col] = pl.Series(col, rng.uniform(0.0, 10.0, n).round(2))
+        elif dtype.is_integer() and not col.endswith("_id"):
+            out[col] = pl.Series(col, rng.integers(1, 31, n))
+        else:
+            out[col] = pl.Series(col, [None] * n)
+    return pl.DataFrame(out).cast(dict(schema))
+
+
+def note_corpus(rng: np.random.Generator, n_chars: int = 1_000_000) -> str:
+    """Pseudo-text that notes are sliced from: words of 1-4 syllables in sentences of 5-20 words."""
+    syllables = np.array(
+        [
+            "pa",
+            "ti",
+            "ent",
+            "car",
+            "di",
+            "ac",
+            "re",
+            "nal",
+            "pul",
+            "mo",
+            "ary",
+            "hem",
+            "os",
+            "is",
+        ]
+    )
+    words = np.array(
+        ["".join(rng.choice(syllables, size=rng.integers(1, 5))) for _ in range(2_000)]
+    )
+    text = []
+    length = 0
+    while length < n_chars:
+        sentence = (
+            " ".join(rng.choice(words, size=rng.integers(5, 21))).capitalize() + ". "
+        )
+        text.append(sentence)
+        length += len(sentence)
+    return "".join(text)
+
+
+def _generate_chunk(
+    writers: dict[str, _TableWriter],
+    schemas: dict[str, pl.Schema],
+    first_person_id: int,
+    n_persons: int,
+    events_per_person: dict[str, float],
+    vocab: Vocabulary,
+    corpus: str,
+    note_length_mean: float,
+    note_length_sigma: float,
+    rng: np.random.Generator,
+    death_fraction: float,
+):
+    """Generate and write the rows of ``n_persons`` persons of every table."""
+    person_id = np.arange(first_person_id, first_person_id + n_persons)
+    birth_us = rng.integers(_us(date(1930, 1, 1)), _us(date(2006, 1, 1)), n_persons)
+    obs_start_us = rng.integers(_us(date(2010, 1, 1)), _us(date(2020, 1, 1)), n_persons)
+    obs_end_us = obs_start_us + rng.integers(30, 8 * 365, n_persons) * US_PER_DAY
+    empty = np.empty(0, dtype=np.int64)
+
+    def ids(table: str, n: int) -> np.ndarray:
+        first = writers[table].n_rows + 1 if table in writers else 1
+        return np.arange(first, first + n)
+
+    if "person" in writers:
+        birth = pl.Series(birth_us).cast(pl.Datetime("us"))
+        gender = rng.choice([c for c, _, _ in GENDER_CONCEPTS], n_persons)
+        writers["person"].write(
+            _fill_columns(
+                "person",
+                schemas["person"],
+                {
+                    "person_id": person_id,
+                    "gender_concept_id": gender,
+                    "year_of_birth": birth.dt.year().cast(pl.Int64),
+                    "month_of_birth": birth.dt.month().cast(pl.Int64),
+                    "day_of_birth": birth.dt.day().cast(pl.Int64),
+                    "race_concept_id": rng.choice(
+                        [c for c, _, _ in RACE_CONCEPTS], n_persons
+                    ),
+                    "ethnicity_concept_id": rng.choice(
+                        [c for c, _, _ in ETHNICITY_CONCEPTS], n_persons
+                    ),
+                    "gender_source_value": np.where(gender == 8507, "M", "F"),
+                    "person_source_value": person_id.astype(str),
+                },
+                birth_us,
+                birth_us,
+                vocab,
+                rng,
+            )
+        )
+    if "observation_period" in writers:
+        writers["observation_period"].write(
+            _fill_columns(
+                "observation_period",
+                schemas["observation_period"],
+                {
+                    "observation_period_id": ids("observation_period", n_persons),
+                    "person_id": person_id,
+                },
+                obs_start_us,
+                obs_end_us,
+                vocab,
+                rng,
+            )
+        )
+    if "death" in writers:
+        died = rng.random(n_persons) < death_fraction
+        writers["death"].write(
+            _fill_columns(
+                "death",
+                schemas["death"],
+                {
+                    "person_id": person_id[died],
+                    "cause_concept_id": vocab.sample(
+                        "condition_occurrence", died.sum(), rng
+                    ),
+                },
+                obs_end_us[died],
+                obs_end_us[died],
+                vocab,
+                rng,
+            )
+        )
+
+    # Visits, in time order per person; the other events happen during a visit of their person if it has any.
+    visit_counts = rng.poisson(events_per_person.get("visit_occurrence", 0), n_persons)
+    visit_person = np.repeat(np.arange(n_persons), visit_counts)
+    visit_start_us = obs_start_us[visit_person] + (
+        rng.random(len(visit_person)) * (obs_end_us - obs_start_us)[visit_person]
+    ).astype(np.int64)
+    order = np.lexsort((visit_start_us, visit_person))
+    visit_start_us = visit_start_us[order]
+    visit_end_us = visit_start_us + (
+        rng.exponential(EVENT_DURATION_DAYS["visit_occurrence"], len(order))
+        * US_PER_DAY
+    ).astype(np.int64)
+    visit_offsets = np.concatenate([[0], np.cumsum(visit_counts)[:-1]])
+    visit_ids = (
+        ids("visit_occurrence", len(order)) if "visit_occurrence" in writers else empty
+    )
+    if "visit_occurrence" in writers:
+        concepts = vocab.sample("visit_occurrence", len(order), rng)
+        writers["visit_occurrence"].write(
+            _fill_columns(
+                "visit_occurrence",
+                schemas["visit_occurrence"],
+                {
+                    "visit_occurrence_id": visit_ids,
+                    "person_id": person_id[visit_person],
+                    "visit_concept_id": concepts,
+                },
+                visit_start_us,
+                visit_end_us,
+                vocab,
+                rng,
+            )
+        )
+
+    for table, (concept_col, _, _, _) in EVENT_DOMAINS.items():
+        if table == "visit_occurrence" or table not in writers:
+            continue
+        counts = rng.poisson(events_per_person.get(table, 0), n_persons)
+        person = np.repeat(np.arange(n_persons), counts)
+        n = len(person)
+        has_visit = (visit_counts[person] > 0) & (len(visit_ids) > 0)
+        visit = visit_offsets[person] + (rng.random(n) * visit_counts[person]).astype(
+            np.int64
+        )
+        visit = np.where(has_visit, visit, 0)
+        in_obs = obs_start_us[person] + (
+            rng.random(n) * (obs_end_us - obs_start_us)[person]
+        ).astype(np.int64)
+        if len(visit_ids):
+            during_visit = visit_start_us[visit] + (
+                rng.random(n) * (visit_end_us - visit_start_us)[visit]
+            ).astype(np.int64)
+            start_us = np.where(has_visit, during_visit, in_obs)
+            visit_occurrence_id = pl.select(
+                pl.when(pl.Series(has_visit)).then(pl.Series(visit_ids[visit]))
+            ).to_series()
+        else:
+            start_us = in_obs
+            visit_occurrence_id = pl.Series([None] * n, dtype=pl.Int64)
+        duration_days = EVENT_DURATION_DAYS.get(table, 1.0)
+        end_us = start_us + (rng.exponential(duration_days, n) * US_PER_DAY).astype(
+            np.int64
+        )
+        columns = {
+            f"{table}_id": ids(table, n),
+            "person_id": person_id[person],
+            concept_col: vocab.sample(table, n, rng),
+            "visit_occurrence_id": visit_occurrence_id,
+        }
+        if table == "note":
+            lengths = np.clip(
+                rng.lognormal(
+                    np.log(note_length_mean) - note_length_sigma**2 / 2,
+                    note_length_sigma,
+                    n,
+                ),
+                1,
+                len(corpus),
+            ).astype(np.int64)
+            offsets = (rng.random(n) * (len(corpus) - lengths)).astype(np.int64)
+            columns["note_text"] = pl.select(
+                pl.lit(corpus).str.slice(pl.Series(offsets), pl.Series(lengths))
+            ).to_series()
+            columns["note_title"] = "Note " + vocab.code(table, columns[concept_col])
+        writers[table].write(
+            _fill_columns(table, schemas[table], columns, start_us, end_us, vocab, rng)
+        )
+
+
+def generate_omop_dataset(
+    output_dir: Path,
+    n_persons: int = 1000,
+    omop_version: float = 5.3,
+    events_per_person: dict[str, float] | None = None,
+    vocabulary_size: int = 10_000,
+    note_length_mean: float = 2_000,
+    note_length_sigma: float = 1.0,
+    layout: str = "csv",
+    persons_per_chunk: int = 100_000,
+    death_fraction: float = 0.05,
+    seed: int = 0,
+) -> dict[str, int]:
+    """Write a synthetic OMOP CDM dataset to ``output_dir``.
+
+    Every table has all columns of the ``omop_schema`` schema of ``omop_version``: the person, observation
+    period, death and event tables (see ``DEFAULT_EVENTS_PER_PERSON``) and the ``concept``,
+    ``concept_relationship`` and ``concept_ancestor`` tables of the synthetic :class:`Vocabulary`. Events fall
+    in visits of their person within the person's observation period.
+
+    The persons are generated ``persons_per_chunk`` at a time, so memory does not grow with ``n_persons``. The
+    output is determined by the arguments: the same seed and chunk size give the same dataset.
+
+    Args:
+        output_dir: The directory to write the tables to.
+        n_persons: The number of persons.
+        omop_version: The OMOP CDM version, 5.3 or 5.4.
+        events_per_person: Mean rows per person of event tables, overriding ``DEFAULT_EVENTS_PER_PERSON``; 0
+            omits a table.
+        vocabulary_size: The number of event concepts, split over the domains of the event tables.
+        note_length_mean: The mean length of the note texts in characters.
+        note_length_sigma: The shape of the log-normal distribution of note text lengths.
+        layout: ``csv``, ``csv.gz`` or ``parquet`` for one ``<table>.<layout>`` file per table, or ``sharded``
+            for a ``<table>/`` directory of parquet files, one per chunk of persons.
+        persons_per_chunk: How many persons are generated at once.
+        death_fraction: The fraction of persons with a death record.
+        seed: The random seed.
+
+    Returns:
+        The number of rows of each table.
+
+    Raises:
+        ValueError: If the layout is unknown.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     rows = generate_omop_dataset(Path(tmpdir), n_persons=20, vocabulary_size=50, layout="sharded",
+        ...                                  persons_per_chunk=8)
+        ...     print(sorted(p.name for p in Path(tmpdir).iterdir())[:4], len(list(Path(tmpdir, "person").iterdir())))
+        ...     print(rows["person"], rows["concept"])
+        ['concept', 'concept_ancestor', 'concept_relationship', 'condition_occurrence'] 3
+        20 78
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout {layout!r}; expected one of {LAYOUTS}")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    events_per_person = {**DEFAULT_EVENTS_PER_PERSON, **(events_per_person or {})}
+    schema_loader = get_schema_loader(float(omop_version))
+
+    def schema(table: str) -> pl.Schema:
+        return pl.Schema(
+            pyarrow_to_polars_schema(schema_loader.get_pyarrow_schema(table))
+        )
+
+    vocab = Vocabulary(vocabulary_size)
+    corpus = (
+        note_corpus(np.random.default_rng([seed]))
+        if events_per_person.get("note", 0)
+        else ""
+    )
+    row_counts = {}
+    for table, build in [
+        ("concept", vocab.concept),
+        ("concept_relationship", vocab.concept_relationship),
+        ("concept_ancestor", vocab.concept_ancestor),
+    ]:
+        writer = _TableWriter(output_dir, table, layout, schema(table))
+        df = build()
+        writer.write(
+            df.select(
+                pl.col(c).cast(d) for c, d in writer.schema.items() if c in df.columns
+            )
+        )
+        writer.close()
+        row_counts[table] = writer.n_rows
+
+    tables = ["person", "observation_period", "death"] + [
+        t for t, m in events_per_person.items() if m > 0
+    ]
+    schemas = {table: schema(table) for table in tables}
+    writers = {
+        table: _TableWriter(output_dir, table, layout, schemas[table])
+        for table in tables
+    }
+    try:
+        for chunk, first in enumerate(range(0, n_persons, persons_per_chunk)):
+            n = min(persons_per_chunk, n_persons - first)
+            _generate_chunk(
+                writers,
+                schemas,
+                first + 1,
+                n,
+                events_per_person,
+                vocab,
+                corpus,
+                note_length_mean,
+                note_length_sigma,
+                np.random.default_rng([seed, chunk]),
+                death_fraction,
+            )
+            logger.info(f"Generated persons {first + 1}-{first + n} of {n_persons}")
+    finally:
+        for writer in writers.values():
+            writer.close()
+    row_counts.update({table: writer.n_rows for table, writer in writers.items()})
+    logger.info(
+        f"Wrote a synthetic OMOP {omop_version} dataset to {output_dir}: {row_counts}"
+    )
+    return row_counts
+
+
+@hydra.main(
+    version_base=None,
+    config_path=str(SYNTHETIC_CFG.parent),
+    config_name=SYNTHETIC_CFG.stem,
+)
+def main(cfg: DictConfig):
+    """Generates a synthetic OMOP dataset (see :func:`generate_omop_dataset`)."""
+    generate_omop_dataset(
+        Path(cfg.output_dir),
+        n_persons=int(cfg.n_persons),
+        omop_version=float(cfg.omop_version),
+        events_per_person=dict(cfg.get("events_per_person") or {}),
+        vocabulary_size=int(cfg.vocabulary_size),
+        note_length_mean=float(cfg.note_length_mean),
+        note_length_sigma=float(cfg.note_length_sigma),
+        layout=str(cfg.layout),
+        persons_per_chunk=int(cfg.persons_per_chunk),
+        death_fraction=float(cfg.death_fraction),
+        seed=int(cfg.seed),
+    )
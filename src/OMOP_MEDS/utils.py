@@ -1,42 +1,351 @@
 import logging
+import shutil
 from pathlib import Path
 
 import polars as pl
+from dftly import Parser
+from MEDS_extract.convert_to_MEDS_events.convert_to_MEDS_events import extract_event
+from MEDS_extract.shard_events.shard_events import retrieve_columns
+from omegaconf import DictConfig, OmegaConf
+
+from .ancestry import ANCESTRY_INDEX_FN
+from .fused_events import (
+    apply_fused_event_configs,
+    code_col,
+    event_names,
+    is_fused_output,
+)
+from .pre_meds_writer import build_schema_manifest
 
 logger = logging.getLogger(__name__)
 
+CODE_VOCABULARY_FN = "code_vocabulary.parquet"
+CODE_INDEX_COL = "code_index"
+
+
+def code_occurrence_counts(data_fps: list[Path]) -> pl.DataFrame:
+    """Count the events per ``code`` and ``table_name`` over MEDS data shards.
+
+    Each shard is reduced to its own partial counts, the shards in parallel on the Polars thread pool, and the
+    partial counts are summed, so no query spans the whole cohort.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     fps = [Path(tmpdir) / "0.parquet", Path(tmpdir) / "1.parquet"]
+        ...     pl.DataFrame({"code": ["A", "A", "B"], "table_name": ["x"] * 3}).write_parquet(fps[0])
+        ...     pl.DataFrame({"code": ["A"], "table_name": ["x"]}).write_parquet(fps[1])
+        ...     code_occurrence_counts(fps).sort("code")
+        shape: (2, 3)
+        ┌──────┬────────────┬──────────────────┐
+        │ code ┆ table_name ┆ occurrence_count │
+        │ ---  ┆ ---        ┆ ---              │
+        │ str  ┆ str        ┆ u32              │
+        ╞══════╪════════════╪══════════════════╡
+        │ A    ┆ x          ┆ 3                │
+        │ B    ┆ x          ┆ 1                │
+        └──────┴────────────┴──────────────────┘
+    """
+    if not data_fps:
+        return pl.DataFrame(
+            schema={
+                "code": pl.String,
+                "table_name": pl.String,
+                "occurrence_count": pl.UInt32,
+            }
+        )
+    partial_counts = pl.collect_all(
+        [
+            pl.scan_parquet(fp)
+            .group_by(["code", "table_name"])
+            .agg(pl.len().alias("occurrence_count"))
+            for fp in data_fps
+        ]
+    )
+    return (
+        pl.concat(partial_counts)
+        .group_by(["code", "table_name"])
+        .agg(pl.col("occurrence_count").sum())
+    )
+
+
+def build_code_vocabulary(code_counts: pl.DataFrame) -> pl.DataFrame:
+    """Number the codes densely from 0, most frequent first and ties broken by code, so the ids are stable.
 
-def finish_codes_metadata(MEDS_cohort_dir: Path, pre_MEDS_dir: Path):
+    Args:
+        code_counts: Occurrence counts per ``code`` (and possibly ``table_name``), see
+            :func:`code_occurrence_counts`.
+
+    Examples:
+        >>> counts = pl.DataFrame({
+        ...     "code": ["B", "A", "C", "A"], "table_name": ["x", "x", "x", "y"], "occurrence_count": [2, 1, 5, 1]
+        ... })
+        >>> build_code_vocabulary(counts)
+        shape: (3, 3)
+        ┌──────┬────────────┬──────────────────┐
+        │ code ┆ code_index ┆ occurrence_count │
+        │ ---  ┆ ---        ┆ ---              │
+        │ str  ┆ i32        ┆ i64              │
+        ╞══════╪════════════╪══════════════════╡
+        │ C    ┆ 0          ┆ 5                │
+        │ A    ┆ 1          ┆ 2                │
+        │ B    ┆ 2          ┆ 2                │
+        └──────┴────────────┴──────────────────┘
+    """
+    return (
+        code_counts.drop_nulls("code")
+        .group_by("code")
+        .agg(pl.col("occurrence_count").cast(pl.Int64).sum())
+        .sort(["occurrence_count", "code"], descending=[True, False])
+        .with_row_index(CODE_INDEX_COL)
+        .select("code", pl.col(CODE_INDEX_COL).cast(pl.Int32), "occurrence_count")
+    )
+
+
+def add_code_index_column(data_fps: list[Path], vocabulary: pl.DataFrame):
+    """Add (or replace) the :data:`CODE_INDEX_COL` column of MEDS data shards from a code vocabulary.
+
+    The shards are rewritten in parallel on the Polars thread pool, each to a temporary file that then replaces
+    it, keeping the row order.
+    """
+    code_index = pl.col("code").replace_strict(
+        vocabulary["code"], vocabulary[CODE_INDEX_COL], return_dtype=pl.Int32
+    )
+    tmp_fps = [fp.with_name(f".{fp.name}.tmp") for fp in data_fps]
+    pl.collect_all(
+        [
+            pl.scan_parquet(fp)
+            .with_columns(code_index.alias(CODE_INDEX_COL))
+            .sink_parquet(tmp_fp, lazy=True)
+            for fp, tmp_fp in zip(data_fps, tmp_fps)
+        ]
+    )
+    for fp, tmp_fp in zip(data_fps, tmp_fps):
+        tmp_fp.replace(fp)
+
+
+def finish_codes_metadata(
+    MEDS_cohort_dir: Path, pre_MEDS_dir: Path, code_index_column: bool = False
+):
     codes_source = pre_MEDS_dir / "codes.parquet"
     codes_dest = MEDS_cohort_dir / "metadata/codes.parquet"
+    data_fps = sorted((MEDS_cohort_dir / "data").glob("**/*.parquet"))
+    collected = code_occurrence_counts(data_fps)
 
     if codes_source.exists():
         MEDS_cohort_dir.mkdir(parents=True, exist_ok=True)
         logger.info(f"Copying codes.parquet from {codes_source} to {codes_dest}")
         # Read metadata and collected codes
         metadata = pl.read_parquet(codes_source)
-        collected = (
-            pl.scan_parquet(MEDS_cohort_dir / "data/**/*.parquet")
-            .select(["code", "table_name"])
-            .group_by(["code", "table_name"])
-            .agg(pl.len().alias("occurrence_count"))
-            .collect()
-        )
-        # Extract base code for alignment
-        collected = collected.with_columns(
+        # Extract base code for alignment, once per distinct code
+        base_codes = collected.select(pl.col("code").unique()).with_columns(
             pl.col("code").str.replace(r"(//start|//end)$", "").alias("base_code")
         )
+        merged = collected.join(base_codes, on="code", how="left")
         metadata = metadata.with_columns(pl.col("code").alias("base_code"))
         # Join to fill metadata for suffixed codes
-        merged = collected.join(metadata, on="base_code", how="left").with_columns(
+        merged = merged.join(metadata, on="base_code", how="left").with_columns(
             pl.col("code")  # keep original code with suffix
         )
         # Save merged codes
         _ensure_parent_dir(codes_dest)
         merged.write_parquet(codes_dest)
+        ancestry_source = pre_MEDS_dir / ANCESTRY_INDEX_FN
+        if ancestry_source.exists():
+            shutil.copy2(ancestry_source, codes_dest.parent / ANCESTRY_INDEX_FN)
     else:
         logger.warning(f"codes.parquet not found in {pre_MEDS_dir}")
 
+    # Integer code ids for tokenization, so downstream models need not re-scan the cohort.
+    vocabulary = build_code_vocabulary(collected)
+    vocabulary_dest = MEDS_cohort_dir / "metadata" / CODE_VOCABULARY_FN
+    _ensure_parent_dir(vocabulary_dest)
+    vocabulary.write_parquet(vocabulary_dest)
+    logger.info(f"Wrote vocabulary of {vocabulary.height} codes to {vocabulary_dest}")
+    if code_index_column:
+        add_code_index_column(data_fps, vocabulary)
+        logger.info(f"Added {CODE_INDEX_COL} to {len(data_fps)} data shards")
+
+
+def present_codes(event_cfg: DictConfig, pre_MEDS_dir: Path) -> pl.LazyFrame:
+    """The distinct codes, without ``//start`` and ``//end`` suffixes, that the pre-MEDS outputs can yield.
+
+    Every event's code expression is evaluated as MEDS-Extract does, but only over the distinct values of the
+    columns it references; tables written as fused events contribute their code columns. Literal codes are
+    included as they are. The result is a superset of the codes in the final MEDS data, since rows MEDS-Extract
+    drops (e.g. for a null time) are not filtered.
+
+    Examples:
+        >>> import tempfile
+        >>> cfg = OmegaConf.create({
+        ...     "subject_id_col": "person_id",
+        ...     "visit": {
+        ...         "start": {"code": 'f"{$vocab}//{$concept}//start"', "time": "$start"},
+        ...         "death": {"code": "MEDS_DEATH", "time": "$end"},
+        ...     },
+        ...     "missing": {"e": {"code": "$c", "time": None}},
+        ... })
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     pl.DataFrame({
+        ...         "person_id": [1, 2, 3], "vocab": ["V", "V", None], "concept": ["1", "1", "2"], "start": [1, 2, 3]
+        ...     }).write_parquet(Path(tmpdir) / "visit.parquet")
+        ...     sorted(present_codes(cfg, Path(tmpdir)).collect()["code"])
+        ['MEDS_DEATH', 'UNK//2', 'V//1']
+    """
+    codes = []
+    for table, table_cfg in event_cfg.items():
+        if table == "subject_id_col":
+            continue
+        table_fp = pre_MEDS_dir / f"{table}.parquet"
+        fps = (
+            [table_fp]
+            if table_fp.is_file()
+            else sorted((pre_MEDS_dir / table).glob("**/*.parquet"))
+        )
+        if not fps:
+            continue
+        lf = pl.scan_parquet(fps)
+        fused = is_fused_output(lf.collect_schema().names(), table_cfg)
+        for name in event_names(table_cfg):
+            code = str(table_cfg[name]["code"])
+            code_cols = sorted(Parser()(code).referenced_columns)
+            if fused:
+                events = lf.select(pl.col(code_col(name)).alias("code"))
+            elif code_cols:
+                events = extract_event(
+                    lf.select(code_cols).unique().with_columns(subject_id=pl.lit(0)),
+                    {"code": code, "time": None},
+                ).select("code")
+            else:
+                events = pl.LazyFrame({"code": [code]})
+            codes.append(events.unique())
+    if not codes:
+        return pl.LazyFrame({"code": []}, schema={"code": pl.String})
+    return (
+        pl.concat(codes)
+        .drop_nulls()
+        .select(pl.col("code").str.replace(r"(//start|//end)$", ""))
+        .unique()
+    )
+
+
+def check_event_config_columns(event_cfg: DictConfig, schema_manifest: dict) -> None:
+    """Check that every column the event config reads exists in the pre-MEDS schema manifest.
+
+    This fails before MEDS-Extract starts instead of inside a ``shard_events`` worker. Input prefixes without a
+    manifest entry are not checked.
+
+    Raises:
+        ValueError: If any input is missing columns, listing them per input prefix.
+
+    Examples:
+        >>> cfg = OmegaConf.create({"subject_id_col": "person_id", "a": {"e": {"code": "$c", "time": "$t"}}})
+        >>> check_event_config_columns(cfg, {"a": {"columns": {"person_id": "Int64", "c": "String", "t": "Date"}}})
+        >>> check_event_config_columns(cfg, {"a": {"columns": {"person_id": "Int64", "c": "String"}}})
+        Traceback (most recent call last):
+            ...
+        ValueError: Pre-MEDS outputs lack columns read by the event config: a: t
+    """
+    missing = {}
+    for prefix, columns in retrieve_columns(event_cfg).items():
+        if prefix not in schema_manifest:
+            continue
+        missing_cols = sorted(set(columns) - set(schema_manifest[prefix]["columns"]))
+        if missing_cols:
+            missing[prefix] = missing_cols
+    if missing:
+        raise ValueError(
+            "Pre-MEDS outputs lack columns read by the event config: "
+            + "; ".join(
+                f"{prefix}: {', '.join(cols)}" for prefix, cols in missing.items()
+            )
+        )
+
+
+def expand_event_config_for_parts(
+    event_cfg: DictConfig, pre_MEDS_dir: Path
+) -> DictConfig:
+    """Give every part file of a directory-backed pre-MEDS table its own event config entry.
+
+    MEDS-Extract keys its inputs by file prefix relative to the pre-MEDS directory, so the parts of a batched
+    table (``pre_MEDS/<table>/part_00000.parquet``) are only picked up, and only processed as independent
+    units of work, if each ``<table>/part_00000`` prefix is configured.
+
+    Examples:
+        >>> import tempfile
+        >>> cfg = OmegaConf.create({"subject_id_col": "person_id", "a": {"e": {"code": "A"}}, "b": {}})
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     root = Path(tmpdir)
+        ...     (root / "a").mkdir()
+        ...     for name in ["part_00001.parquet", "part_00000.parquet"]:
+        ...         (root / "a" / name).touch()
+        ...     print(OmegaConf.to_yaml(expand_event_config_for_parts(cfg, root)))
+        subject_id_col: person_id
+        b: {}
+        a/part_00000:
+          e:
+            code: A
+        a/part_00001:
+          e:
+            code: A
+        <BLANKLINE>
+    """
+    expanded = OmegaConf.create({})
+    part_entries = {}
+    for prefix, table_cfg in event_cfg.items():
+        table_dir = pre_MEDS_dir / prefix
+        parts = sorted(table_dir.glob("**/*.parquet")) if table_dir.is_dir() else []
+        if not parts:
+            expanded[prefix] = table_cfg
+            continue
+        for part in parts:
+            part_prefix = part.relative_to(pre_MEDS_dir).with_suffix("").as_posix()
+            part_entries[part_prefix] = table_cfg
+    for part_prefix, table_cfg in part_entries.items():
+        expanded[part_prefix] = table_cfg
+    return expanded
+
+
+def table_event_config(
+    event_cfg: DictConfig, table: str, pre_MEDS_dir: Path
+) -> DictConfig | None:
+    """The event conversion config MEDS-Extract uses for one finished pre-MEDS table.
+
+    This is the subset of the final config that ``__main__`` builds for all tables: the table's entry, read as
+    fused events if pre-MEDS wrote them and expanded to the table's part files. Only the table's own output
+    files are read, so other tables may still be being written.
+
+    Returns:
+        The config, or ``None`` if the table is not configured or pre-MEDS wrote no output for it.
+
+    Examples:
+        >>> import tempfile
+        >>> cfg = OmegaConf.create({"subject_id_col": "person_id", "a": {"e": {"code": "$c", "time": None}}})
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     root = Path(tmpdir)
+        ...     (root / "a").mkdir()
+        ...     pl.DataFrame({"person_id": [1], "c": ["A"]}).write_parquet(root / "a" / "part_00000.parquet")
+        ...     print(OmegaConf.to_yaml(table_event_config(cfg, "a", root)))
+        ...     print(table_event_config(cfg, "b", root))
+        subject_id_col: person_id
+        a/part_00000:
+          e:
+            code: $c
+            time: null
+        <BLANKLINE>
+        None
+    """
+    if table not in event_cfg or table == "subject_id_col":
+        return None
+    schema_manifest = build_schema_manifest(pre_MEDS_dir, tables=[table])
+    if not schema_manifest:
+        return None
+    table_cfg = OmegaConf.create(
+        {"subject_id_col": event_cfg.subject_id_col, table: event_cfg[table]}
+    )
+    table_cfg = apply_fused_event_configs(table_cfg, schema_manifest)
+    return expand_event_config_for_parts(table_cfg, pre_MEDS_dir)
+
 
 def _ensure_parent_dir(path: Path) -> None:
     """Ensure parent directory exists for a file path."""
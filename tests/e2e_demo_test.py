@@ -1,5 +1,6 @@
 import shutil
 import subprocess
+from collections.abc import Callable
 from pathlib import Path
 from tempfile import TemporaryDirectory
 import os
@@ -9,6 +10,7 @@ from omegaconf import OmegaConf
 
 from OMOP_MEDS.__main__ import main as run_omop_meds
 from OMOP_MEDS import MAIN_CFG
+from OMOP_MEDS.pre_meds_writer import read_subject_rows
 
 DEMO_RESOURCES_DIR = Path(__file__).resolve().parent / "demo_resources"
 
@@ -36,55 +38,92 @@ def _stage_local_demo_omop(raw_input_dir: Path) -> Path:
     return raw_input_dir
 
 
-def test_local_e2e_demo_resources():
+def _run_demo_etl(
+    tmp_path: Path, raw_input_dir: Path | None = None, **overrides
+) -> Path:
+    """Run the ETL in-process on the demo resources below ``tmp_path``, with cfg ``overrides``.
+
+    Returns:
+        The root output directory.
+    """
+    root = (tmp_path / "output").resolve()
+    if raw_input_dir is None:
+        raw_input_dir = _stage_local_demo_omop(tmp_path / "raw_input")
+
+    cfg = OmegaConf.load(MAIN_CFG)
+    cfg.root_output_dir = str(root)
+    cfg.raw_input_dir = str(raw_input_dir.resolve())
+    cfg.pre_MEDS_dir = str(root / "pre_MEDS")
+    cfg.MEDS_cohort_dir = str(root / "MEDS_cohort")
+    cfg.do_download = False
+    cfg.do_demo = False
+    cfg.do_overwrite = True
+    cfg.join_on_visit = False
+    for key, value in overrides.items():
+        cfg[key] = value
+
+    run_omop_meds.__wrapped__(cfg)
+    return root
+
+
+def _read_meds_data(root: Path) -> pl.DataFrame:
+    return pl.read_parquet(root / "MEDS_cohort" / "data" / "**" / "*.parquet").sort(
+        pl.all()
+    )
+
+
+def _assert_matches_standard_extraction(
+    tmp_path: Path,
+    option: str,
+    check: Callable[[Path, bool], None] | None = None,
+    **overrides,
+):
+    """Run the demo ETL with ``option`` off and on and assert both produce the same MEDS data.
+
+    ``check(root, value)`` is called on the output of each run before the comparison.
+    """
+    outputs = {}
+    for value in (False, True):
+        root = _run_demo_etl(
+            tmp_path / f"{option}_{value}", **overrides, **{option: value}
+        )
+        if check is not None:
+            check(root, value)
+        outputs[value] = _read_meds_data(root)
+
+    assert outputs[True].height > 0
+    assert outputs[True].equals(outputs[False])
+
+
+def test_local_e2e_demo_resources(tmp_path: Path):
     """Run a local end-to-end smoke test against the checked-in demo resources."""
-    with (
-        TemporaryDirectory() as output_temp_dir,
-        TemporaryDirectory() as input_temp_dir,
-    ):
-        root = Path(output_temp_dir)
-        raw_input_dir = _stage_local_demo_omop(Path(input_temp_dir) / "raw_input")
-
-        cfg = OmegaConf.load(MAIN_CFG)
-        cfg.root_output_dir = str(root.resolve())
-        cfg.raw_input_dir = str(raw_input_dir.resolve())
-        cfg.pre_MEDS_dir = str((root / "pre_MEDS").resolve())
-        cfg.MEDS_cohort_dir = str((root / "MEDS_cohort").resolve())
-        cfg.do_download = False
-        cfg.do_demo = False
-        cfg.do_overwrite = True
-        cfg.prefer_source = False
-        cfg.join_on_visit = False
-
-        run_omop_meds.__wrapped__(cfg)
+    root = _run_demo_etl(tmp_path, prefer_source=False)
 
-        data_path = root / "MEDS_cohort" / "data"
-        data_files = list(data_path.glob("*.parquet")) + list(
-            data_path.glob("**/*.parquet")
-        )
-        all_files = [x for x in data_path.glob("**/*") if x.is_file()]
+    data_path = root / "MEDS_cohort" / "data"
+    data_files = list(data_path.glob("*.parquet")) + list(
+        data_path.glob("**/*.parquet")
+    )
+    all_files = [x for x in data_path.glob("**/*") if x.is_file()]
 
-        assert len(data_files) > 0, (
-            f"No data files found in {data_path}; found {all_files}"
-        )
+    assert len(data_files) > 0, f"No data files found in {data_path}; found {all_files}"
 
-        metadata_path = root / "MEDS_cohort" / "metadata"
-        all_files = [x for x in metadata_path.glob("**/*") if x.is_file()]
+    metadata_path = root / "MEDS_cohort" / "metadata"
+    all_files = [x for x in metadata_path.glob("**/*") if x.is_file()]
 
-        dataset_metadata = metadata_path / "dataset.json"
-        assert dataset_metadata.exists(), (
-            f"Dataset metadata not found in {metadata_path}; found {all_files}"
-        )
+    dataset_metadata = metadata_path / "dataset.json"
+    assert dataset_metadata.exists(), (
+        f"Dataset metadata not found in {metadata_path}; found {all_files}"
+    )
 
-        codes_metadata = metadata_path / "codes.parquet"
-        assert codes_metadata.exists(), (
-            f"Codes metadata not found in {metadata_path}; found {all_files}"
-        )
+    codes_metadata = metadata_path / "codes.parquet"
+    assert codes_metadata.exists(), (
+        f"Codes metadata not found in {metadata_path}; found {all_files}"
+    )
 
-        subject_splits = metadata_path / "subject_splits.parquet"
-        assert subject_splits.exists(), (
-            f"Subject splits not found in {metadata_path}; found {all_files}"
-        )
+    subject_splits = metadata_path / "subject_splits.parquet"
+    assert subject_splits.exists(), (
+        f"Subject splits not found in {metadata_path}; found {all_files}"
+    )
 
 
 # @pytest.mark.skip(reason="Skip for duration")
@@ -146,3 +185,105 @@ def test_e2e():
         assert subject_splits.exists(), (
             f"Subject splits not found in {metadata_path}; found {all_files}"
         )
+
+
+def _split_table_into_parquet_shards(raw_input_dir: Path, table: str, n_shards: int):
+    """Replace ``<table>.csv`` with a directory of ``n_shards`` parquet shards."""
+    csv_fp = raw_input_dir / f"{table}.csv"
+    df = pl.read_csv(csv_fp, try_parse_dates=True)
+    csv_fp.unlink()
+    table_dir = raw_input_dir / table
+    table_dir.mkdir()
+    shard_size = -(-df.height // n_shards)
+    for i in range(n_shards):
+        df.slice(i * shard_size, shard_size).write_parquet(
+            table_dir / f"{i:012d}.parquet"
+        )
+
+
+def test_local_e2e_batched_table_parts_reach_meds_cohort(tmp_path: Path):
+    """Batched tables written as ``pre_MEDS/<table>/part_*.parquet`` must still be extracted."""
+    raw_input_dir = _stage_local_demo_omop(tmp_path / "raw_input")
+    _split_table_into_parquet_shards(raw_input_dir, "visit_occurrence", 3)
+
+    root = _run_demo_etl(
+        tmp_path,
+        raw_input_dir,
+        pre_meds_chunked_tables=["visit_occurrence"],
+        pre_meds_batching_row_threshold=0,
+        pre_meds_batch_mode="per_shard",
+        pre_meds_compact_parts=False,
+    )
+
+    parts = sorted((root / "pre_MEDS" / "visit_occurrence").glob("*.parquet"))
+    assert len(parts) == 3
+
+    events = _read_meds_data(root)
+    n_visit_events = events.filter(pl.col("table_name") == "visit_occurrence").height
+    n_visits = sum(pl.read_parquet(p).height for p in parts)
+    assert n_visit_events > 0
+    assert n_visit_events <= 2 * n_visits
+
+
+def test_local_e2e_sorted_pre_meds_writes_subject_index(tmp_path: Path):
+    """Sorted pre-MEDS outputs get a row-group subject index and still reach the MEDS cohort."""
+    root = _run_demo_etl(tmp_path, pre_meds_sort_output=True)
+
+    pre_meds_dir = root / "pre_MEDS"
+    visits = pl.read_parquet(pre_meds_dir / "visit_occurrence.parquet")
+    assert visits.equals(
+        visits.sort(["person_id", "visit_start_datetime"], nulls_last=True)
+    )
+
+    subject_index = pl.read_parquet(pre_meds_dir / ".subject_index.parquet")
+    assert "visit_occurrence" in subject_index["table"].to_list()
+    subject_id = visits["person_id"][0]
+    rows = read_subject_rows(
+        pre_meds_dir, subject_index, "visit_occurrence", "person_id", subject_id
+    )
+    assert rows.equals(visits.filter(pl.col("person_id") == subject_id))
+
+    events = _read_meds_data(root)
+    assert events.filter(pl.col("table_name") == "visit_occurrence").height > 0
+
+
+def test_local_e2e_in_process_meds_extract_matches_subprocess(tmp_path: Path):
+    """Running the MEDS-Extract stages in-process must produce the same MEDS data as the subprocess runner."""
+
+    def check(root: Path, in_process: bool):
+        assert (root / "MEDS_cohort" / ".logs" / "_all_stages.done").is_file()
+
+    _assert_matches_standard_extraction(tmp_path, "meds_extract_in_process", check)
+
+
+def test_local_e2e_fused_events_match_standard_extraction(tmp_path: Path):
+    """Extracting events in pre-MEDS must produce the same MEDS data as extracting them in MEDS-Extract."""
+
+    def check(root: Path, fused: bool):
+        visit_cols = pl.read_parquet_schema(
+            root / "pre_MEDS" / "visit_occurrence.parquet"
+        )
+        assert ("code__visit" in visit_cols) == fused
+
+    _assert_matches_standard_extraction(
+        tmp_path, "pre_meds_fused_events", check, meds_extract_in_process=True
+    )
+
+
+def test_local_e2e_overlapped_shard_events_match_standard_extraction(tmp_path: Path):
+    """Sharding each table while pre-MEDS is still running must produce the same MEDS data."""
+
+    def check(root: Path, overlap: bool):
+        overlap_cfgs = root / "pre_MEDS" / ".overlap"
+        assert (overlap_cfgs / "visit_occurrence.yaml").is_file() == overlap
+
+    _assert_matches_standard_extraction(
+        tmp_path, "meds_extract_overlap", check, meds_extract_in_process=True
+    )
+
+
+def test_local_e2e_encoded_categoricals_match_standard_extraction(tmp_path: Path):
+    """Enum-encoding the concept vocabulary columns must not change the MEDS data."""
+    _assert_matches_standard_extraction(
+        tmp_path, "pre_meds_encode_categoricals", meds_extract_in_process=True
+    )
@@ -0,0 +1,159 @@
+from pathlib import Path
+
+import polars as pl
+from omegaconf import OmegaConf
+
+from OMOP_MEDS import MAIN_CFG, pre_meds
+from OMOP_MEDS.ancestry import (
+    ANCESTRY_INDEX_FN,
+    build_ancestry_index,
+    read_ancestry_csr,
+)
+from OMOP_MEDS.pre_meds import run as run_pre_meds
+from OMOP_MEDS.pre_meds_utils import extract_codes_metadata
+from OMOP_MEDS.synthetic import generate_omop_dataset
+from OMOP_MEDS.utils import finish_codes_metadata
+
+
+def test_finish_codes_metadata_merges_shard_counts_onto_base_codes(tmp_path: Path):
+    pre_MEDS_dir = tmp_path / "pre_MEDS"
+    MEDS_cohort_dir = tmp_path / "MEDS_cohort"
+    pre_MEDS_dir.mkdir()
+    pl.DataFrame(
+        {"code": ["VISIT//9201", "LOINC//1"], "description": ["Inpatient", "Lab"]}
+    ).write_parquet(pre_MEDS_dir / "codes.parquet")
+    shards = {
+        "train/0": ["VISIT//9201//start", "VISIT//9201//end", "LOINC//1"],
+        "train/1": ["VISIT//9201//start", "LOINC//1", "LOINC//1"],
+        "held_out/0": ["MEDS_BIRTH"],
+    }
+    for shard, codes in shards.items():
+        fp = MEDS_cohort_dir / "data" / f"{shard}.parquet"
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        pl.DataFrame({"code": codes, "table_name": ["t"] * len(codes)}).write_parquet(
+            fp
+        )
+
+    finish_codes_metadata(MEDS_cohort_dir, pre_MEDS_dir)
+
+    codes = pl.read_parquet(MEDS_cohort_dir / "metadata" / "codes.parquet")
+    assert codes.sort("code").select(
+        "code", "occurrence_count", "description"
+    ).rows() == [
+        ("LOINC//1", 3, "Lab"),
+        ("MEDS_BIRTH", 1, None),
+        ("VISIT//9201//end", 1, "Inpatient"),
+        ("VISIT//9201//start", 2, "Inpatient"),
+    ]
+
+
+def test_extract_codes_metadata_restricted_to_present_codes_matches_full_vocabulary():
+    concept = pl.LazyFrame(
+        {
+            "concept_id": [1, 2, 3],
+            "vocabulary_id": ["SRC", "LOINC", "SRC"],
+            "concept_code": ["a", "1-1", "c"],
+            "concept_name": ["Source A", "Lab", "Source C"],
+        }
+    )
+    concept_relationship = pl.LazyFrame(
+        {
+            "concept_id_1": [1, 3],
+            "concept_id_2": [2, 2],
+            "relationship_id": ["Maps to", "Maps to"],
+        }
+    )
+
+    full = extract_codes_metadata(concept, concept_relationship).collect()
+    restricted = extract_codes_metadata(
+        concept,
+        concept_relationship,
+        codes=pl.LazyFrame({"code": ["SRC//1", "SRC//1", "MEDS_BIRTH"]}),
+    ).collect()
+
+    assert full.height == 3
+    assert restricted.equals(full.filter(pl.col("code") == "SRC//1"))
+    assert restricted.row(0, named=True)["parent_codes"] == ["LOINC//1-1"]
+
+
+def test_ancestry_index_csr_lookups_match_concept_ancestor(tmp_path: Path):
+    concept = pl.LazyFrame(
+        {"concept_id": [1, 2, 3, 4, 5], "vocabulary_id": ["SNOMED"] * 5}
+    )
+    # 1 -> 2 -> 3 and 1 -> 4, with the self-pairs and transitive closure concept_ancestor contains.
+    pairs = [(1, 1, 0), (2, 2, 0), (3, 3, 0), (4, 4, 0), (5, 5, 0)]
+    pairs += [(1, 2, 1), (2, 3, 1), (1, 3, 2), (1, 4, 1)]
+    concept_ancestor = pl.LazyFrame(
+        pairs,
+        schema=[
+            "ancestor_concept_id",
+            "descendant_concept_id",
+            "min_levels_of_separation",
+        ],
+        orient="row",
+    )
+    index_fp = tmp_path / ANCESTRY_INDEX_FN
+
+    build_ancestry_index(
+        concept,
+        concept_ancestor,
+        pl.LazyFrame({"code": ["SNOMED//3", "SNOMED//4", "OTHER//1"]}),
+    ).sink_parquet(index_fp)
+
+    index = pl.read_parquet(index_fp)
+    indptr, indices = read_ancestry_csr(index_fp)
+    concept_ids = index["concept_id"].to_list()
+    ancestors = {
+        concept_ids[i]: sorted(
+            concept_ids[j]
+            for j in indices[indptr[i].as_py() : indptr[i + 1].as_py()].to_pylist()
+        )
+        for i in range(index.height)
+    }
+    assert ancestors == {1: [], 2: [1], 3: [1, 2], 4: [1]}
+
+
+def test_finish_codes_metadata_writes_code_vocabulary_and_index_column(
+    tmp_path: Path,
+):
+    MEDS_cohort_dir = tmp_path / "MEDS_cohort"
+    shards = {"train/0": ["B", "A", "B"], "train/1": ["C", "B", "A"]}
+    for shard, codes in shards.items():
+        fp = MEDS_cohort_dir / "data" / f"{shard}.parquet"
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        pl.DataFrame(
+            {"subject_id": range(len(codes)), "code": codes, "table_name": "t"}
+        ).write_parquet(fp)
+
+    finish_codes_metadata(
+        MEDS_cohort_dir, tmp_path / "pre_MEDS", code_index_column=True
+    )
+
+    vocabulary = pl.read_parquet(
+        MEDS_cohort_dir / "metadata" / "code_vocabulary.parquet"
+    )
+    assert vocabulary.rows() == [("B", 0, 3), ("A", 1, 2), ("C", 2, 1)]
+    shard = pl.read_parquet(MEDS_cohort_dir / "data" / "train" / "1.parquet")
+    assert shard["code"].to_list() == ["C", "B", "A"]
+    assert shard["code_index"].to_list() == [2, 0, 1]
+
+
+def test_resumed_pre_meds_does_not_rescan_present_codes(tmp_path: Path, monkeypatch):
+    generate_omop_dataset(
+        tmp_path / "raw_input", n_persons=20, layout="parquet", vocabulary_size=100
+    )
+    cfg = OmegaConf.load(MAIN_CFG)
+    cfg.root_output_dir = str(tmp_path)
+    run_pre_meds(cfg)
+    codes_fp = tmp_path / "pre_MEDS" / "codes.parquet"
+    codes_mtime = codes_fp.stat().st_mtime_ns
+
+    def fail(*args, **kwargs):
+        raise AssertionError("present_codes should not run when codes.parquet exists")
+
+    monkeypatch.setattr(pre_meds, "present_codes", fail)
+    (tmp_path / "pre_MEDS" / ".done").unlink()
+    cfg.do_overwrite = False
+    run_pre_meds(cfg)
+
+    assert codes_fp.stat().st_mtime_ns == codes_mtime
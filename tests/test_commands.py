@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from OMOP_MEDS import commands
+from OMOP_MEDS.commands import process_tree_rss
+
+
+needs_proc = pytest.mark.skipif(not os.path.isdir("/proc"), reason="needs /proc")
+
+
+@needs_proc
+def test_process_tree_rss_includes_children():
+    before = process_tree_rss(os.getpid())
+    child = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import sys, time; x = bytearray(64 * 1024**2); print(flush=True); time.sleep(30)",
+        ],
+        stdout=subprocess.PIPE,
+    )
+    try:
+        child.stdout.readline()
+        time.sleep(0.1)
+        assert process_tree_rss(os.getpid()) - before >= 64 * 1024**2
+        assert process_tree_rss(child.pid) >= 64 * 1024**2
+    finally:
+        child.kill()
+        child.wait()
+
+
+@needs_proc
+def test_process_tree_rss_walks_only_the_monitored_tree(monkeypatch):
+    tree = {os.getpid(): [101, 102], 101: [103], 102: [], 103: []}
+
+    def scan(pid):
+        raise AssertionError("the whole process table should not be scanned")
+
+    monkeypatch.setattr(commands, "_child_pids", tree.get)
+    monkeypatch.setattr(commands, "_rss_pages", lambda pid: 1)
+    monkeypatch.setattr(commands, "_scan_process_tree", scan)
+
+    assert process_tree_rss(os.getpid()) == 4 * os.sysconf("SC_PAGE_SIZE")
@@ -1,5 +1,9 @@
+import json
+import logging
 import subprocess
+import sys
 
+import pytest
 from omegaconf import OmegaConf
 
 from OMOP_MEDS import ETL_CFG, EVENT_CFG
@@ -37,10 +41,44 @@ def test_event_config_uses_dftly_syntax_not_legacy_col_syntax():
 
 
 def test_run_command_uses_argv_and_env_not_shell():
-    def fake_run(cmd, capture_output, env):
+    def fake_popen(cmd, stdout, stderr, env, text, bufsize):
         assert cmd == ["echo", "ok"]
-        assert capture_output is True
+        assert stdout is subprocess.PIPE
         assert env["OMOP_MEDS_TEST_ENV"] == "1"
-        return subprocess.CompletedProcess(cmd, 0, b"ok", b"")
+        return subprocess.Popen(["echo", "ok"], stdout=stdout, stderr=stderr, text=text)
 
-    run_command(["echo", "ok"], env={"OMOP_MEDS_TEST_ENV": "1"}, runner_fn=fake_run)
+    run_command(["echo", "ok"], env={"OMOP_MEDS_TEST_ENV": "1"}, runner_fn=fake_popen)
+
+
+def test_run_command_streams_output_and_summarizes_stages(tmp_path, caplog):
+    script = (
+        "import sys, time\n"
+        "for stage in ['shard_events', 'merge_to_MEDS_cohort']:\n"
+        "    print(f'Running stage: {stage}', flush=True)\n"
+        "    time.sleep(0.2)\n"
+        "print('x' * 10, file=sys.stderr)\n"
+    )
+    summary_fp = tmp_path / "stage_summary.json"
+
+    with caplog.at_level(logging.INFO, logger="OMOP_MEDS.commands"):
+        run_command([sys.executable, "-c", script], stage_summary_fp=summary_fp)
+
+    assert "xxxxxxxxxx" in caplog.text
+    summary = json.loads(summary_fp.read_text())
+    assert [s["stage"] for s in summary] == ["shard_events", "merge_to_MEDS_cohort"]
+    assert all(s["status"] == "completed" for s in summary)
+    assert all(s["wall_time_s"] >= 0.2 for s in summary)
+
+
+def test_run_command_failure_reports_output_tail(tmp_path):
+    script = "import sys\nfor i in range(1000): print(i)\nsys.exit(3)\n"
+
+    with pytest.raises(ValueError, match="return code 3") as excinfo:
+        run_command(
+            [sys.executable, "-c", script],
+            stage_summary_fp=tmp_path / "stage_summary.json",
+            tail_lines=5,
+        )
+
+    assert "999" in str(excinfo.value)
+    assert "\n994\n" not in str(excinfo.value)
@@ -0,0 +1,222 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import polars as pl
+import polars.selectors as cs
+import pytest
+from omegaconf import DictConfig
+from omop_schema.utils import get_schema_loader
+from polars.testing import assert_frame_equal
+
+from OMOP_MEDS.download import download_data
+from OMOP_MEDS.pre_meds_data_loader import load_raw_file
+from OMOP_MEDS.pre_meds_utils import rename_demo_files
+
+FILES = {
+    "/data/person.csv": b"person_id\n" + b"1\n" * 50_000,
+    "/data/vocab/concept.csv": b"concept_id\n" + b"2\n" * 30_000,
+}
+
+
+class FileServer(ThreadingHTTPServer):
+    """A static file server with directory listings, ``Range`` requests and ETags that logs its requests."""
+
+    def __init__(self, files: dict[str, bytes]):
+        self.files = files
+        self.requests = []
+        super().__init__(("127.0.0.1", 0), FileHandler)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._respond(head=True)
+
+    def do_GET(self):
+        self._respond(head=False)
+
+    def _respond(self, head: bool):
+        files = self.server.files
+        self.server.requests.append(
+            (self.command, self.path, self.headers.get("Range"))
+        )
+        if self.path.endswith("/"):
+            children = {
+                p[len(self.path) :].split("/")[0]
+                + ("/" if "/" in p[len(self.path) :] else "")
+                for p in files
+                if p.startswith(self.path)
+            }
+            if not children:
+                self.send_error(404)
+                return
+            body = "".join(f"<a href='{c}'>{c}</a>" for c in sorted(children)).encode()
+            status, headers = 200, {}
+        elif self.path in files:
+            body = files[self.path]
+            headers = {"ETag": f'"{hashlib.sha256(body).hexdigest()[:16]}"'}
+            status = 200
+            if self.headers.get("Range"):
+                start = int(self.headers["Range"].removeprefix("bytes=").rstrip("-"))
+                headers["Content-Range"] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+                body, status = body[start:], 206
+        else:
+            self.send_error(404)
+            return
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = FileServer(dict(FILES))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _dataset_info(server: FileServer, sha256sums: bool = False) -> DictConfig:
+    url = {"url": f"{server.url}/data/"}
+    if sha256sums:
+        server.files["/SHA256SUMS.txt"] = "".join(
+            f"{hashlib.sha256(body).hexdigest()}  {path.lstrip('/')}\n"
+            for path, body in FILES.items()
+        ).encode()
+        url["sha256sums"] = f"{server.url}/SHA256SUMS.txt"
+    return DictConfig({"urls": {"dataset": [url]}})
+
+
+def _get_requests(server: FileServer) -> list[tuple[str, str | None]]:
+    return [(path, rng) for method, path, rng in server.requests if method == "GET"]
+
+
+def test_download_data_fetches_listing_concurrently(tmp_path: Path, server):
+    download_data(tmp_path, _dataset_info(server, sha256sums=True), n_workers=4)
+
+    assert (tmp_path / "person.csv").read_bytes() == FILES["/data/person.csv"]
+    assert (tmp_path / "vocab" / "concept.csv").read_bytes() == FILES[
+        "/data/vocab/concept.csv"
+    ]
+    assert not list(tmp_path.rglob("*.part"))
+
+
+@pytest.mark.parametrize("sha256sums", [True, False])
+def test_download_data_skips_complete_files(tmp_path: Path, server, sha256sums):
+    dataset_info = _dataset_info(server, sha256sums=sha256sums)
+    download_data(tmp_path, dataset_info, n_workers=2)
+    server.requests.clear()
+
+    download_data(tmp_path, dataset_info, n_workers=2)
+
+    downloaded = {path for path, _ in _get_requests(server)}
+    assert not downloaded & set(FILES)
+
+
+def test_download_data_resumes_partial_files(tmp_path: Path, server):
+    body = FILES["/data/person.csv"]
+    (tmp_path / ".person.csv.part").write_bytes(body[:1000])
+
+    download_data(tmp_path, _dataset_info(server, sha256sums=True), n_workers=2)
+
+    assert ("/data/person.csv", "bytes=1000-") in _get_requests(server)
+    assert (tmp_path / "person.csv").read_bytes() == body
+
+
+def test_download_data_rejects_checksum_mismatch(tmp_path: Path, server):
+    dataset_info = _dataset_info(server, sha256sums=True)
+    server.files["/data/person.csv"] = b"tampered"
+
+    with pytest.raises(ValueError, match="Failed to download data from"):
+        download_data(tmp_path, dataset_info, n_workers=2)
+
+    assert not (tmp_path / "person.csv").exists()
+    assert not (tmp_path / ".person.csv.part").exists()
+    assert (tmp_path / "vocab" / "concept.csv").is_file()
+
+
+@pytest.mark.parametrize("sha256sums", [True, False])
+def test_download_data_links_files_from_mirror(tmp_path: Path, server, sha256sums):
+    dataset_info = _dataset_info(server, sha256sums=sha256sums)
+    dataset_info.download_mirror = str(tmp_path / "mirror")
+    download_data(tmp_path / "a", dataset_info, n_workers=2)
+    server.requests.clear()
+
+    download_data(tmp_path / "b", dataset_info, n_workers=2)
+
+    assert server.requests == []
+    for path, body in FILES.items():
+        fp = tmp_path / "b" / path.removeprefix("/data/")
+        downloaded_fp = tmp_path / "a" / path.removeprefix("/data/")
+        assert fp.read_bytes() == body
+        assert fp.samefile(downloaded_fp)
+        assert downloaded_fp.stat().st_mode & 0o200
+
+
+DEATH_CSV = (
+    b"person_id,death_date,death_datetime,death_type_concept_id\n"
+    b"1,2020-01-02,2020-01-02 10:00:00,32817\n2,2021-03-04,,32817\n"
+)
+
+
+@pytest.mark.parametrize("delete_csv", [True, False])
+def test_download_data_converts_tables_to_parquet(tmp_path: Path, server, delete_csv):
+    server.files["/data/2b_death.csv"] = DEATH_CSV
+    schema_loader = get_schema_loader(5.3)
+    output_dir = tmp_path / "raw_input"
+
+    download_data(
+        output_dir,
+        _dataset_info(server),
+        n_workers=2,
+        schema_loader=schema_loader,
+        delete_csv=delete_csv,
+    )
+
+    for path in ["/data/2b_death.csv", "/data/person.csv", "/data/vocab/concept.csv"]:
+        csv_fp = output_dir / path.removeprefix("/data/")
+        want_fp = tmp_path / "want" / csv_fp.name.removeprefix("2b_")
+        want_fp.parent.mkdir(exist_ok=True)
+        want_fp.write_bytes(server.files[path])
+        want = load_raw_file(want_fp, schema_loader, cs.all()).collect()
+        assert_frame_equal(pl.read_parquet(csv_fp.with_suffix(".parquet")), want)
+        assert csv_fp.exists() is not delete_csv
+    assert not list(output_dir.rglob(".*.part"))
+
+    server.requests.clear()
+    download_data(output_dir, _dataset_info(server), schema_loader=schema_loader)
+    assert not {path for path, _ in _get_requests(server)} & set(server.files)
+
+
+@pytest.mark.parametrize("to_parquet", [True, False])
+def test_download_data_skips_renamed_demo_files(tmp_path: Path, server, to_parquet):
+    server.files["/data/2b_death.csv"] = DEATH_CSV
+    output_dir = tmp_path / "raw_input"
+    kwargs = (
+        {"schema_loader": get_schema_loader(5.3), "delete_csv": True}
+        if to_parquet
+        else {}
+    )
+    suffix = ".parquet" if to_parquet else ".csv"
+
+    for _ in range(2):
+        server.requests.clear()
+        download_data(output_dir, _dataset_info(server), **kwargs)
+        rename_demo_files(output_dir)
+
+        assert sorted(p.name for p in output_dir.glob("*death*")) == [f"death{suffix}"]
+    assert "/data/2b_death.csv" not in {path for path, _ in _get_requests(server)}
@@ -0,0 +1,40 @@
+import json
+
+from OMOP_MEDS.microbenchmarks import (
+    BENCHMARKS,
+    benchmark_cases,
+    results_table,
+    run_microbenchmarks,
+)
+
+GRID = {"rows": [500], "concept_size": [100], "note_length_mean": [50], "shards": [3]}
+
+
+def test_run_microbenchmarks_covers_all_benchmarks():
+    results = run_microbenchmarks(GRID, repeats=1, isolate=False)
+
+    results = json.loads(json.dumps(results))
+    assert {"commit", "polars", "numpy", "python"} <= set(results)
+    assert [(r["benchmark"], r["params"]) for r in results["results"]] == [
+        (name, params) for name, params in benchmark_cases(GRID)
+    ]
+    assert {r["benchmark"] for r in results["results"]} == set(BENCHMARKS)
+    for r in results["results"]:
+        assert r["rows"] == 500
+        assert r["median_s"] > 0 and r["rows_per_s"] > 0
+        assert r["peak_rss_bytes"] > 0
+
+    table = results_table(results, baseline=results)
+    assert table.height == len(results["results"])
+    assert (table["speedup"] == 1.0).all()
+
+
+def test_run_microbenchmarks_isolated():
+    results = run_microbenchmarks(
+        {"rows": [200], "prefer_source": [True]},
+        benchmarks=["determine_concept_id"],
+        repeats=1,
+    )
+
+    [result] = results["results"]
+    assert result["params"] == {"rows": 200, "prefer_source": True}
@@ -0,0 +1,55 @@
+import logging
+import subprocess
+import sys
+from pathlib import Path
+
+import polars as pl
+from omegaconf import OmegaConf
+
+from OMOP_MEDS import MAIN_CFG
+from OMOP_MEDS.pre_meds import run as run_pre_meds
+from OMOP_MEDS.pre_meds_budget import ResourceBudget
+from OMOP_MEDS.synthetic import generate_omop_dataset
+
+
+def test_importing_pre_meds_does_not_mutate_environment():
+    # Polars itself may tune its allocator through the environment on import; only POLARS_* settings matter.
+    code = (
+        "import os; import polars; "
+        "before = {k: v for k, v in os.environ.items() if k.startswith('POLARS_')}; "
+        "import OMOP_MEDS.pre_meds; "
+        "after = {k: v for k, v in os.environ.items() if k.startswith('POLARS_')}; "
+        "assert after == before, (before, after)"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_budget_scope_restores_streaming_chunk_size():
+    before = pl.Config.state()["POLARS_STREAMING_CHUNK_SIZE"]
+    n_workers, worker_budget = ResourceBudget(4, "auto", chunk_bytes=1024**2).split(2)
+
+    with worker_budget.scope(row_width=64):
+        assert pl.Config.state()["POLARS_STREAMING_CHUNK_SIZE"] == str(
+            1024**2 // 2 // 64
+        )
+
+    assert n_workers == 2
+    assert worker_budget.n_threads == 2
+    assert pl.Config.state()["POLARS_STREAMING_CHUNK_SIZE"] == before
+
+
+def test_pre_meds_threads_sizes_the_polars_thread_pool(tmp_path: Path, caplog):
+    generate_omop_dataset(
+        tmp_path / "raw_input", n_persons=20, layout="parquet", vocabulary_size=100
+    )
+    cfg = OmegaConf.load(MAIN_CFG)
+    cfg.root_output_dir = str(tmp_path)
+    cfg.pre_meds_threads = pl.thread_pool_size() + 1
+    done = []
+
+    with caplog.at_level(logging.INFO):
+        run_pre_meds(cfg, on_table_done=done.append)
+
+    assert f"Polars thread pool: {pl.thread_pool_size() + 1} threads" in caplog.text
+    assert (tmp_path / "pre_MEDS" / "measurement.parquet").is_file()
+    assert "measurement" in done
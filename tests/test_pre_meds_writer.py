@@ -0,0 +1,122 @@
+from pathlib import Path
+
+import polars as pl
+import pytest
+from pyarrow import parquet as pq
+
+from OMOP_MEDS.pre_meds_writer import (
+    compact_parquet_parts,
+    parquet_num_rows,
+    polars_sink_kwargs,
+    resolve_dtype_policy,
+    resolve_parquet_profile,
+    sink_parquet_with_dtype_policy,
+)
+
+
+def _write_parts(parts_dir: Path, row_counts: list[int]) -> pl.DataFrame:
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    frames = []
+    offset = 0
+    for idx, n_rows in enumerate(row_counts):
+        df = pl.DataFrame(
+            {
+                "person_id": list(range(offset, offset + n_rows)),
+                "value": [float(i) for i in range(n_rows)],
+            }
+        )
+        df.write_parquet(parts_dir / f"part_{idx:05d}.parquet")
+        frames.append(df)
+        offset += n_rows
+    return pl.concat(frames)
+
+
+def test_compact_parquet_parts_merges_tiny_parts(tmp_path: Path):
+    expected = _write_parts(tmp_path, [5] * 20)
+
+    parts = compact_parquet_parts(tmp_path, target_file_bytes=1024**3)
+
+    assert [p.name for p in parts] == ["part_00000.parquet"]
+    assert pl.read_parquet(parts[0]).equals(expected)
+
+
+def test_compact_parquet_parts_splits_large_parts_evenly(tmp_path: Path):
+    expected = _write_parts(tmp_path, [50_000, 10])
+    total_bytes = sum(p.stat().st_size for p in tmp_path.glob("part_*.parquet"))
+
+    parts = compact_parquet_parts(
+        tmp_path, target_file_bytes=total_bytes // 4, row_group_size=1_000, n_workers=3
+    )
+
+    row_counts = [parquet_num_rows(p) for p in parts]
+    assert len(parts) >= 4
+    assert max(row_counts) - min(row_counts) <= 1
+    assert not (tmp_path / ".compacted").exists()
+    assert pl.concat([pl.read_parquet(p) for p in parts]).equals(expected)
+
+
+def test_compact_parquet_parts_applies_output_profile(tmp_path: Path):
+    _write_parts(tmp_path, [100] * 4)
+    profile = resolve_parquet_profile(
+        "measurement", {"measurement": {"compression": "lz4", "row_group_size": 150}}
+    )
+
+    parts = compact_parquet_parts(
+        tmp_path, target_file_bytes=1024**3, **polars_sink_kwargs(profile)
+    )
+
+    metadata = pq.ParquetFile(parts[0]).metadata
+    assert metadata.num_row_groups == 3
+    assert metadata.row_group(0).column(0).compression == "LZ4"
+
+
+@pytest.mark.parametrize("policy", [None, {"values": "Float32"}, {"ids": "Int32"}])
+def test_sink_parquet_with_dtype_policy_raises_plan_errors(tmp_path: Path, policy):
+    lf = pl.LazyFrame({"person_id": [1], "unit_concept_id": [2], "code": ["x"]})
+    lf = lf.with_columns(pl.col("code").cast(pl.Int64, strict=True))
+
+    with pytest.raises(pl.exceptions.InvalidOperationError):
+        sink_parquet_with_dtype_policy(lf, tmp_path / "t.parquet", policy)
+
+
+def test_sink_parquet_with_dtype_policy_keeps_link_ids(tmp_path: Path):
+    lf = pl.LazyFrame(
+        {
+            "person_id": [1, 2],
+            "visit_occurrence_id": [2**40, 3],
+            "measurement_concept_id": [3, 4],
+            "value_as_number": [1.5, 2.5],
+        }
+    )
+    fp = tmp_path / "t.parquet"
+
+    n = sink_parquet_with_dtype_policy(lf, fp, {"ids": "Int32", "values": "Float32"})
+
+    assert n == 2
+    assert dict(pl.read_parquet_schema(fp)) == {
+        "person_id": pl.Int64,
+        "visit_occurrence_id": pl.Int64,
+        "measurement_concept_id": pl.Int32,
+        "value_as_number": pl.Float32,
+    }
+
+
+def test_sink_parquet_with_dtype_policy_runs_the_plan_once(tmp_path: Path):
+    n_runs = []
+
+    def count_run(df: pl.DataFrame) -> pl.DataFrame:
+        n_runs.append(df.height)
+        return df
+
+    lf = pl.LazyFrame({"person_id": [1, 2], "unit_concept_id": [3, 4]}).map_batches(
+        count_run
+    )
+    policy = resolve_dtype_policy(
+        {"ids": "Int32"}, pl.LazyFrame({"concept_id": [0, 10]})
+    )
+
+    n = sink_parquet_with_dtype_policy(lf, tmp_path / "t.parquet", policy)
+
+    assert n == 2
+    assert n_runs == [2]
+    assert pl.read_parquet_schema(tmp_path / "t.parquet")["unit_concept_id"] == pl.Int32
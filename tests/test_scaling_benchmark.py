@@ -0,0 +1,38 @@
+import json
+from pathlib import Path
+
+from OMOP_MEDS.scaling_benchmark import results_table, run_scaling_benchmark
+
+
+def test_run_scaling_benchmark(tmp_path: Path):
+    kwargs = {
+        "scales": [40],
+        "grid": {"N_WORKERS": [1], "meds_extract_in_process": [True]},
+        "dataset": {"layout": "parquet", "vocabulary_size": 200},
+    }
+    results = run_scaling_benchmark(tmp_path, **kwargs)
+
+    results = json.loads(json.dumps(results))
+    [result] = results["results"]
+    assert result["status"] == "completed", (
+        tmp_path / "runs" / "40_persons" / "0" / "etl.log"
+    ).read_text()
+    assert result["n_persons"] == 40
+    assert result["config"] == {"N_WORKERS": 1, "meds_extract_in_process": True}
+    stages = [s["stage"] for s in result["stages"]]
+    assert stages[0] == "pre_MEDS"
+    assert "shard_events" in stages and "finalize_MEDS_data" in stages
+    assert result["meds_events"] > 0
+    assert result["MEDS_bytes"] > 0 and result["pre_MEDS_bytes"] > 0
+    assert not (tmp_path / "runs" / "40_persons" / "0" / "output").exists()
+
+    table = results_table(results)
+    assert table["meds_events"].to_list() == [result["meds_events"]]
+    assert {"pre_MEDS_s", "shard_events_s"} <= set(table.columns)
+
+    # The dataset is reused by a rerun with the same parameters.
+    dataset_info_fp = tmp_path / "data" / "40_persons" / ".dataset.json"
+    mtime = dataset_info_fp.stat().st_mtime_ns
+    rerun = run_scaling_benchmark(tmp_path, **kwargs)
+    assert dataset_info_fp.stat().st_mtime_ns == mtime
+    assert rerun["results"][0]["meds_events"] == result["meds_events"]
@@ -0,0 +1,66 @@
+from pathlib import Path
+
+import polars as pl
+from omegaconf import OmegaConf
+
+from OMOP_MEDS import stage_runner
+
+
+def test_auto_stage_runner_sizes_stages_from_pre_meds_inputs(
+    tmp_path: Path, monkeypatch
+):
+    monkeypatch.setattr(stage_runner, "available_cpus", lambda: 8)
+    monkeypatch.setattr(stage_runner, "available_memory_bytes", lambda: 64 * 1024**3)
+    pl.DataFrame({"person_id": list(range(45_000))}).write_parquet(
+        tmp_path / "person_birth_death.parquet"
+    )
+    for prefix in ["measurement/part_00000", "measurement/part_00001", "person"]:
+        (tmp_path / prefix).parent.mkdir(parents=True, exist_ok=True)
+        pl.DataFrame({"person_id": [1, 2, 3]}).write_parquet(
+            tmp_path / f"{prefix}.parquet"
+        )
+
+    runner_fp = stage_runner.auto_stage_runner(
+        tmp_path,
+        ["measurement/part_00000", "measurement/part_00001", "person", "death"],
+        "/cfg/ETL.yaml",
+        tmp_path / ".logs" / "stage_runner.yaml",
+        n_subjects_per_shard=10_000,
+    )
+
+    runner_cfg = OmegaConf.load(runner_fp)
+    assert runner_cfg.shard_events.parallelize == {"n_workers": 3, "launcher": "joblib"}
+    assert runner_cfg.shard_events.script.startswith("POLARS_MAX_THREADS=2 ")
+    # 5 train shards plus tuning and held-out.
+    assert runner_cfg.convert_to_MEDS_events.parallelize.n_workers == 7
+    assert runner_cfg.convert_to_MEDS_events.script.startswith("POLARS_MAX_THREADS=1 ")
+    assert runner_cfg.split_and_shard_subjects.parallelize == {"n_workers": 1}
+    assert runner_cfg.split_and_shard_subjects.script == (
+        "POLARS_MAX_THREADS=8 MEDS_transform-stage /cfg/ETL.yaml split_and_shard_subjects"
+    )
+
+
+def test_autotune_subjects_per_shard_targets_events_per_shard(tmp_path: Path):
+    pl.DataFrame({"person_id": list(range(1_000))}).write_parquet(
+        tmp_path / "person_birth_death.parquet"
+    )
+    # 50 measurement rows with two events each: 100 events per subject.
+    pl.DataFrame({"person_id": [i // 50 for i in range(50_000)]}).write_parquet(
+        tmp_path / "measurement.parquet"
+    )
+    event_cfg = OmegaConf.create(
+        {
+            "subject_id_col": "person_id",
+            "measurement": {
+                "value": {"code": "M", "time": "$t"},
+                "unit": {"code": "U", "time": "$t"},
+            },
+        }
+    )
+
+    assert (
+        stage_runner.autotune_subjects_per_shard(
+            tmp_path, event_cfg, target_rows=25_000
+        )
+        == 250
+    )
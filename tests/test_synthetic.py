@@ -0,0 +1,77 @@
+from pathlib import Path
+
+import polars as pl
+import pytest
+from omop_schema.utils import get_schema_loader
+from polars.testing import assert_frame_equal
+
+from OMOP_MEDS.pre_meds_data_loader import ShardedTableDataLoader, load_raw_file
+from OMOP_MEDS.pre_meds_utils import get_table_path
+from OMOP_MEDS.synthetic import LAYOUTS, generate_omop_dataset
+
+SCALE = {"n_persons": 60, "vocabulary_size": 200, "persons_per_chunk": 25}
+
+
+def _load_tables(
+    input_dir: Path, tables: list[str], omop_version: float
+) -> dict[str, pl.DataFrame]:
+    schema_loader = get_schema_loader(omop_version)
+    return {
+        table: load_raw_file(get_table_path(input_dir, table), schema_loader).collect()
+        for table in tables
+    }
+
+
+@pytest.mark.parametrize("omop_version", [5.3, 5.4])
+def test_generate_omop_dataset_layouts_load_identically(tmp_path: Path, omop_version):
+    loaded = {}
+    for layout in LAYOUTS:
+        rows = generate_omop_dataset(
+            tmp_path / layout, omop_version=omop_version, layout=layout, **SCALE
+        )
+        loaded[layout] = _load_tables(tmp_path / layout, list(rows), omop_version)
+        assert {t: df.height for t, df in loaded[layout].items()} == rows
+
+    schema_loader = get_schema_loader(omop_version)
+    for table, df in loaded["csv"].items():
+        assert df.columns == schema_loader.get_pyarrow_schema(table).names
+        for layout in LAYOUTS[1:]:
+            assert_frame_equal(loaded[layout][table], df)
+
+    person = loaded["csv"]["person"]
+    assert person["person_id"].to_list() == list(range(1, SCALE["n_persons"] + 1))
+    events = loaded["csv"]["measurement"].join(
+        loaded["csv"]["visit_occurrence"], on="visit_occurrence_id"
+    )
+    assert (events["person_id"] == events["person_id_right"]).all()
+    assert (
+        events["measurement_datetime"].is_between(
+            events["visit_start_datetime"], events["visit_end_datetime"]
+        )
+    ).all()
+
+
+def test_generate_omop_dataset_is_deterministic(tmp_path: Path):
+    for name, seed in [("a", 1), ("b", 1), ("c", 2)]:
+        generate_omop_dataset(tmp_path / name, layout="parquet", seed=seed, **SCALE)
+    a, b, c = (
+        _load_tables(tmp_path / name, ["measurement", "note"], 5.3) for name in "abc"
+    )
+    for table in a:
+        assert_frame_equal(a[table], b[table])
+        assert not a[table].equals(c[table])
+
+
+def test_generate_omop_dataset_sharded_layout_batches(tmp_path: Path):
+    rows = generate_omop_dataset(tmp_path, layout="sharded", **SCALE)
+    loader = ShardedTableDataLoader(
+        get_schema_loader(5.3),
+        chunked_tables=["measurement"],
+        batching_row_threshold=0,
+        batch_mode="per_shard",
+    )
+
+    batches = list(loader.iter_table_batches("measurement", tmp_path / "measurement"))
+
+    assert len(batches) == 3
+    assert sum(b.collect().height for b in batches) == rows["measurement"]